@@ -0,0 +1,76 @@
+__copyright__ = """
+Copyright 2011 James Lindstorff
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import binascii
+import errno
+import os
+import os.path
+import tempfile
+
+
+def isTemporary(filename):
+    """
+    Check if a filename is the name of the temporary file of an AtomicFile.
+    """
+    basename = os.path.basename(filename)
+    return basename.startswith(".") and basename.endswith(".tmp")
+
+
+class AtomicFile(object):
+    """
+    File written to a temporary file in the directory of the file, which
+    replaces the file when it's closed, so readers of the file, like a web
+    server, never see a partially written file. Attributes other than close
+    and discard are those of the temporary file.
+    """
+    def __init__(self, filename, mode = "wb", buffering = -1):
+        """
+        Open the temporary file for the filename with the mode and buffering
+        of open. The temporary file is created with the permissions of new
+        files under the current umask, unlike the owner only permissions of
+        mkstemp, so the file keeps them when it replaces the file.
+        """
+        self.filename = filename
+        directory = os.path.dirname(os.path.abspath(filename))
+        prefix = os.path.join(directory, "." + os.path.basename(filename) + ".")
+        flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+        for attempt in xrange(tempfile.TMP_MAX):
+            self.temporary = prefix + binascii.hexlify(os.urandom(6)) + ".tmp"
+            try:
+                fd = os.open(self.temporary, flags, 0666)
+                break
+            except OSError as error:
+                if(errno.EEXIST != error.errno):
+                    raise
+        else:
+            raise IOError(errno.EEXIST, "No free temporary file name", prefix)
+        self._file = os.fdopen(fd, mode, buffering)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def close(self):
+        """
+        Close the temporary file and replace the file with it.
+        """
+        self._file.close()
+        os.rename(self.temporary, self.filename)
+
+    def discard(self):
+        """
+        Close and remove the temporary file, leaving the file as it was.
+        """
+        self._file.close()
+        os.remove(self.temporary)
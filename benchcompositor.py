@@ -0,0 +1,93 @@
+__copyright__ = """
+Copyright 2011 James Lindstorff
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import random
+import sys
+import time
+from optparse import OptionParser
+from PIL import Image
+from compositor import COMPOSITORS
+from compositor import compositorSupported
+from compositor import createCompositor
+
+
+ICON_SIZES = (16, 24, 32, 48, 64)
+MODES = ("RGBA", "RGB", "L", "P")
+
+
+def iconImages(count, mode, seed = 0):
+    """
+    Create count decoded icons of the mode, with sizes picked from
+    ICON_SIZES, placed in rows of a sprite 100 of the largest icons wide.
+    Return: ((width, height) of the sprite, list of (image, (x, y)))
+    """
+    rnd = random.Random(seed)
+    step = max(ICON_SIZES)
+    placed = []
+    for index in xrange(count):
+        size = rnd.choice(ICON_SIZES)
+        image = Image.new("RGBA", (size, size), (rnd.randrange(256), rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)))
+        if("P" == mode):
+            image = image.convert("RGB").convert("P")
+        elif("RGBA" != mode):
+            image = image.convert(mode)
+        placed.append((image, (step * (index % 100), step * (index // 100))))
+    return ((step * min(count, 100), step * ((count + 99) // 100)), placed)
+
+
+def benchmark(name, size, placed, repeat):
+    """
+    Composite the placed images with the compositor repeat times.
+    Return: (fastest seconds, RGBA pixels of the sprite)
+    """
+    best = None
+    for run in xrange(repeat):
+        start = time.time()
+        compositor = createCompositor(name, size)
+        for (image, position) in placed:
+            compositor.paste(image, position)
+        sprite = compositor.image()
+        elapsed = time.time() - start
+        if(best is None or elapsed < best):
+            best = elapsed
+    return (best, sprite.tobytes())
+
+
+def main():
+    parser = OptionParser(usage = "usage: %prog [options] [count ...]", description = "Benchmark the compositors pasting decoded icons of each mode into a sprite. Decoding isn't timed. (Default count: 20000)")
+    parser.add_option("-r", "--repeat", dest="repeat", type="int", default=3, help="Number of times each compositor runs, keeping the fastest run. (Default: 3)")
+    (options, args) = parser.parse_args()
+    try:
+        counts = [int(arg) for arg in args] or [20000]
+    except ValueError:
+        parser.error("Counts must be integers")
+    compositors = [name for name in sorted(COMPOSITORS.keys()) if compositorSupported(name)]
+    print str.format("{0:<8} {1:<5} {2:<10} {3:>8} {4:>14}", "Count", "Mode", "Compositor", "Seconds", "Images/s")
+    for count in counts:
+        for mode in MODES:
+            (size, placed) = iconImages(count, mode)
+            pixels = None
+            for name in compositors:
+                (seconds, sprite) = benchmark(name, size, placed, options.repeat)
+                if((not pixels is None) and sprite != pixels):
+                    print str.format("The {0} compositor drew different pixels for {1}", name, mode)
+                    sys.exit(1)
+                pixels = sprite
+                print str.format("{0:<8} {1:<5} {2:<10} {3:>8.3f} {4:>14.0f}", count, mode, name, seconds, count / max(seconds, 1e-9))
+                sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
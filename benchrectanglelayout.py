@@ -0,0 +1,371 @@
+__copyright__ = """
+Copyright 2011 James Lindstorff
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import json
+import multiprocessing
+import os
+import os.path
+import random
+import sys
+import time
+from optparse import OptionParser
+from instrumentation import peakMemory
+from rectanglelayout import LAYOUTS
+from rectanglelayout import Layout
+from rectanglelayout import createLayout
+
+
+ICON_SIZES = (16, 24, 32, 48, 64)
+BANNER_SIZES = ((468, 60), (728, 90), (300, 250), (160, 600), (320, 50))
+
+
+def iconRectangles(count, seed = 0):
+    """
+    Create a list of count square icon rectangles, (width, height), with
+    sizes picked from ICON_SIZES. The seed makes the list reproducible.
+    """
+    rnd = random.Random(seed)
+    rectangles = []
+    for i in xrange(count):
+        size = rnd.choice(ICON_SIZES)
+        rectangles.append((size, size))
+    return rectangles
+
+
+def powerLawRectangles(count, seed = 0):
+    """
+    Create a list of count rectangles with sides drawn independently from a
+    Pareto distribution, so most rectangles are small and a few are large,
+    like the images collected from a real site. Sides are 8 to 1024 pixels.
+    """
+    rnd = random.Random(seed)
+    rectangles = []
+    for i in xrange(count):
+        width = min(1024, int(8 * rnd.paretovariate(1.5)))
+        height = min(1024, int(8 * rnd.paretovariate(1.5)))
+        rectangles.append((width, height))
+    return rectangles
+
+
+def bannerRectangles(count, seed = 0):
+    """
+    Create a list of count rectangles where one in twenty is a banner
+    picked from BANNER_SIZES and the others are icons.
+    """
+    rnd = random.Random(seed)
+    rectangles = []
+    for i in xrange(count):
+        if(0 == rnd.randrange(20)):
+            rectangles.append(rnd.choice(BANNER_SIZES))
+        else:
+            size = rnd.choice(ICON_SIZES)
+            rectangles.append((size, size))
+    return rectangles
+
+
+def fixtureRectangles(directory):
+    """
+    Create the list of rectangles of the images in a fixture directory,
+    like test/img_set_1, using the sizes of the images PIL can open.
+    """
+    from PIL import Image
+    rectangles = []
+    for root, dirs, files in os.walk(directory):
+        for filename in sorted(files):
+            try:
+                rectangles.append(Image.open(os.path.join(root, filename)).size)
+            except IOError:
+                pass
+    return rectangles
+
+
+# Registry of the synthetic workloads by name. Each creates a
+# reproducible list of count rectangles from a seed.
+DISTRIBUTIONS = {
+    "icons" : iconRectangles,
+    "powerlaw" : powerLawRectangles,
+    "banners" : bannerRectangles,
+}
+
+
+def fixtureDirectories():
+    """
+    Find the test/img_set_* fixture directories next to this file.
+    Return: dict of the fixture name to its directory
+    """
+    test = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test")
+    fixtures = {}
+    if(os.path.isdir(test)):
+        for name in sorted(os.listdir(test)):
+            if(name.startswith("img_set_") and os.path.isdir(os.path.join(test, name))):
+                fixtures[name] = os.path.join(test, name)
+    return fixtures
+
+
+def layoutBytes(layout):
+    """
+    Sum the size in bytes of every node in the layout tree, allocated or
+    not, and the list holding the allocated nodes. Items are not counted
+    because they belong to the application.
+    """
+    total = sys.getsizeof(layout._allocated)
+    stack = [layout._root]
+    while(stack):
+        node = stack.pop()
+        total += sys.getsizeof(node)
+        if hasattr(node, "__dict__"):
+            total += sys.getsizeof(node.__dict__)
+        for child in (node.left, node.right):
+            if(not child is None):
+                stack.append(child)
+    return total
+
+
+def benchmarkMemory(count):
+    """
+    Place count icons in a layout locked to the width of the
+    largest icon and report the bytes used per placed rectangle.
+    """
+    rectangles = iconRectangles(count)
+    rectangles.sort(reverse = True, key = lambda rectangle: rectangle[0])
+    layout = Layout(max(ICON_SIZES), sys.maxint)
+    start = time.time()
+    for (item, (width, height)) in enumerate(rectangles):
+        layout.insert(width, height, item)
+    layout.prune()
+    elapsed = time.time() - start
+    total = layoutBytes(layout)
+    print str.format("Rectangles placed: {0}", count)
+    print str.format("Bounding: {0} x {1}", *layout.bounding())
+    print str.format("Layout time: {0:.2f}s", elapsed)
+    print str.format("Layout bytes: {0}", total)
+    print str.format("Bytes per placed rectangle: {0:.1f}", float(total) / count)
+
+
+def layoutRectangles(algorithm, rectangles):
+    """
+    Layout the rectangles like spritify does, in a layout locked to the
+    largest width or height and open-ended in the other direction, with
+    the rectangles sorted by decreasing extent in the locked direction.
+    Return: the pruned layout
+    """
+    width = max(rectangle[0] for rectangle in rectangles)
+    height = max(rectangle[1] for rectangle in rectangles)
+    if(width < height):
+        width = sys.maxint
+        extent = lambda rectangle: rectangle[0]
+    else:
+        height = sys.maxint
+        extent = lambda rectangle: rectangle[1]
+    layout = createLayout(algorithm, width, height)
+    for (item, (rectangle_width, rectangle_height)) in enumerate(sorted(rectangles, reverse = True, key = extent)):
+        layout.insert(rectangle_width, rectangle_height, item)
+    layout.prune()
+    return layout
+
+
+def _measure(algorithm, rectangles, queue):
+    """
+    Layout the rectangles and put the measurements on the queue. Run in a
+    process of its own, so the peak memory is that of the one layout.
+    """
+    base = peakMemory()
+    start = time.time()
+    layout = layoutRectangles(algorithm, rectangles)
+    elapsed = time.time() - start
+    (width, height) = layout.bounding()
+    used = sum(node.width * node.height for node in layout.nodes())
+    queue.put({
+        "seconds" : elapsed,
+        "inserts_per_second" : len(rectangles) / max(elapsed, 1e-9),
+        "peak_memory" : max(0, peakMemory() - base),
+        "width" : width,
+        "height" : height,
+        "efficiency" : float(used) / (width * height),
+    })
+
+
+def benchmark(algorithm, rectangles, timeout, repeat = 1):
+    """
+    Measure a layout of the rectangles with the algorithm repeat times,
+    keeping the fastest run to even out noise from the rest of the system.
+    Return: dict of the measurements, or None on timeout
+    """
+    best = None
+    for run in xrange(repeat):
+        result = _benchmarkOnce(algorithm, rectangles, timeout)
+        if(result is None):
+            return None
+        if(best is None or result["inserts_per_second"] > best["inserts_per_second"]):
+            best = result
+    return best
+
+
+def _benchmarkOnce(algorithm, rectangles, timeout):
+    """
+    Measure a layout of the rectangles with the algorithm in a process
+    of its own, which is stopped if it runs longer than timeout seconds.
+    Return: dict of the measurements, or None on timeout
+    """
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target = _measure, args = (algorithm, rectangles, queue))
+    process.start()
+    process.join(timeout)
+    if(process.is_alive()):
+        process.terminate()
+        process.join()
+        return None
+    if(queue.empty()):
+        return None
+    return queue.get()
+
+
+def workloads(distributions, counts, fixtures, seed):
+    """
+    Generator function for the workloads to benchmark, the synthetic
+    distributions at every count followed by the fixture directories.
+    Yields (workload name, list of rectangles).
+    """
+    for distribution in distributions:
+        for count in counts:
+            yield (str.format("{0}-{1}", distribution, count), DISTRIBUTIONS[distribution](count, seed))
+    for (name, directory) in sorted(fixtures.items()):
+        rectangles = fixtureRectangles(directory)
+        if(rectangles):
+            yield (name, rectangles)
+
+
+def compareResults(results, baseline, threshold):
+    """
+    Compare results with the results of an earlier run. A run regresses
+    if its inserts per second drop by more than the threshold fraction,
+    if its efficiency drops or if it timed out where it didn't before.
+    Return: list of the regression descriptions
+    """
+    regressions = []
+    for (key, result) in sorted(results.items()):
+        # Workloads new to this run, or that timed out before, can't regress
+        previous = baseline.get(key)
+        if(previous is None):
+            continue
+        if(result is None):
+            regressions.append(str.format("{0}: timed out", key))
+            continue
+        if(result["inserts_per_second"] < previous["inserts_per_second"] * (1.0 - threshold)):
+            regressions.append(str.format("{0}: {1:.0f} inserts/s, was {2:.0f}", key, result["inserts_per_second"], previous["inserts_per_second"]))
+        if(result["efficiency"] < previous["efficiency"] - 1e-9):
+            regressions.append(str.format("{0}: efficiency {1:.3f}, was {2:.3f}", key, result["efficiency"], previous["efficiency"]))
+    return regressions
+
+
+def scalingResults(results, distributions, counts, layouts):
+    """
+    Get the slowdown of every layout from the smallest to the largest count
+    of each distribution, the seconds per insert at the largest count divided
+    by the seconds per insert at the smallest. A layout looking through all
+    of its free space for every insert slows down in proportion to the count,
+    which the inserts per second of a single count don't show.
+    Return: list of (distribution/layout, slowdown or None if either count timed out)
+    """
+    scaling = []
+    if(2 > len(set(counts))):
+        return scaling
+    for distribution in distributions:
+        for algorithm in layouts:
+            (small, large) = [results.get(str.format("{0}-{1}/{2}", distribution, count, algorithm)) for count in (min(counts), max(counts))]
+            slowdown = None
+            if(not small is None and not large is None):
+                slowdown = small["inserts_per_second"] / large["inserts_per_second"]
+            scaling.append((str.format("{0}/{1}", distribution, algorithm), slowdown))
+    return scaling
+
+
+def main():
+    parser = OptionParser(usage = "usage: %prog [options] [count ...]", description = "Benchmark the layout algorithms on synthetic rectangle distributions, of each count, and on the test/img_set_* fixtures. (Default counts: 1000 10000 100000)")
+    parser.add_option("-d", "--distributions", dest="distributions", default=",".join(sorted(DISTRIBUTIONS.keys())), help=str.format("Comma separated list of distributions, from {0}. (Default: all)", ", ".join(sorted(DISTRIBUTIONS.keys()))))
+    parser.add_option("-l", "--layouts", dest="layouts", default=",".join(sorted(LAYOUTS.keys())), help=str.format("Comma separated list of layout algorithms, from {0}. (Default: all)", ", ".join(sorted(LAYOUTS.keys()))))
+    parser.add_option("--no-fixtures", action="store_false", default=True, dest="fixtures", help="Don't benchmark the test/img_set_* fixtures.")
+    parser.add_option("--seed", dest="seed", type="int", default=0, help="Seed of the synthetic distributions. (Default: 0)")
+    parser.add_option("--timeout", dest="timeout", type="float", default=60.0, help="Seconds a layout may run before it's stopped and reported as timed out. (Default: 60)")
+    parser.add_option("-r", "--repeat", dest="repeat", type="int", default=3, help="Number of times each layout is run, keeping the fastest run. (Default: 3)")
+    parser.add_option("--save", dest="save", help="Name of a JSON file to save the results in.")
+    parser.add_option("--compare", dest="compare", help="Name of a JSON file with saved results to compare with. Exits with status 1 on regressions.")
+    parser.add_option("--threshold", dest="threshold", type="float", default=0.1, help="Fraction inserts per second may drop before it's a regression. (Default: 0.1)")
+    parser.add_option("--max-slowdown", dest="maxSlowdown", type="float", help="Times the seconds per insert may grow from the smallest to the largest count before a layout doesn't scale. Exits with status 1 on layouts that don't scale or time out.")
+    parser.add_option("--node-bytes", dest="nodeBytes", type="int", help="Only report the bytes used per placed rectangle by the guillotine layout for this many icons.")
+    (options, args) = parser.parse_args()
+    if(not options.nodeBytes is None):
+        benchmarkMemory(options.nodeBytes)
+        return
+    try:
+        counts = [int(arg) for arg in args] or [1000, 10000, 100000]
+    except ValueError:
+        parser.error("Counts must be integers")
+    if(1 > options.repeat):
+        parser.error("Repeat must be at least 1")
+    distributions = [name for name in options.distributions.split(",") if name]
+    layouts = [name for name in options.layouts.split(",") if name]
+    for name in distributions:
+        if(not name in DISTRIBUTIONS):
+            parser.error(str.format("Unknown distribution {0}", name))
+    for name in layouts:
+        if(not name in LAYOUTS):
+            parser.error(str.format("Unknown layout algorithm {0}", name))
+    fixtures = {}
+    if(options.fixtures):
+        fixtures = fixtureDirectories()
+    results = {}
+    print str.format("{0:<24} {1:<11} {2:>12} {3:>12} {4:>10} {5:>15}", "Workload", "Layout", "Inserts/s", "Peak memory", "Efficiency", "Bounding")
+    for (workload, rectangles) in workloads(distributions, counts, fixtures, options.seed):
+        for algorithm in layouts:
+            result = benchmark(algorithm, rectangles, options.timeout, options.repeat)
+            results[str.format("{0}/{1}", workload, algorithm)] = result
+            if(result is None):
+                print str.format("{0:<24} {1:<11} {2:>12}", workload, algorithm, "timeout")
+            else:
+                print str.format("{0:<24} {1:<11} {2:>12.0f} {3:>11.1f}M {4:>10.3f} {5:>15}", workload, algorithm, result["inserts_per_second"], result["peak_memory"] / 1048576.0, result["efficiency"], str.format("{0} x {1}", result["width"], result["height"]))
+            sys.stdout.flush()
+    if(not options.save is None):
+        f = open(options.save, "w")
+        json.dump(results, f, indent = 1, sort_keys = True)
+        f.close()
+    scaling = scalingResults(results, distributions, counts, layouts)
+    if(scaling):
+        print str.format("Slowdown per insert from {0} to {1} rectangles", min(counts), max(counts))
+        for (name, slowdown) in scaling:
+            if(slowdown is None):
+                print str.format("{0:<36} {1:>8}", name, "timeout")
+            else:
+                print str.format("{0:<36} {1:>8.1f}", name, slowdown)
+    regressions = []
+    if(not options.compare is None):
+        f = open(options.compare)
+        baseline = json.load(f)
+        f.close()
+        regressions.extend(compareResults(results, baseline, options.threshold))
+    if(not options.maxSlowdown is None):
+        for (name, slowdown) in scaling:
+            if(slowdown is None or slowdown > options.maxSlowdown):
+                regressions.append(str.format("{0}: doesn't scale to {1} rectangles", name, max(counts)))
+    for regression in regressions:
+        print str.format("Regression {0}", regression)
+    if(regressions):
+        sys.exit(1)
+    if(not options.compare is None or not options.maxSlowdown is None):
+        print "No regressions"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+__copyright__ = """
+Copyright 2011 James Lindstorff
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import hashlib
+import json
+import os
+import os.path
+from atomicfile import AtomicFile
+
+
+def fileHash(filename):
+    """
+    Calculate the SHA-1 hash of the content of a file as a hex string.
+    """
+    digest = hashlib.sha1()
+    f = open(filename, "rb")
+    try:
+        while True:
+            data = f.read(65536)
+            if not data:
+                break
+            digest.update(data)
+    finally:
+        f.close()
+    return digest.hexdigest()
+
+
+def fileFingerprint(filename):
+    """
+    Get the modification time, size and content hash of a file. The file is
+    stat'ed before it's read, so a file changed while it's hashed is taken
+    as changed by the next build.
+    Return: (mtime, size, hash)
+    """
+    (mtime, size) = fileStat(filename)
+    return (mtime, size, fileHash(filename))
+
+
+def fileStat(filename):
+    """
+    Get the modification time and size of a file.
+    Return: (mtime, size)
+    """
+    stat = os.stat(filename)
+    return (stat.st_mtime, stat.st_size)
+
+
+class BuildCache(object):
+    """
+    Persistent build cache stored as a JSON manifest between runs.
+    The manifest holds an entry per input image with the path, mtime,
+    size, content hash and dimensions of the image, plus the options,
+    inputs and layout of the previous build and the modification times
+    of the files it wrote. An input is trusted without being read if
+    its mtime and size are unchanged, and its dimensions are reused
+    without probing the image if its content hash is unchanged.
+    """
+    VERSION = 3
+
+    def __init__(self, filename):
+        """
+        Initialize the build cache from the manifest in the file
+        named by the filename. A missing or unreadable manifest
+        gives an empty cache. Without a filename the cache is only
+        kept in memory, like when watching a directory.
+        """
+        self.filename = filename
+        self._inputs = {}
+        self._build = None
+        if(filename is None):
+            return
+        try:
+            f = open(filename, "r")
+            try:
+                manifest = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            manifest = None
+        if isinstance(manifest, dict) and self.VERSION == manifest.get("version"):
+            self._inputs = manifest.get("inputs", {})
+            self._build = manifest.get("build")
+
+    def __current(self, filename):
+        """
+        Get the cache entry for the filename if the file has the same
+        mtime and size as when the entry was stored, otherwise None.
+        """
+        entry = self._inputs.get(filename)
+        if entry is None:
+            return None
+        try:
+            (mtime, size) = fileStat(filename)
+        except OSError:
+            return None
+        if(mtime == entry["mtime"] and size == entry["size"]):
+            return entry
+        return None
+
+    def isKnownImage(self, filename):
+        """
+        Check if the file is a cached image which hasn't changed
+        since it was cached, so the file type doesn't need detection.
+        """
+        return not self.__current(filename) is None
+
+    def lookup(self, filename, fingerprint = None):
+        """
+        Look up the size of an image file in the cache. The file is only
+        read, to compare content hashes, if its mtime or size has changed
+        and the fingerprint of the file, from fileFingerprint, isn't given.
+        None is returned if the file isn't cached or its content has changed.
+        Return: (width, height) or None
+        """
+        entry = self.__current(filename)
+        if entry is None:
+            entry = self._inputs.get(filename)
+            if entry is None:
+                return None
+            try:
+                if(fingerprint is None):
+                    fingerprint = fileFingerprint(filename)
+            except (IOError, OSError):
+                return None
+            (mtime, size, content_hash) = fingerprint
+            if(entry["hash"] != content_hash):
+                return None
+            entry["mtime"] = mtime
+            entry["size"] = size
+        return (entry["width"], entry["height"])
+
+    def contentHash(self, filename):
+        """
+        Get the cached content hash of a file if the file is
+        unchanged since it was cached, otherwise None.
+        """
+        entry = self.__current(filename)
+        if entry is None:
+            return None
+        return entry["hash"]
+
+    def update(self, filename, dimensions, fingerprint = None):
+        """
+        Store the dimensions, (width, height), of an image file in the cache
+        together with the fingerprint of the file, its mtime, size and content
+        hash from fileFingerprint, which is taken now if it isn't given.
+        """
+        if(fingerprint is None):
+            fingerprint = fileFingerprint(filename)
+        (mtime, size, content_hash) = fingerprint
+        (width, height) = dimensions
+        self._inputs[filename] = {
+            "mtime" : mtime,
+            "size" : size,
+            "hash" : content_hash,
+            "width" : width,
+            "height" : height,
+        }
+
+    def lookupTrim(self, filename):
+        """
+        Look up the trim box of an image file in the cache, if the file
+        is unchanged since the box was stored, otherwise None.
+        Return: (left, top, right, bottom) or None
+        """
+        entry = self.__current(filename)
+        if((entry is None) or (not "trim" in entry)):
+            return None
+        return tuple(entry["trim"])
+
+    def updateTrim(self, filename, box):
+        """
+        Store the trim box, (left, top, right, bottom), of an image
+        file that is in the cache.
+        """
+        self._inputs[filename]["trim"] = list(box)
+
+    def __inputKey(self, filenames):
+        """
+        Key identifying the content of the input files of a build.
+        """
+        return [[filename, self._inputs[filename]["hash"]] for filename in filenames]
+
+    def __outputsCurrent(self, outputs):
+        """
+        Check the output files are unchanged since the previous build.
+        """
+        for (filename, mtime) in outputs.items():
+            try:
+                if(mtime != fileStat(filename)[0]):
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def placements(self, options, filenames):
+        """
+        Get the placements of the previous build if it was built with the
+        same options from the same input files, otherwise None.
+        Return: list of (filename, sheet, x, y, width, height, rotated) or None
+        """
+        if self._build is None:
+            return None
+        if(options != self._build["options"] or self.__inputKey(filenames) != self._build["inputs"]):
+            return None
+        return [tuple(placement) for placement in self._build["placements"]]
+
+    def previousPlacements(self, options = None, keys = ()):
+        """
+        Get the placements of the previous build, whatever input files it
+        was built from, or None if no build is cached or the previous build
+        had other values for the options named by keys. Used to keep the
+        images of the previous build in place when images are added or removed.
+        Return: list of (filename, sheet, x, y, width, height, rotated) or None
+        """
+        if self._build is None:
+            return None
+        for key in keys:
+            if(options.get(key) != self._build["options"].get(key)):
+                return None
+        return [tuple(placement) for placement in self._build["placements"]]
+
+    def isUpToDate(self, options, filenames):
+        """
+        Check if the previous build was built with the same options from
+        the same input files and its output files are unchanged.
+        """
+        if self.placements(options, filenames) is None:
+            return False
+        return self.__outputsCurrent(self._build["outputs"])
+
+    def store(self, options, filenames, placements, outputs):
+        """
+        Store a build with the options, the input filenames, the placements
+        from the layouts as (filename, sheet, x, y, width, height, rotated) tuples and
+        the filenames of the written outputs. Cache entries of files that
+        aren't inputs of the build, like deleted images, are dropped.
+        """
+        self._inputs = dict((filename, self._inputs[filename]) for filename in filenames if filename in self._inputs)
+        self._build = {
+            "options" : options,
+            "inputs" : self.__inputKey(filenames),
+            "placements" : [list(placement) for placement in placements],
+            "outputs" : dict((output, fileStat(output)[0]) for output in outputs),
+        }
+
+    def save(self):
+        """
+        Save the cache manifest. The manifest is written to an AtomicFile
+        which replaces the manifest, so a failed save can't leave a partial
+        manifest behind. A cache kept in memory isn't saved.
+        """
+        if(self.filename is None):
+            return
+        f = AtomicFile(self.filename, "w")
+        try:
+            json.dump({"version" : self.VERSION, "inputs" : self._inputs, "build" : self._build}, f)
+        except:
+            f.discard()
+            raise
+        f.close()
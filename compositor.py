@@ -0,0 +1,104 @@
+__copyright__ = """
+Copyright 2011 James Lindstorff
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from PIL import Image
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class PILCompositor(object):
+    """
+    Compositor pasting the images onto an RGBA sprite with PIL, which
+    converts images of other modes to RGBA as they are pasted.
+    """
+    def __init__(self, size):
+        """
+        Initialize the compositor with a transparent sprite of the size.
+        """
+        self._sprite = Image.new("RGBA", size)
+
+    def paste(self, image, position):
+        """
+        Paste the image with its top left corner at the position, (x, y).
+        """
+        self._sprite.paste(image, position)
+
+    def image(self):
+        """
+        Get the sprite as a PIL image.
+        """
+        return self._sprite
+
+
+class NumpyCompositor(object):
+    """
+    Compositor copying the images into a preallocated uint8 array of the
+    RGBA pixels of the sprite, through views of the array. Images of other
+    modes are converted to RGBA by PIL once, before they are copied, which
+    is faster than filling the bands of the view one at a time. The sprite
+    is an image sharing the memory of the array, so it's handed to the
+    encoder without a copy. PIL pastes as fast or faster, so spritify draws
+    with the PIL compositor and this one is the baseline of benchcompositor.
+    """
+    def __init__(self, size):
+        """
+        Initialize the compositor with a transparent sprite of the size.
+        """
+        (width, height) = size
+        self._size = size
+        self._canvas = numpy.zeros((height, width, 4), numpy.uint8)
+
+    def paste(self, image, position):
+        """
+        Paste the image with its top left corner at the position, (x, y).
+        """
+        (x, y) = position
+        (width, height) = image.size
+        target = self._canvas[y:y + height, x:x + width]
+        if("RGBA" != image.mode):
+            image = image.convert("RGBA")
+        # Faster than numpy.asarray, which goes through the array interface
+        target[...] = numpy.frombuffer(image.tobytes(), numpy.uint8).reshape(height, width, 4)
+
+    def image(self):
+        """
+        Get the sprite as a PIL image sharing the memory of the array.
+        The image is read only, so it can't change the array behind it.
+        """
+        return Image.frombuffer("RGBA", self._size, self._canvas, "raw", "RGBA", 0, 1)
+
+
+# Registry of the compositors compared by benchcompositor. All compositors
+# are created with the size of the sprite and support paste and image.
+COMPOSITORS = {
+    "pil" : PILCompositor,
+    "numpy" : NumpyCompositor,
+}
+
+
+def compositorSupported(name):
+    """
+    Check if the compositor can be used, the numpy compositor needs numpy.
+    """
+    return "numpy" != name or not numpy is None
+
+
+def createCompositor(name, size):
+    """
+    Create the compositor registered with the name for a sprite of the size.
+    """
+    return COMPOSITORS[name](size)
@@ -0,0 +1,193 @@
+__copyright__ = """
+Copyright 2011 James Lindstorff
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import os.path
+import zlib
+from atomicfile import AtomicFile
+from instrumentation import log
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Size of the write buffer of the output files.
+BUFFER_SIZE = 65536
+
+# Extensions of the pre-compressed files by compression.
+COMPRESSIONS = {
+    "gzip" : ".gz",
+    "brotli" : ".br",
+}
+
+
+def compressionSupported(compression):
+    """
+    Check if a compression can be written. Brotli requires the brotli module.
+    """
+    if("brotli" == compression):
+        return not brotli is None
+    return compression in COMPRESSIONS
+
+
+def minifiedFilename(filename):
+    """
+    Get the filename of the minified CSS file written alongside a CSS file.
+    """
+    (base, extension) = os.path.splitext(filename)
+    return base + ".min" + extension
+
+
+def cssFilenames(filename, minify = False, compressions = ()):
+    """
+    Get the filenames of all files written by a CSSWriter, the CSS file,
+    the minified CSS file and the pre-compressed copies of them.
+    """
+    filenames = [filename]
+    if(minify):
+        filenames.append(minifiedFilename(filename))
+    compressed = []
+    for compression in compressions:
+        compressed.extend(f + COMPRESSIONS[compression] for f in filenames)
+    return filenames + compressed
+
+
+class _CompressedFile(object):
+    """
+    File like object compressing what is written to it with the compression.
+    The gzip header doesn't get a timestamp, so unchanged CSS gives identical
+    files. The file is an AtomicFile, replacing the file when closed.
+    """
+    def __init__(self, filename, compression):
+        self._file = AtomicFile(filename, "wb", BUFFER_SIZE)
+        if("gzip" == compression):
+            compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            (self._compress, self._finish) = (compressor.compress, compressor.flush)
+        else:
+            compressor = brotli.Compressor(mode = brotli.MODE_TEXT)
+            (self._compress, self._finish) = (compressor.process, compressor.finish)
+
+    def write(self, data):
+        self._file.write(self._compress(data))
+
+    def close(self):
+        self._file.write(self._finish())
+        self._file.close()
+
+    def discard(self):
+        self._file.discard()
+
+
+class ClassNames(object):
+    """
+    The CSS class names of a stylesheet. A name that is already taken
+    gets a number appended, so every image gets a class of its own.
+    """
+    def __init__(self, taken = ()):
+        """
+        Initialize the class names with names that are taken already,
+        like the background class of the sprite.
+        """
+        self._taken = set(taken)
+        self.names = []
+
+    def add(self, name):
+        """
+        Add a class name, renaming it if the name is taken.
+        Return: the name added
+        """
+        unique = name
+        number = 2
+        while(unique in self._taken):
+            unique = str.format("{0}-{1}", name, number)
+            number += 1
+        if(unique != name):
+            log.warning(str.format("Already a class named {0}, using {1}", name, unique))
+        self._taken.add(unique)
+        self.names.append(unique)
+        return unique
+
+    def __contains__(self, name):
+        return name in self._taken
+
+
+class CSSWriter(object):
+    """
+    Write a stylesheet a rule at a time through buffered files. Rules are
+    written as they are given, formatted for reading to the CSS file and,
+    if minifying, without whitespace to the minified file. Each file can
+    be compressed, while it's written, to pre-compressed copies. The files
+    are AtomicFile objects, so they are replaced when the writer is closed
+    and left as they were if it's discarded.
+    """
+    def __init__(self, filename, minify = False, compressions = ()):
+        """
+        Initialize the writer with the filename of the CSS file, whether to
+        write a minified file and the compressions, from COMPRESSIONS,
+        to write pre-compressed copies with.
+        """
+        self._streams = [[AtomicFile(filename, "wb", BUFFER_SIZE)]]
+        if(minify):
+            self._streams.append([AtomicFile(minifiedFilename(filename), "wb", BUFFER_SIZE)])
+        filenames = cssFilenames(filename, minify)
+        for (files, f) in zip(self._streams, filenames):
+            for compression in compressions:
+                files.append(_CompressedFile(f + COMPRESSIONS[compression], compression))
+
+    def __write(self, readable, minified):
+        """
+        Write the readable text to the CSS files and the minified text
+        to the minified files.
+        """
+        for (files, text) in zip(self._streams, (readable, minified)):
+            for f in files:
+                f.write(text)
+
+    def rule(self, selectors, declarations):
+        """
+        Write a rule for the list of selectors with the declarations
+        as a list of (property, value) tuples.
+        """
+        self.__write(str.format("{0} {{{1}}}\n", ", ".join(selectors), " ".join(str.format("{0}: {1};", name, value) for (name, value) in declarations)),
+            str.format("{0}{{{1}}}", ",".join(selectors), ";".join(str.format("{0}:{1}", name, value) for (name, value) in declarations)))
+
+    def beginBlock(self, prelude):
+        """
+        Begin an at-rule block, like a media query, with the prelude.
+        Rules written until endBlock are in the block.
+        """
+        self.__write(str.format("{0} {{\n", prelude), str.format("{0}{{", prelude.replace(", ", ",").replace(": ", ":")))
+
+    def endBlock(self):
+        """
+        End the at-rule block begun by beginBlock.
+        """
+        self.__write("}\n", "}")
+
+    def close(self):
+        """
+        Flush and close the files, replacing the written files.
+        """
+        for files in self._streams:
+            for f in files:
+                f.close()
+
+    def discard(self):
+        """
+        Close the files without replacing the written files.
+        """
+        for files in self._streams:
+            for f in files:
+                f.discard()
@@ -0,0 +1,420 @@
+__copyright__ = """
+Copyright 2011 James Lindstorff
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import importlib
+import json
+import os.path
+from csswriter import BUFFER_SIZE
+from csswriter import CSSWriter
+from csswriter import cssFilenames
+from atomicfile import AtomicFile
+from instrumentation import log
+from spriteencoder import FORMAT_TYPES
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class EmitterError(Exception):
+    """
+    Exception raised if an emitter can't be found or created.
+    """
+    def __init__(self, value):
+        """
+        Initialize the error with a value.
+        """
+        self.value = value
+
+    def __str__(self):
+        """
+        String representation of the emitter error.
+        """
+        return repr(self.value)
+
+
+class SpriteEntry(object):
+    """
+    An image in a sprite sheet, with its CSS class name, position and
+    size in the sheet and the padding, (top, right, bottom, left), giving
+    back the borders of a trimmed image, or None if it isn't trimmed.
+    A rotated image is stored in the sheet turned 90 degrees clockwise, so
+    it covers height by width pixels at the position, while the width and
+    height are those of the image turned back.
+    """
+    def __init__(self, name, x, y, width, height, padding = None, rotated = False):
+        self.name = name
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.padding = padding
+        self.rotated = rotated
+
+
+class SpriteSheet(object):
+    """
+    A sprite sheet as seen by the emitters. The classname is the background
+    class of the sheet and the width and height its size in CSS pixels.
+    The images are (density, urls) pairs, in order of density, where the
+    urls are (format, url) pairs, in order of preference, including PNG.
+    The entries are the SpriteEntry objects of the images in the sheet.
+    """
+    def __init__(self, classname, width, height, images, entries):
+        self.classname = classname
+        self.width = width
+        self.height = height
+        self.images = images
+        self.entries = entries
+
+    trimmed = property(lambda self : any(not entry.padding is None for entry in self.entries), None, None, None)
+
+
+def cssEntries(sheet):
+    """
+    Get the entries of a sheet a stylesheet can show, which are those
+    that aren't rotated, because a CSS background can't turn the image.
+    """
+    return [entry for entry in sheet.entries if not entry.rotated]
+
+
+def _warnRotated(sheets, filename):
+    """
+    Warn about the rotated entries of the sheets left out of the stylesheet.
+    """
+    rotated = sum(len(sheet.entries) - len(cssEntries(sheet)) for sheet in sheets)
+    if(0 < rotated):
+        log.warning(str.format("Left {0} rotated images out of {1}, use a manifest emitter for rotated images", rotated, filename))
+
+
+def backgroundImage(urls):
+    """
+    Get the background-image declarations of a sprite, given its (format, url)
+    pairs, as (property, value) tuples. With several formats the PNG url is
+    declared first, for browsers without image-set support, followed by an
+    image-set of all formats in the order of preference.
+    """
+    declarations = [("background-image", str.format("url(\"{0}\")", dict(urls)["png"]))]
+    if(1 < len(urls)):
+        candidates = [str.format("url(\"{0}\") type(\"{1}\")", url, FORMAT_TYPES[format]) for (format, url) in urls]
+        declarations.append(("background-image", str.format("image-set({0})", ", ".join(candidates))))
+    return declarations
+
+
+def densityQuery(density):
+    """
+    Get the media query matching devices with the pixel density.
+    """
+    return str.format("@media (-webkit-min-device-pixel-ratio: {0}), (min-resolution: {1}dpi)", density, 96 * density)
+
+
+class Emitter(object):
+    """
+    Base class of the emitters writing the sprite sheets as a stylesheet
+    or a manifest. Emitters with an extension write a file named by
+    replacing the extension of the CSS file, while emitters without one
+    write the CSS file. Files are written as AtomicFile objects, so a
+    failed emitter leaves the previous files in place. An emitter is
+    added by registering its class in EMITTERS or named on the command
+    line as module:class. Subclasses implement emit.
+    """
+    extension = None
+
+    def __init__(self, filename, minify = False, compressions = ()):
+        """
+        Initialize the emitter with the filename of the CSS file, whether
+        to minify CSS and the compressions to pre-compress CSS files with.
+        """
+        if(self.extension is None):
+            self.filename = filename
+        else:
+            self.filename = os.path.splitext(filename)[0] + self.extension
+        self.minify = minify
+        self.compressions = compressions
+
+    def filenames(self):
+        """
+        Get the filenames of the files written by the emitter.
+        """
+        return [self.filename]
+
+    def emit(self, sheets):
+        """
+        Write the list of SpriteSheet objects. This is abstract, every
+        emitter implements it, and raises NotImplementedError here.
+        """
+        raise NotImplementedError
+
+
+class CSSEmitter(Emitter):
+    """
+    Write the sprite sheets as CSS with a class per image. With several sheets
+    each sheet gets a numbered background class, which the classes of the
+    images in the sheet are added to. With several densities the background is
+    sized to the sheet, so positions are in CSS pixels for every density, and
+    media queries on the device pixel ratio select the sprite of the density.
+    Rotated images are left out, with a warning, because CSS can't show them.
+    """
+    def filenames(self):
+        return cssFilenames(self.filename, self.minify, self.compressions)
+
+    def _sheetDeclarations(self, sheet):
+        """
+        Get the declarations of the background class of a sheet, beside the
+        background image, as (property, value) tuples.
+        """
+        return []
+
+    def _entryDeclarations(self, sheet, entry):
+        """
+        Get the declarations of the class of an image as (property, value)
+        tuples. Trimmed images keep their original size by padding the class
+        with the trimmed borders and painting the background in the content
+        box only, so they render exactly as the original image.
+        """
+        declarations = [("width", str.format("{0}px", entry.width)), ("height", str.format("{0}px", entry.height))]
+        if(not entry.padding is None):
+            declarations.append(("padding", str.format("{0}px {1}px {2}px {3}px", *entry.padding)))
+            declarations.extend([("box-sizing", "content-box"), ("background-origin", "content-box"), ("background-clip", "content-box")])
+        declarations.append(("background-position", str.format("{0}px {1}px", 0 - entry.x, 0 - entry.y)))
+        return declarations
+
+    def emit(self, sheets):
+        _warnRotated(sheets, self.filename)
+        css = CSSWriter(self.filename, self.minify, self.compressions)
+        try:
+            # Register the sheets as background:url
+            selectors = []
+            for sheet in sheets:
+                if(1 == len(sheets)):
+                    selector = ["." + sheet.classname]
+                else:
+                    selector = ["." + name for name in [sheet.classname] + [entry.name for entry in cssEntries(sheet)]]
+                selectors.append(selector)
+                declarations = backgroundImage(sheet.images[0][1])
+                if(1 < len(sheet.images)):
+                    declarations.append(("background-size", str.format("{0}px {1}px", sheet.width, sheet.height)))
+                css.rule(selector, declarations + self._sheetDeclarations(sheet))
+            for (index, (density, urls)) in enumerate(sheets[0].images[1:], 1):
+                css.beginBlock(densityQuery(density))
+                for (selector, sheet) in zip(selectors, sheets):
+                    css.rule(selector, backgroundImage(sheet.images[index][1]))
+                css.endBlock()
+            # Register the images as classes by there filenames
+            for sheet in sheets:
+                for entry in cssEntries(sheet):
+                    css.rule(["." + entry.name], self._entryDeclarations(sheet, entry))
+        except:
+            css.discard()
+            raise
+        css.close()
+
+
+class CompactCSSEmitter(CSSEmitter):
+    """
+    Write the sprite sheets as CSS where the background class of a sheet
+    sizes and positions the images through custom properties. The class of
+    an image only sets the position and, unless the image has the most common
+    size in the sheet, the size, so sets of same sized icons get short classes.
+    """
+    def __init__(self, filename, minify = False, compressions = ()):
+        CSSEmitter.__init__(self, filename, minify, compressions)
+        self._common = {}
+
+    def _commonSize(self, sheet):
+        """
+        Get the most common size, (width, height), of the images in a sheet
+        shown by the CSS.
+        The size is found once per sheet.
+        """
+        if(not sheet.classname in self._common):
+            sizes = {}
+            for entry in cssEntries(sheet):
+                sizes[(entry.width, entry.height)] = sizes.get((entry.width, entry.height), 0) + 1
+            self._common[sheet.classname] = max(sorted(sizes.keys()) or [(0, 0)], key = sizes.get)
+        return self._common[sheet.classname]
+
+    def _sheetDeclarations(self, sheet):
+        (width, height) = self._commonSize(sheet)
+        declarations = [
+            ("--sprite-w", str.format("{0}px", width)),
+            ("--sprite-h", str.format("{0}px", height)),
+            ("width", "var(--sprite-w)"),
+            ("height", "var(--sprite-h)"),
+            ("background-position", "var(--sprite-xy)"),
+        ]
+        if(sheet.trimmed):
+            declarations.extend([("--sprite-pad", "0px"), ("padding", "var(--sprite-pad)"), ("box-sizing", "content-box"), ("background-origin", "content-box"), ("background-clip", "content-box")])
+        return declarations
+
+    def _entryDeclarations(self, sheet, entry):
+        declarations = [("--sprite-xy", str.format("{0}px {1}px", 0 - entry.x, 0 - entry.y))]
+        if((entry.width, entry.height) != self._commonSize(sheet)):
+            declarations.extend([("--sprite-w", str.format("{0}px", entry.width)), ("--sprite-h", str.format("{0}px", entry.height))])
+        if(not entry.padding is None):
+            declarations.append(("--sprite-pad", str.format("{0}px {1}px {2}px {3}px", *entry.padding)))
+        return declarations
+
+
+def manifest(sheets):
+    """
+    Build the coordinate manifest of the sprite sheets, with the size and
+    image urls of each sheet and the sheet, position, size and padding of
+    each image by its class name. Rotated images are marked as rotated,
+    their size being that of the image turned back.
+    """
+    images = {}
+    for (index, sheet) in enumerate(sheets):
+        for entry in sheet.entries:
+            image = {"sheet" : index, "x" : entry.x, "y" : entry.y, "width" : entry.width, "height" : entry.height}
+            if(not entry.padding is None):
+                image["padding"] = list(entry.padding)
+            if(entry.rotated):
+                image["rotated"] = True
+            images[entry.name] = image
+    return {
+        "sheets" : [{
+            "class" : sheet.classname,
+            "width" : sheet.width,
+            "height" : sheet.height,
+            "images" : [{"density" : density, "format" : format, "url" : url} for (density, urls) in sheet.images for (format, url) in urls],
+        } for sheet in sheets],
+        "images" : images,
+    }
+
+
+class JSONEmitter(Emitter):
+    """
+    Write the coordinate manifest of the sprite sheets as JSON.
+    """
+    extension = ".json"
+
+    def emit(self, sheets):
+        f = AtomicFile(self.filename, "wb", BUFFER_SIZE)
+        try:
+            json.dump(manifest(sheets), f, sort_keys = True, separators = (",", ":"))
+        except:
+            f.discard()
+            raise
+        f.close()
+
+
+class MessagePackEmitter(Emitter):
+    """
+    Write the coordinate manifest of the sprite sheets as MessagePack.
+    Requires the msgpack module.
+    """
+    extension = ".msgpack"
+
+    def __init__(self, filename, minify = False, compressions = ()):
+        if(msgpack is None):
+            raise EmitterError("The msgpack emitter requires the msgpack module")
+        Emitter.__init__(self, filename, minify, compressions)
+
+    def emit(self, sheets):
+        f = AtomicFile(self.filename, "wb", BUFFER_SIZE)
+        try:
+            msgpack.pack(manifest(sheets), f)
+        except:
+            f.discard()
+            raise
+        f.close()
+
+
+class SCSSEmitter(Emitter):
+    """
+    Write the sprite sheets as SCSS maps, $sprite-sheets with the PNG sprite
+    urls and size of each sheet and $sprite-images with the sheet, position,
+    size and padding of each image, and a sprite mixin including the image
+    by its class name, like @include sprite("icon"). Rotated images are
+    left out, like in the CSS.
+    """
+    extension = ".scss"
+
+    def emit(self, sheets):
+        _warnRotated(sheets, self.filename)
+        scss = AtomicFile(self.filename, "wb", BUFFER_SIZE)
+        try:
+            scss.write("$sprite-sheets: (\n")
+            for sheet in sheets:
+                declared = []
+                for (density, urls) in sheet.images:
+                    if(1 == density):
+                        declared.append(str.format("url: \"{0}\"", dict(urls)["png"]))
+                    else:
+                        declared.append(str.format("url-{0}x: \"{1}\"", density, dict(urls)["png"]))
+                scss.write(str.format("  \"{0}\": ({1}, width: {2}px, height: {3}px),\n", sheet.classname, ", ".join(declared), sheet.width, sheet.height))
+            scss.write(");\n")
+            scss.write("$sprite-images: (\n")
+            for sheet in sheets:
+                for entry in cssEntries(sheet):
+                    if(entry.padding is None):
+                        padding = "null"
+                    else:
+                        padding = str.format("{0}px {1}px {2}px {3}px", *entry.padding)
+                    scss.write(str.format("  \"{0}\": (sheet: \"{1}\", position: {2}px {3}px, width: {4}px, height: {5}px, padding: {6}),\n", entry.name, sheet.classname, 0 - entry.x, 0 - entry.y, entry.width, entry.height, padding))
+            scss.write(");\n")
+            scss.write("@mixin sprite($name) {\n")
+            scss.write("  $image: map-get($sprite-images, $name);\n")
+            scss.write("  $sheet: map-get($sprite-sheets, map-get($image, sheet));\n")
+            scss.write("  width: map-get($image, width);\n")
+            scss.write("  height: map-get($image, height);\n")
+            scss.write("  background-image: url(map-get($sheet, url));\n")
+            scss.write("  background-position: map-get($image, position);\n")
+            if(1 < len(sheets[0].images)):
+                scss.write("  background-size: map-get($sheet, width) map-get($sheet, height);\n")
+            scss.write("  @if map-get($image, padding) {\n")
+            scss.write("    padding: map-get($image, padding);\n")
+            scss.write("    box-sizing: content-box;\n")
+            scss.write("    background-origin: content-box;\n")
+            scss.write("    background-clip: content-box;\n")
+            scss.write("  }\n")
+            for (density, urls) in sheets[0].images[1:]:
+                scss.write(str.format("  {0} {{\n", densityQuery(density)))
+                scss.write(str.format("    background-image: url(map-get($sheet, url-{0}x));\n", density))
+                scss.write("  }\n")
+            scss.write("}\n")
+        except:
+            scss.discard()
+            raise
+        scss.close()
+
+
+EMITTERS = {
+    "css" : CSSEmitter,
+    "compact" : CompactCSSEmitter,
+    "json" : JSONEmitter,
+    "msgpack" : MessagePackEmitter,
+    "scss" : SCSSEmitter,
+}
+
+
+def createEmitter(name, filename, minify = False, compressions = ()):
+    """
+    Create the emitter registered in EMITTERS by the name, or the
+    emitter class named like module:class, for the CSS file named
+    by the filename.
+    """
+    if(name in EMITTERS):
+        emitter = EMITTERS[name]
+    elif(":" in name):
+        (module, classname) = name.split(":", 1)
+        try:
+            emitter = getattr(importlib.import_module(module), classname)
+        except (ImportError, AttributeError) as error:
+            raise EmitterError(str.format("Can't load the emitter {0}, {1}", name, error))
+    else:
+        raise EmitterError(str.format("Unknown emitter {0}", name))
+    return emitter(filename, minify, compressions)
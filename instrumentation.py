@@ -0,0 +1,180 @@
+__copyright__ = """
+Copyright 2011 James Lindstorff
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from contextlib import contextmanager
+import cProfile
+import logging
+import sys
+import time
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+# The logger of every module of spritify. Nothing is output unless a
+# handler is added, like logOutput does for the command line. Messages
+# sent for every image are only formatted after checking the level with
+# log.isEnabledFor, so they cost nothing when the level is disabled.
+log = logging.getLogger("spritify")
+log.addHandler(logging.NullHandler())
+log.setLevel(logging.INFO)
+
+# Stages of a build in the order they run, which is the order of reports.
+STAGES = ("scan", "probe", "duplicates", "trim", "layout", "decode", "compose", "encode", "write")
+
+
+def logOutput(stream, level = logging.INFO):
+    """
+    Add a handler writing the log messages of the level and above, without
+    decoration, to the stream. The level is kept on the handler, so other
+    handlers of the logger are unaffected, and the logger is only lowered
+    to the level when it would drop the messages, like debug messages.
+    Return: the handler, to remove with log.removeHandler
+    """
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    handler.setLevel(level)
+    log.addHandler(handler)
+    if(not log.isEnabledFor(level)):
+        log.setLevel(level)
+    return handler
+
+
+def peakMemory():
+    """
+    Get the peak resident set size of the process in bytes,
+    or None where the resource module isn't available.
+    """
+    if(resource is None):
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if(sys.platform == "darwin"):
+        return peak
+    return peak * 1024
+
+
+class Stats(object):
+    """
+    Counts, bytes and durations of the stages of a build. Durations of
+    stages run by pools of processes, like decoding and encoding several
+    sheets, are the sums of the durations in each process.
+    """
+    def __init__(self, started = None):
+        """
+        Initialize the stats with no counts, bytes or durations. The
+        started time is when the build started, like the start of a stage
+        run before the stats were created, and now if None.
+        """
+        self.counts = {}
+        self.bytes = {}
+        self.durations = {}
+        self.started = started
+        if(started is None):
+            self.started = time.time()
+
+    @contextmanager
+    def timer(self, stage):
+        """
+        Context manager adding the time spent in the block to the stage.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.addDuration(stage, time.time() - start)
+
+    def addDuration(self, stage, seconds):
+        """
+        Add seconds spent in the stage.
+        """
+        self.durations[stage] = self.durations.get(stage, 0.0) + seconds
+
+    def count(self, name, count = 1):
+        """
+        Add to the count of things, like images or sheets, with the name.
+        """
+        self.counts[name] = self.counts.get(name, 0) + count
+
+    def addBytes(self, name, count):
+        """
+        Add to the count of bytes of things, like sprites, with the name.
+        """
+        self.bytes[name] = self.bytes.get(name, 0) + count
+
+    def report(self):
+        """
+        Get the stats as a dict of plain values, ready to be dumped as JSON.
+        The peak memory is the resident set size of the process and, when
+        tracing memory allocations, the peak of the traced memory.
+        """
+        memory = {"peak_rss" : peakMemory()}
+        if((not tracemalloc is None) and tracemalloc.is_tracing()):
+            memory["peak_traced"] = tracemalloc.get_traced_memory()[1]
+        return {
+            "counts" : dict(self.counts),
+            "bytes" : dict(self.bytes),
+            "durations" : dict(self.durations),
+            "seconds" : time.time() - self.started,
+            "memory" : memory,
+        }
+
+    def summary(self):
+        """
+        Get the stats as lines of text, the stages in the order they run.
+        """
+        report = self.report()
+        stages = [stage for stage in STAGES if stage in self.durations]
+        stages.extend(sorted(stage for stage in self.durations if not stage in STAGES))
+        lines = [str.format("{0:<12} {1:>8.3f}s", stage, self.durations[stage]) for stage in stages]
+        lines.extend(str.format("{0:<12} {1:>9}", name, count) for (name, count) in sorted(self.counts.items()))
+        lines.extend(str.format("{0:<12} {1:>9} bytes", name, count) for (name, count) in sorted(self.bytes.items()))
+        for (name, count) in sorted(report["memory"].items()):
+            if(not count is None):
+                lines.append(str.format("{0:<12} {1:>9.1f} MB", name, count / 1048576.0))
+        lines.append(str.format("{0:<12} {1:>8.3f}s", "total", report["seconds"]))
+        return lines
+
+
+@contextmanager
+def profiled(filename = None, traceMemory = False):
+    """
+    Context manager profiling the block with cProfile, writing the profile
+    to the filename for pstats or snakeviz, if a filename is given, and
+    tracing memory allocations with tracemalloc, if traceMemory is set,
+    so the peak of the traced memory is part of the stats reported in
+    the block. Without a filename or traceMemory the block runs as is.
+    """
+    profile = None
+    if(not filename is None):
+        profile = cProfile.Profile()
+    if(traceMemory):
+        tracemalloc.start()
+    try:
+        if(not profile is None):
+            profile.enable()
+        try:
+            yield
+        finally:
+            if(not profile is None):
+                profile.disable()
+                profile.dump_stats(filename)
+    finally:
+        if(traceMemory):
+            tracemalloc.stop()
@@ -0,0 +1,206 @@
+__copyright__ = """
+Copyright 2011 James Lindstorff
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from collections import deque
+import math
+import multiprocessing
+import random
+import sys
+import time
+from rectanglelayout import RectangleLayoutError
+from rectanglelayout import createLayout
+
+
+# Sort keys of the rectangles, (width, height), tried by the optimizer.
+# The rectangles are inserted in decreasing order of the key.
+SORT_KEYS = {
+    "area" : lambda size: size[0] * size[1],
+    "maxside" : lambda size: (max(size), min(size)),
+    "perimeter" : lambda size: size[0] + size[1],
+    "width" : lambda size: (size[0], size[1]),
+    "height" : lambda size: (size[1], size[0]),
+}
+
+# Factors of the side of a square with the area of the rectangles
+# giving the widths of the strips tried by the optimizer.
+WIDTH_FACTORS = (0.75, 1.0, 1.25, 1.5, 2.0)
+
+
+class Candidate(object):
+    """
+    A candidate layout, the order the rectangles are inserted in, given as
+    their indices, and the width and height of the layout, one of which
+    is open-ended. The description tells how the candidate was made.
+    """
+    def __init__(self, description, order, width, height):
+        self.description = description
+        self.order = order
+        self.width = width
+        self.height = height
+
+
+def virtualSize(sizes):
+    """
+    Get the size of the layout spritify uses without optimizing, locked to
+    the largest width or height of the rectangles and open-ended in the
+    other direction.
+    Return: (width, height)
+    """
+    width = max(size[0] for size in sizes)
+    height = max(size[1] for size in sizes)
+    if(width < height):
+        return (sys.maxint, height)
+    return (width, sys.maxint)
+
+
+def candidateWidths(sizes):
+    """
+    Get the widths of the strips to try, the widest rectangle and
+    the widths given by WIDTH_FACTORS that are at least that wide.
+    """
+    widest = max(size[0] for size in sizes)
+    side = math.sqrt(sum(size[0] * size[1] for size in sizes))
+    return sorted(set([widest] + [max(widest, int(round(factor * side))) for factor in WIDTH_FACTORS]))
+
+
+def candidates(sizes, seed = 0, count = 256):
+    """
+    Generator function for at most count candidate layouts of the
+    rectangles. The first is the layout spritify makes without optimizing,
+    then every sort key with every strip width and then orders where the
+    sort keys are jittered by a random generator seeded with the seed,
+    so the same sizes and seed always give the same candidates.
+    """
+    indices = range(len(sizes))
+    (width, height) = virtualSize(sizes)
+    if(width < height):
+        fixed = lambda index: sizes[index][0]
+    else:
+        fixed = lambda index: sizes[index][1]
+    yield Candidate("default", sorted(indices, reverse = True, key = fixed), width, height)
+    produced = 1
+    widths = candidateWidths(sizes)
+    for name in sorted(SORT_KEYS.keys()):
+        order = sorted(indices, reverse = True, key = lambda index: SORT_KEYS[name](sizes[index]))
+        for strip in widths:
+            if(produced >= count):
+                return
+            yield Candidate(str.format("{0} sorted in a strip {1} wide", name, strip), order, strip, sys.maxint)
+            produced += 1
+    rnd = random.Random(seed)
+    while(produced < count):
+        name = rnd.choice(sorted(SORT_KEYS.keys()))
+        strip = rnd.choice(widths)
+        jitter = [rnd.uniform(0.9, 1.1) for index in indices]
+        area = lambda index: SORT_KEYS["area"](sizes[index]) * jitter[index]
+        if("area" != name):
+            key = lambda index: (SORT_KEYS[name](sizes[index]), area(index))
+        else:
+            key = area
+        order = sorted(indices, reverse = True, key = key)
+        yield Candidate(str.format("{0} jittered in a strip {1} wide", name, strip), order, strip, sys.maxint)
+        produced += 1
+
+
+def layoutCandidate(algorithm, sizes, candidate, rotate = False):
+    """
+    Layout the rectangles as the candidate with the layout algorithm,
+    which may rotate the rectangles if rotate is set.
+    Return: the pruned layout, with the index of each rectangle as its item
+    """
+    layout = createLayout(algorithm, candidate.width, candidate.height, rotate)
+    for index in candidate.order:
+        (width, height) = sizes[index]
+        layout.insert(width, height, index)
+    layout.prune()
+    return layout
+
+
+def _score(arguments):
+    """
+    Score a candidate by the area of its bounding rectangle, and then by its
+    longest side, so square layouts win ties. This runs in a worker process,
+    so the arguments are the algorithm, the sizes, the candidate and whether
+    the rectangles may be rotated.
+    Return: (area, longest side), or None if the candidate doesn't fit
+    """
+    (algorithm, sizes, candidate, rotate) = arguments
+    try:
+        (width, height) = layoutCandidate(algorithm, sizes, candidate, rotate).bounding()
+    except RectangleLayoutError:
+        return None
+    return (width * height, max(width, height))
+
+
+def _scoredCandidates(algorithm, sizes, seed, count, rotate, pool, processes):
+    """
+    Generator function for (candidate, score) pairs in the order of the
+    at most count candidates, scored by the pool of processes, or by this
+    process if the pool is None. Only a couple of candidates per process
+    are made ahead of being scored, so the candidates left when the caller
+    stops are never made.
+    """
+    if(pool is None):
+        for candidate in candidates(sizes, seed, count):
+            yield (candidate, _score((algorithm, sizes, candidate, rotate)))
+        return
+    pending = deque()
+    for candidate in candidates(sizes, seed, count):
+        pending.append((candidate, pool.apply_async(_score, ((algorithm, sizes, candidate, rotate),))))
+        if(len(pending) >= 2 * processes):
+            (candidate, result) = pending.popleft()
+            yield (candidate, result.get())
+    while(pending):
+        (candidate, result) = pending.popleft()
+        yield (candidate, result.get())
+
+
+def optimizeLayout(algorithm, sizes, count = 64, seed = 0, processes = 1, rotate = False, timeBudget = None):
+    """
+    Search the first count candidates for the layout of the rectangles with
+    the smallest bounding area, scoring them in order on a pool of processes.
+    The layouts may rotate the rectangles if rotate is set. Ties go to the
+    earlier candidate, so the same rectangles, count and seed always give
+    the same layout. A timeBudget, in seconds, stops the search early, but
+    only between batches of a candidate per process, after the default
+    layout is scored. A layout found under a time budget depends on the
+    speed and load of the machine, so it isn't reproducible.
+    Return: (best Candidate, its score, default score, number of candidates scored)
+    """
+    deadline = None
+    if(not timeBudget is None):
+        deadline = time.time() + timeBudget
+    best = None
+    default = None
+    scored = 0
+    pool = None
+    if(1 < processes):
+        pool = multiprocessing.Pool(processes)
+    try:
+        for (candidate, score) in _scoredCandidates(algorithm, sizes, seed, count, rotate, pool, processes):
+            scored += 1
+            if(1 == scored):
+                default = score
+            if((not score is None) and (best is None or score < best[1])):
+                best = (candidate, score)
+            if((not deadline is None) and 0 == scored % processes and time.time() >= deadline):
+                break
+    finally:
+        if(not pool is None):
+            pool.terminate()
+            pool.join()
+    if(best is None):
+        raise RectangleLayoutError("None of the candidate layouts fit")
+    return (best[0], best[1], default, scored)
@@ -13,6 +13,9 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+from bisect import bisect_left
+import sys
+
 
 class RectangleLayoutError(Exception):
     """
@@ -44,9 +47,19 @@ class Node(object):
     extent, width and height, and whether the node
     is allocated, plus an item property which can be used
     to associate application specific references to the node.
+    A rotated node holds its rectangle turned 90 degrees clockwise,
+    so the width and height are those of the turned rectangle.
     The Node also has a left and a right property which is
     references to the Node childs in the layout tree.
+    While the Node is free space its block property references
+    the FreeSpaceBlock holding it in the layouts free space index.
+    The attributes are declared as slots because a layout holds a
+    Node per rectangle plus the free space nodes, so dropping the
+    per instance dictionary matters for large layouts.
     """
+    __slots__ = ("x", "y", "width", "height", "allocated", "item",
+                 "rotated", "left", "right", "block")
+
     def __init__(self, x, y, width, height, allocated = False, item = None):
         """
         Initialize a Node with a placement and an extent. 
@@ -58,15 +71,201 @@ class Node(object):
         self.height = height
         self.allocated = allocated
         self.item = item
+        self.rotated = False
         self.left = None
         self.right = None
+        self.block = None
 
     def __str__(self):
+        if(self.rotated):
+            return "[%s] - (%s, %s) w=%s h=%s rotated" % (self.item, self.x, self.y, self.width, self.height)
         return "[%s] - (%s, %s) w=%s h=%s" % (self.item, self.x, self.y, self.width, self.height)
 
     area = property(lambda self : self.width * self.height, None, None, None)
 
 
+def _frontier(extents):
+    """
+    Get the frontier of the (width, height) extents, the extents that no
+    other extent is both as wide and as high as. Any rectangle fitting one
+    of the extents fits one on the frontier.
+    Return: (widths, heights) of the frontier, the widths increasing and
+    the heights decreasing
+    """
+    widths = []
+    heights = []
+    for (width, height) in sorted(extents, reverse = True):
+        if(not heights or height > heights[-1]):
+            widths.append(width)
+            heights.append(height)
+    widths.reverse()
+    heights.reverse()
+    return (widths, heights)
+
+
+def _frontierFits(frontier, width, height):
+    """
+    Check if the rectangle defined by the width and height fits an extent
+    on the frontier. The first extent as wide as the rectangle is the
+    highest of those as wide, so it's the only one to check.
+    """
+    (widths, heights) = frontier
+    position = bisect_left(widths, width)
+    return position < len(widths) and height <= heights[position]
+
+
+class FreeSpaceBlock(object):
+    """
+    A block of consecutive free space nodes in the free space index
+    with the frontier of the free extents of the nodes.
+    The position is the place of the block in the index.
+    """
+    def __init__(self, nodes):
+        """
+        Initialize the block with a list of free space nodes.
+        """
+        self.nodes = nodes
+        self.position = None
+        for node in nodes:
+            node.block = self
+        self.update()
+
+    def update(self):
+        """
+        Update the frontier of the free extents from the nodes in the block.
+        """
+        self.frontier = _frontier([(node.width, node.height) for node in self.nodes])
+
+    def onFrontier(self, node):
+        """
+        Check if the extent of the node is on the frontier of the block.
+        """
+        (widths, heights) = self.frontier
+        position = bisect_left(widths, node.width)
+        return position < len(widths) and node.width == widths[position] and node.height == heights[position]
+
+
+class FreeSpaceIndex(object):
+    """
+    Index of the free space nodes in a layout tree, kept in the order
+    a left to right traversal of the tree would visit them.
+    The nodes are bucketed into blocks of consecutive nodes, and the
+    frontiers of the free extents of the blocks are merged in a binary
+    tree over the blocks. The frontier tells exactly if a rectangle fits
+    somewhere below a position in the tree, where the largest width and
+    height could come from different nodes, so a first-fit lookup descends
+    straight to the leftmost block holding the rectangle in logarithmic
+    time instead of visiting every block. Blocks are split when they grow
+    beyond twice the block size, which rebuilds the tree.
+    """
+    BLOCK_SIZE = 128
+
+    def __init__(self, nodes):
+        """
+        Initialize the index with free space nodes in tree order.
+        """
+        self.rebuild(nodes)
+
+    def rebuild(self, nodes):
+        """
+        Rebuild the index from free space nodes in tree order.
+        """
+        nodes = list(nodes)
+        self._blocks = []
+        for start in xrange(0, len(nodes), self.BLOCK_SIZE):
+            self._blocks.append(FreeSpaceBlock(nodes[start:start + self.BLOCK_SIZE]))
+        self.__buildTree()
+
+    def __buildTree(self):
+        """
+        Build the tree of frontiers over the blocks. The tree is kept in an
+        array where position 1 is the root, the childs of position p are 2p
+        and 2p + 1 and the leaves, from position size on, are the frontiers
+        of the blocks in index order. Leaves without a block are empty.
+        """
+        size = 1
+        while(size < len(self._blocks)):
+            size *= 2
+        self._size = size
+        self._frontiers = [([], [])] * (2 * size)
+        for (position, block) in enumerate(self._blocks):
+            block.position = position
+            self._frontiers[size + position] = block.frontier
+        for position in xrange(size - 1, 0, -1):
+            self._frontiers[position] = self.__merged(position)
+
+    def __merged(self, position):
+        """
+        Get the frontier of the childs of the position in the tree.
+        """
+        (left_widths, left_heights) = self._frontiers[2 * position]
+        (right_widths, right_heights) = self._frontiers[2 * position + 1]
+        return _frontier(zip(left_widths + right_widths, left_heights + right_heights))
+
+    def __updateTree(self, block):
+        """
+        Update the tree with the frontier of the block, from its leaf
+        up to the first position left unchanged.
+        """
+        position = self._size + block.position
+        self._frontiers[position] = block.frontier
+        position //= 2
+        while(0 < position):
+            frontier = self.__merged(position)
+            if(frontier == self._frontiers[position]):
+                break
+            self._frontiers[position] = frontier
+            position //= 2
+
+    def first(self, width, height):
+        """
+        Find the first free space node, in tree order, where the rectangle
+        defined by the width and height will fit. None is returned if
+        no free space node will fit the rectangle.
+        """
+        if(not _frontierFits(self._frontiers[1], width, height)):
+            return None
+        position = 1
+        while(position < self._size):
+            position *= 2
+            if(not _frontierFits(self._frontiers[position], width, height)):
+                position += 1
+        for node in self._blocks[position - self._size].nodes:
+            if(width <= node.width and height <= node.height):
+                return node
+        return None
+
+    def replace(self, node, nodes):
+        """
+        Replace a node that is no longer free with the free space
+        nodes split from it. The nodes take the place of the node
+        in the index order, which is the order of the layout tree
+        when the nodes are the childs of the node. The node must
+        still have its free space extent when it's replaced.
+        """
+        block = node.block
+        node.block = None
+        position = block.nodes.index(node)
+        block.nodes[position:position + 1] = nodes
+        for free_node in nodes:
+            free_node.block = block
+        if(len(block.nodes) > 2 * self.BLOCK_SIZE):
+            half = len(block.nodes) // 2
+            split = FreeSpaceBlock(block.nodes[half:])
+            del block.nodes[half:]
+            block.update()
+            self._blocks.insert(block.position + 1, split)
+            self.__buildTree()
+        elif(0 == len(block.nodes)):
+            del self._blocks[block.position]
+            self.__buildTree()
+        elif(block.onFrontier(node)):
+            # The nodes split from the node fit within it, so the frontier
+            # of the block only changes if the node was on the frontier
+            block.update()
+            self.__updateTree(block)
+
+
 class Layout(object):
     """
     Represents and builds the rectangle layout.
@@ -79,7 +278,7 @@ class Layout(object):
     support methods to calculate the actual area used
     by the rectangles (nodes) placed in the layout.
     """
-    def __init__(self, width, height):
+    def __init__(self, width, height, rotate = False):
         """
         Initialize the layout with a width and height representing
         the initial free space the following rectangles should
@@ -88,10 +287,12 @@ class Layout(object):
         large value that will not be exhausted. Take care not setting
         both directions to open-ended because the rectangles added will
         end up in a single row or column so one direction should be locked.
+        If rotate is set rectangles may be turned 90 degrees to fit better.
         """
         self._root = Node(0, 0, width, height)
+        self._rotate = rotate
         self._partitioning = self.__selectPartitioning(width, height)
-        self._free_node = None
+        self._free = FreeSpaceIndex([self._root])
         self._allocated = []
 
     def __selectPartitioning(self, width, height):
@@ -106,30 +307,39 @@ class Layout(object):
         else:
             return PartitioningDirection.Y
 
-    def __traverse(self, node, width, height):
+    def __walk(self):
         """
-        Traverse the tree for first usable node
-        that is not allocated and will fit the
-        recgtangle, width and height.
+        Generator function for all nodes in the layout tree, allocated
+        or not. The tree is walked with an explicit stack so degenerate
+        trees, from long single row or column layouts, can't exhaust
+        the recursion limit. A node is yielded before its childs, which
+        lets the caller remove the childs before they are visited.
         """
-        if((not node is None) and (self._free_node is None)):
-            self.__traverse(node.left, width, height)
-            if((not node.allocated) and (width <= node.width and height <= node.height)):
-                self._free_node = node
-            self.__traverse(node.right, width, height)
-
+        stack = [self._root]
+        while(stack):
+            node = stack.pop()
+            yield node
+            if(not node.right is None):
+                stack.append(node.right)
+            if(not node.left is None):
+                stack.append(node.left)
 
-    def __findFreeSpace(self, width, height):
+    def __freeNodes(self):
         """
-        Traverse the layout tree for a free space node
-        where the rectangle defined by the width and height
-        will fit. If a free space node could not be found
-        it means the initial rectangle space has been
-        exhausted and None will be returned.
+        Generator function for the unallocated nodes in the layout
+        tree in the order of a left to right traversal of the tree.
         """
-        self._free_node = None
-        self.__traverse(self._root, width, height)
-        return self._free_node
+        stack = []
+        node = self._root
+        while(stack or (not node is None)):
+            if(not node is None):
+                stack.append(node)
+                node = node.left
+            else:
+                node = stack.pop()
+                if(not node.allocated):
+                    yield node
+                node = node.right
 
     def __freeSpaceBelowAllocation(self, node, width, height):
         """
@@ -170,6 +380,17 @@ class Layout(object):
             raise RectangleLayoutError("Unknown partitioning direction")
         return Node(x_beside, y_beside, width_beside, height_beside)
 
+
+    def __growth(self, node, width, height):
+        """
+        Calculate how far the layout extends in the open-ended direction
+        if the rectangle defined by the width and the height is
+        allocated from the node.
+        """
+        if(PartitioningDirection.Y == self._partitioning):
+            return node.y + height
+        return node.x + width
+
         
     def insert(self, width, height, item):
         """
@@ -182,82 +403,610 @@ class Layout(object):
         node. The free space node with the smallest area will
         be inserted on the left child while the one with the
         largest area will be inserted on the right child.
+        If the layout may rotate the rectangles, the rectangle is turned
+        when the first node the turned rectangle fits extends the layout
+        less in the open-ended direction.
+        Return: the allocated node
         """
-        node = self.__findFreeSpace(width, height)
+        node = self._free.first(width, height)
+        rotated = False
+        if(self._rotate and width != height):
+            turned = self._free.first(height, width)
+            if((not turned is None) and (node is None or self.__growth(turned, height, width) < self.__growth(node, width, height))):
+                (node, width, height, rotated) = (turned, height, width, True)
         if(node is None):
             raise RectangleLayoutError("No free space left in the layout")
-        print "Allocate from", node
         # Place the rectangle into the layout starting by calculating
         # the free space areas that will be left when the rectangle
         # has been allocated from the node.
         node_below = self.__freeSpaceBelowAllocation(node, width, height)
         node_beside = self.__freeSpaceBesideAllocation(node, width, height)
+        # Place the smallest free space area to the left in the tree
+        if(node_below.area < node_beside.area):
+            (left, right) = (node_below, node_beside)
+        else:
+            (left, right) = (node_beside, node_below)
+        # Check if the left and right nodes are usabled taking
+        # area of the in to account and set unusable nodes to None.
+        if(0 >= left.area):
+            left = None
+        if(0 >= right.area):
+            right = None
+        # Replace the node in the free space index with the free
+        # space nodes left after the allocation, before the node
+        # gets the extent of the rectangle.
+        self._free.replace(node, [child for child in (left, right) if not child is None])
         # Allocate the rectangle in the node
         node.allocated = True
         node.item = item
+        node.rotated = rotated
         node.width = width
         node.height = height
+        node.left = left
+        node.right = right
         # Add the allocated node to the allocated list
         self._allocated.append(node)
-        print "After allocation", node
-        # Place the smallest free space area to the left in the tree
-        if(node_below.area < node_beside.area):
-            node.left = node_below
-            node.right = node_beside
-        else:
-            node.left = node_beside
-            node.right = node_below
-        # Check if the left and right nodes are usabled taking
-        # area of the in to account and set unusable nodes to None.
-        if(0 >= node.left.area):
-            node.left = None
-        if(0 >= node.right.area):
-            node.right = None
-        print "Left:", node.left
-        print "Right:", node.right
-        print "-----------------------------------------------"
+        return node
 
 
-    def __prune_traverse(self, node):
+    def prune(self):
         """
-        Traverse the layout tree removing unallocated nodes.
+        Prune the layout tree by removing all unallocated nodes.
         """
-        if(not node is None):
-            self.__prune_traverse(node.left)
+        for node in self.__walk():
             if((not node.left is None) and (not node.left.allocated)):
                 node.left = None
             if((not node.right is None) and (not node.right.allocated)):
                 node.right = None
-            self.__prune_traverse(node.right)
+        self._free.rebuild(self.__freeNodes())
 
-    def prune(self):
+
+    def bounding(self):
         """
-        Prune the layout tree by removing all unallocated nodes.
+        Return the width and height of the layouts bounding rectangle.
+        Its returned as a 2-tuple (width, height).
         """
-        self.__prune_traverse(self._root)
+        width = 0
+        height = 0
+        for node in self.__walk():
+            width = max(width, node.x + node.width)
+            height = max(height, node.y + node.height)
+        return (width, height)
+
+
+    def nodes(self):
+        """
+        Generator function for nodes in the layout.
+        """
+        for node in self._allocated:
+            yield node
 
 
-    def __bounding_traverse(self, node, width, height):
+class PlacementLayout(object):
+    """
+    Base class for layouts placing the rectangles directly as allocated
+    nodes, without a layout tree of free space nodes. Like Layout one of
+    the directions can be open-ended by setting its size to sys.maxint.
+    The layout works along a fixed direction, which is the smallest of
+    the width and height, and grows in the other direction. Subclasses
+    implement insert in fixed and growing coordinates and allocate the
+    rectangles through _allocate, which maps them back to x and y.
+    If rotate is set the subclasses may turn the rectangles 90 degrees
+    when that fits them better. Used as is, the layout only holds placed
+    rectangles, like the placements of a cached build, and can't insert.
+    """
+    def __init__(self, width, height, rotate = False):
         """
-        Traverse the layout tree calculating the bounding box.
+        Initialize the layout with a width and height representing
+        the free space the rectangles should fit within.
         """
-        max_width = width
-        max_height = height
-        if(not node is None):
-            (max_width_left, max_height_left) = self.__bounding_traverse(node.left, max_width, max_height)
-            (max_width_right, max_height_right) = self.__bounding_traverse(node.right, max_width, max_height)
-            max_width = max(max_width, max_width_left, max_width_right, node.x + node.width)
-            max_height = max(max_height, max_height_left, max_height_right, node.y + node.height)
-        return (max_width, max_height)
+        self._rotate = rotate
+        self._transposed = width > height
+        if(self._transposed):
+            (self._fixed, self._limit) = (height, width)
+        else:
+            (self._fixed, self._limit) = (width, height)
+        self._allocated = []
+
+    def _extent(self, width, height):
+        """
+        Convert a width and height to the extent along the fixed
+        and the growing direction of the layout.
+        Return: (fixed, growing)
+        """
+        if(self._transposed):
+            return (height, width)
+        return (width, height)
+
+    def _allocate(self, u, v, width, height, item, rotated = False):
+        """
+        Allocate a node for the rectangle defined by width and height
+        at u in the fixed direction and v in the growing direction.
+        """
+        if(self._transposed):
+            node = Node(v, u, width, height, True, item)
+        else:
+            node = Node(u, v, width, height, True, item)
+        node.rotated = rotated
+        self._allocated.append(node)
+        return node
+
+    def place(self, x, y, width, height, item, rotated = False):
+        """
+        Place a rectangle at a fixed position, for instance a placement
+        from a previous layout, where rotated tells if the width and
+        height are those of the turned rectangle. Placements aren't checked
+        for overlaps.
+        """
+        node = Node(x, y, width, height, True, item)
+        node.rotated = rotated
+        self._allocated.append(node)
+        return node
+
+    def insert(self, width, height, item):
+        """
+        Insert a rectangle into the layout by supplying
+        width, height and an item reference. Only subclasses
+        can insert, this layout only holds placed rectangles.
+        Return: the allocated node
+        """
+        raise RectangleLayoutError("The layout only holds placed rectangles")
+
+    def prune(self):
+        """
+        Nothing to prune because only allocated nodes are kept.
+        """
+        pass
 
     def bounding(self):
         """
         Return the width and height of the layouts bounding rectangle.
         Its returned as a 2-tuple (width, height).
         """
-        (width, height) = self.__bounding_traverse(self._root, 0, 0)
+        width = 0
+        height = 0
+        for node in self._allocated:
+            width = max(width, node.x + node.width)
+            height = max(height, node.y + node.height)
         return (width, height)
 
+    def nodes(self):
+        """
+        Generator function for nodes in the layout.
+        """
+        for node in self._allocated:
+            yield node
+
+
+class ShelfLayout(PlacementLayout):
+    """
+    Shelf layout placing the rectangles next to each other on a shelf
+    along the fixed direction and opening a new shelf when the current
+    one is full (next fit). Each insert is constant time, so with the
+    rectangles sorted by decreasing size in the growing direction the
+    layout is O(n log n), trading density for speed on very large sets.
+    """
+    def __init__(self, width, height, rotate = False):
+        """
+        Initialize the layout with a width and height.
+        """
+        PlacementLayout.__init__(self, width, height, rotate)
+        self._shelf = 0
+        self._shelf_depth = 0
+        self._cursor = 0
+
+    def __fit(self, fixed, growing):
+        """
+        Find the level the top of the shelf would be at if a rectangle with
+        the fixed and growing extent is placed, and whether the rectangle
+        starts a shelf, new or empty. None is returned if it doesn't fit.
+        Return: (top of the shelf, starts a shelf) or None
+        """
+        if(fixed > self._fixed):
+            return None
+        if(self._cursor + fixed > self._fixed):
+            fit = (self._shelf + self._shelf_depth + growing, True)
+        else:
+            fit = (self._shelf + max(self._shelf_depth, growing), 0 == self._cursor)
+        if(fit[0] > self._limit):
+            return None
+        return fit
+
+    def insert(self, width, height, item):
+        """
+        Insert a rectangle on the current shelf or on a new
+        shelf if the current one can't hold the rectangle.
+        If the layout may rotate the rectangles, the rectangle is turned
+        when it would never fit the layout as it is, or when it takes less
+        of the current shelf turned without deepening the shelf. Otherwise a
+        rectangle starting a shelf isn't turned, so the depth of the shelves
+        is set by the order of the rectangles, like without rotation.
+        With the rectangles sorted by decreasing size in the growing direction
+        only wide rectangles can be turned, so the layout rarely rotates.
+        """
+        (fixed, growing) = self._extent(width, height)
+        fit = self.__fit(fixed, growing)
+        rotated = False
+        if(self._rotate and width != height):
+            level = self._shelf + self._shelf_depth
+            turned = self.__fit(growing, fixed)
+            if((not turned is None) and
+               ((fixed > self._fixed or growing > self._limit) or
+                ((not turned[1]) and turned[0] == level and growing < fixed))):
+                (fit, fixed, growing, width, height, rotated) = (turned, growing, fixed, height, width, True)
+        if(fit is None):
+            raise RectangleLayoutError("No free space left in the layout")
+        if(self._cursor + fixed > self._fixed):
+            self._shelf = self._shelf + self._shelf_depth
+            self._shelf_depth = 0
+            self._cursor = 0
+        node = self._allocate(self._cursor, self._shelf, width, height, item, rotated)
+        self._cursor = self._cursor + fixed
+        self._shelf_depth = max(self._shelf_depth, growing)
+        return node
+
+
+class SkylineLayout(PlacementLayout):
+    """
+    Skyline layout keeping the outline of the placed rectangles as a
+    list of segments [position, level, length] along the fixed direction.
+    Each rectangle is placed bottom-left, at the lowest level where it
+    fits, and space hidden below the skyline is never reused.
+    """
+    def __init__(self, width, height, rotate = False):
+        """
+        Initialize the layout with a width and height.
+        """
+        PlacementLayout.__init__(self, width, height, rotate)
+        self._skyline = [[0, 0, self._fixed]]
+
+    def __fit(self, index, fixed):
+        """
+        Find the level a rectangle with the fixed extent would be placed
+        at if it starts at the segment with the index. None is returned
+        if the rectangle would extend beyond the fixed direction.
+        """
+        position = self._skyline[index][0]
+        if(position + fixed > self._fixed):
+            return None
+        level = 0
+        remaining = fixed
+        while(0 < remaining):
+            (segment_position, segment_level, segment_length) = self._skyline[index]
+            level = max(level, segment_level)
+            remaining = remaining - segment_length
+            index = index + 1
+        return level
+
+    def __place(self, index, fixed, top):
+        """
+        Raise the skyline to the top level over the fixed extent
+        starting at the segment with the index.
+        """
+        position = self._skyline[index][0]
+        end = position + fixed
+        self._skyline.insert(index, [position, top, fixed])
+        following = index + 1
+        while(following < len(self._skyline)):
+            segment = self._skyline[following]
+            if(segment[0] >= end):
+                break
+            if(segment[0] + segment[2] <= end):
+                del self._skyline[following]
+            else:
+                segment[2] = segment[0] + segment[2] - end
+                segment[0] = end
+                break
+        # Merge neighbouring segments on the same level
+        merged = [self._skyline[0]]
+        for segment in self._skyline[1:]:
+            if(merged[-1][1] == segment[1]):
+                merged[-1][2] = merged[-1][2] + segment[2]
+            else:
+                merged.append(segment)
+        self._skyline = merged
+
+    def __lowest(self, fixed):
+        """
+        Find the segment where a rectangle with the fixed extent would be
+        placed at the lowest level, the leftmost if several positions are
+        on that level. None is returned if the rectangle doesn't fit.
+        Return: (index of the segment, level) or (None, None)
+        """
+        best_index = None
+        best_level = None
+        for index in xrange(len(self._skyline)):
+            level = self.__fit(index, fixed)
+            if((not level is None) and (best_level is None or level < best_level)):
+                best_index = index
+                best_level = level
+        return (best_index, best_level)
+
+    def insert(self, width, height, item):
+        """
+        Insert a rectangle at the lowest level of the skyline where it fits,
+        using the leftmost position if several positions are on that level.
+        If the layout may rotate the rectangles, the rectangle is turned
+        when the top of the turned rectangle would be lower.
+        """
+        (fixed, growing) = self._extent(width, height)
+        (best_index, best_level) = self.__lowest(fixed)
+        rotated = False
+        if(self._rotate and width != height):
+            (index, level) = self.__lowest(growing)
+            if((not level is None) and level + fixed <= self._limit and (best_level is None or level + fixed < best_level + growing)):
+                (best_index, best_level, fixed, growing, width, height, rotated) = (index, level, growing, fixed, height, width, True)
+        if(best_level is None or best_level + growing > self._limit):
+            raise RectangleLayoutError("No free space left in the layout")
+        position = self._skyline[best_index][0]
+        node = self._allocate(position, best_level, width, height, item, rotated)
+        self.__place(best_index, fixed, best_level + growing)
+        return node
+
+
+class MaxRectsLayout(PlacementLayout):
+    """
+    MaxRects layout keeping the maximal free rectangles of the layout,
+    which may overlap each other. Each rectangle is placed in the free
+    rectangle leaving the shortest leftover side (best short side fit),
+    and ties are broken by the longest leftover side. It's slower than
+    the other layouts but gives the densest layouts, which means smaller
+    sprites.
+    """
+    def __init__(self, width, height, rotate = False, free = None):
+        """
+        Initialize the layout with a width and height. The free space is
+        the whole layout, or the free rectangles, given as (x, y, width,
+        height) tuples within the layout, like the space around placements
+        kept from a previous layout. The rectangles may overlap.
+        """
+        PlacementLayout.__init__(self, width, height, rotate)
+        self.__restricted = not free is None
+        if(free is None):
+            self._free = [(0, 0, self._fixed, self._limit)]
+        else:
+            self._free = []
+            for (x, y, free_width, free_height) in free:
+                (u, v) = self._extent(x, y)
+                (fixed, growing) = self._extent(free_width, free_height)
+                fixed = min(fixed, self._fixed - u)
+                growing = min(growing, self._limit - v)
+                if(0 < fixed and 0 < growing):
+                    self._free.append((u, v, fixed, growing))
+            self.__pruneFree()
+
+    def __split(self, free, placed):
+        """
+        Split the free rectangle by the placed rectangle returning
+        the maximal free rectangles left around the placed rectangle.
+        Both are given as (u, v, fixed, growing) tuples.
+        """
+        (u, v, fixed, growing) = free
+        (placed_u, placed_v, placed_fixed, placed_growing) = placed
+        if(placed_u >= u + fixed or placed_u + placed_fixed <= u or
+           placed_v >= v + growing or placed_v + placed_growing <= v):
+            return [free]
+        split = []
+        if(placed_u > u):
+            split.append((u, v, placed_u - u, growing))
+        if(placed_u + placed_fixed < u + fixed):
+            split.append((placed_u + placed_fixed, v, u + fixed - placed_u - placed_fixed, growing))
+        if(placed_v > v):
+            split.append((u, v, fixed, placed_v - v))
+        if(placed_v + placed_growing < v + growing):
+            split.append((u, placed_v + placed_growing, fixed, v + growing - placed_v - placed_growing))
+        return split
+
+    def __pruneFree(self):
+        """
+        Remove free rectangles contained in other free rectangles.
+        """
+        free = sorted(set(self._free), key = lambda rectangle: rectangle[2] * rectangle[3], reverse = True)
+        kept = []
+        for (u, v, fixed, growing) in free:
+            contained = False
+            for (kept_u, kept_v, kept_fixed, kept_growing) in kept:
+                if(kept_u <= u and kept_v <= v and u + fixed <= kept_u + kept_fixed and v + growing <= kept_v + kept_growing):
+                    contained = True
+                    break
+            if(not contained):
+                kept.append((u, v, fixed, growing))
+        self._free = kept
+
+    def insert(self, width, height, item):
+        """
+        Insert a rectangle in the free rectangle where it fits best.
+        If the layout may rotate the rectangles, the turned rectangle is
+        scored as well and placed if it fits better.
+        """
+        orientations = [(width, height, False)]
+        if(self._rotate and width != height):
+            orientations.append((height, width, True))
+        best = None
+        best_score = None
+        for (placed_width, placed_height, rotated) in orientations:
+            (fixed, growing) = self._extent(placed_width, placed_height)
+            for free in self._free:
+                if(fixed <= free[2] and growing <= free[3]):
+                    leftover_fixed = free[2] - fixed
+                    leftover_growing = free[3] - growing
+                    score = (min(leftover_fixed, leftover_growing), max(leftover_fixed, leftover_growing), free[1], free[0])
+                    if(best_score is None or score < best_score):
+                        best = (free[0], free[1], fixed, growing, placed_width, placed_height, rotated)
+                        best_score = score
+        if(best is None):
+            raise RectangleLayoutError("No free space left in the layout")
+        (u, v, fixed, growing, width, height, rotated) = best
+        self.__occupy((u, v, fixed, growing))
+        return self._allocate(u, v, width, height, item, rotated)
+
+    def __occupy(self, placed):
+        """
+        Remove the placed rectangle, given as a (u, v, fixed, growing)
+        tuple, from the free rectangles of the layout.
+        """
+        free = []
+        for rectangle in self._free:
+            free.extend(self.__split(rectangle, placed))
+        self._free = free
+        self.__pruneFree()
+
+    def place(self, x, y, width, height, item, rotated = False):
+        """
+        Place a rectangle at a fixed position, for instance a placement
+        from a previous layout. A rectangle within the free space is removed
+        from it, so following inserts are placed around it. In a layout
+        created with the free space around the placements kept from a previous
+        layout, a kept placement outside all of the free space is placed as is.
+        """
+        if(self._transposed):
+            (u, v, fixed, growing) = (y, x, height, width)
+        else:
+            (u, v, fixed, growing) = (x, y, width, height)
+        for (free_u, free_v, free_fixed, free_growing) in self._free:
+            if(free_u <= u and free_v <= v and u + fixed <= free_u + free_fixed and v + growing <= free_v + free_growing):
+                self.__occupy((u, v, fixed, growing))
+                break
+        else:
+            if(not self.__restricted):
+                raise RectangleLayoutError("Placement is outside the free space of the layout")
+            for (free_u, free_v, free_fixed, free_growing) in self._free:
+                if(u < free_u + free_fixed and free_u < u + fixed and v < free_v + free_growing and free_v < v + growing):
+                    raise RectangleLayoutError("Placement is partly outside the free space of the layout")
+        return PlacementLayout.place(self, x, y, width, height, item, rotated)
+
+
+class Spacing(object):
+    """
+    Spacing of the rectangles in a SpacedLayout. The padding is the empty
+    space between neighbouring rectangles, the extrude the border of
+    repeated edge pixels drawn around each rectangle and the align the
+    multiple of pixels the positions of the rectangles are aligned to.
+    With powerOfTwo the bounding rectangle of the layout is rounded up to
+    powers of two. A rectangle is packed as a cell holding the extruded
+    rectangle and the padding to its right and below it, so neighbouring
+    rectangles share the padding between them instead of each having its
+    own, and the margin left and above the cells aligns the rectangles.
+    """
+    def __init__(self, padding = 0, extrude = 0, align = 1, powerOfTwo = False):
+        """
+        Initialize the spacing, which defaults to no spacing at all.
+        """
+        self.padding = padding
+        self.extrude = extrude
+        self.align = align
+        self.powerOfTwo = powerOfTwo
+        self.margin = (0 - extrude) % align
+        self.offset = self.margin + extrude
+
+    spaced = property(lambda self : (0 != self.padding or 0 != self.extrude or 1 != self.align or self.powerOfTwo), None, None, None)
+
+    def cell(self, width, height):
+        """
+        Get the size of the cell packed for a rectangle, rounded up to
+        the alignment so the positions of the cells stay aligned.
+        Return: (width, height)
+        """
+        width = width + 2 * self.extrude + self.padding
+        height = height + 2 * self.extrude + self.padding
+        return (width + (0 - width) % self.align, height + (0 - height) % self.align)
+
+    def limit(self, size):
+        """
+        Get the extent of the layout the cells are packed in for a width
+        or height of the bounding rectangle. The padding of the cells at
+        the right and bottom edges is outside the bounding rectangle, so it
+        may extend beyond it, while the margin takes space from it.
+        """
+        if(sys.maxint <= size):
+            return size
+        return size + self.padding - self.margin
+
+
+def _powerOfTwo(size):
+    """
+    Round the size up to a power of two, leaving 0 as is.
+    """
+    if(0 == size):
+        return 0
+    return 1 << (size - 1).bit_length()
+
+
+class SpacedLayout(object):
+    """
+    Layout packing the rectangles with the Spacing of padding, extrusion
+    and alignment given. The cells of the rectangles are packed by the layout
+    it wraps, so every algorithm measures the free space with the padding
+    and extrusion included, while the nodes of this layout are positioned
+    at the rectangles within the cells. The bounding rectangle covers the
+    extruded rectangles but not the padding to the right and below the
+    last cells, which is only needed between neighbouring rectangles.
+    """
+    def __init__(self, layout, spacing):
+        """
+        Initialize the layout with the layout the cells are packed in,
+        created with extents given by Spacing.limit, and the spacing.
+        """
+        self._layout = layout
+        self._spacing = spacing
+        self._allocated = []
+
+    def __node(self, cell, width, height, item):
+        """
+        Allocate the node of a rectangle of the width and height, as
+        placed, from the node of the cell it's packed in.
+        """
+        offset = self._spacing.offset
+        node = Node(cell.x + offset, cell.y + offset, width, height, True, item)
+        node.rotated = cell.rotated
+        self._allocated.append(node)
+        return node
+
+    def insert(self, width, height, item):
+        """
+        Insert a rectangle into the layout by supplying
+        width, height and an item reference.
+        Return: the allocated node
+        """
+        (cell_width, cell_height) = self._spacing.cell(width, height)
+        cell = self._layout.insert(cell_width, cell_height, item)
+        if(cell.rotated):
+            (width, height) = (height, width)
+        return self.__node(cell, width, height, item)
+
+    def place(self, x, y, width, height, item, rotated = False):
+        """
+        Place a rectangle at a fixed position, for instance a placement
+        from a previous layout with the same spacing. The position
+        must leave room for the margin and extrusion and be aligned.
+        """
+        offset = self._spacing.offset
+        if(x < offset or y < offset or 0 != (x - offset) % self._spacing.align or 0 != (y - offset) % self._spacing.align):
+            raise RectangleLayoutError("Placement doesn't fit the spacing of the layout")
+        (cell_width, cell_height) = self._spacing.cell(width, height)
+        return self.__node(self._layout.place(x - offset, y - offset, cell_width, cell_height, item, rotated), width, height, item)
+
+    def prune(self):
+        """
+        Prune the layout the cells are packed in.
+        """
+        self._layout.prune()
+
+    def bounding(self):
+        """
+        Return the width and height of the layouts bounding rectangle,
+        rounded up to powers of two if the spacing says so.
+        Its returned as a 2-tuple (width, height).
+        """
+        extrude = self._spacing.extrude
+        width = 0
+        height = 0
+        for node in self._allocated:
+            width = max(width, node.x + node.width + extrude)
+            height = max(height, node.y + node.height + extrude)
+        if(self._spacing.powerOfTwo):
+            return (_powerOfTwo(width), _powerOfTwo(height))
+        return (width, height)
 
     def nodes(self):
         """
@@ -266,4 +1015,24 @@ class Layout(object):
         for node in self._allocated:
             yield node
 
-            
+
+# Registry of the layout algorithms by name. All layouts are created
+# with a width, a height and whether they may rotate the rectangles, and
+# support insert, prune, bounding and nodes.
+LAYOUTS = {
+    "guillotine" : Layout,
+    "maxrects" : MaxRectsLayout,
+    "skyline" : SkylineLayout,
+    "shelf" : ShelfLayout,
+}
+
+
+def createLayout(algorithm, width, height, rotate = False):
+    """
+    Create a layout using the layout algorithm registered
+    with the name supplied in the algorithm argument.
+    If rotate is set the layout may turn rectangles 90 degrees.
+    """
+    if(not algorithm in LAYOUTS):
+        raise RectangleLayoutError(str.format("Unknown layout algorithm {0}", algorithm))
+    return LAYOUTS[algorithm](width, height, rotate)
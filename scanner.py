@@ -0,0 +1,223 @@
+__copyright__ = """
+Copyright 2011 James Lindstorff
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from fnmatch import fnmatch
+from multiprocessing.pool import ThreadPool
+import os
+import os.path
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+# Extensions of the image files PIL can open, which are taken
+# as images without reading the files.
+IMAGE_EXTENSIONS = frozenset([
+    ".bmp", ".dib", ".gif", ".ico", ".jpe", ".jpeg", ".jpg", ".pbm", ".pgm",
+    ".png", ".pnm", ".ppm", ".ras", ".rgb", ".sgi", ".tif", ".tiff", ".webp",
+    ".xbm",
+])
+
+
+def sniffImage(filename):
+    """
+    Detect if a file is an image by the magic bytes at the start of the file,
+    recognizing the image types of the imghdr module, which is gone from newer
+    Pythons, and icons.
+    Return: the image type or None if the file isn't an image
+    """
+    try:
+        f = open(filename, "rb")
+        try:
+            head = f.read(32)
+        finally:
+            f.close()
+    except IOError:
+        return None
+    if(head.startswith("\x89PNG\r\n\x1a\n")):
+        return "png"
+    if(head.startswith("\xff\xd8\xff") or head[6:10] in ("JFIF", "Exif")):
+        return "jpeg"
+    if(head[:6] in ("GIF87a", "GIF89a")):
+        return "gif"
+    if(head.startswith("BM")):
+        return "bmp"
+    if(head[:4] in ("MM\x00\x2a", "II\x2a\x00")):
+        return "tiff"
+    if(head.startswith("RIFF") and head[8:12] == "WEBP"):
+        return "webp"
+    if(len(head) >= 3 and head[0] == "P" and head[1] in "123456" and head[2] in " \t\n\r"):
+        return {"1" : "pbm", "4" : "pbm", "2" : "pgm", "5" : "pgm", "3" : "ppm", "6" : "ppm"}[head[1]]
+    if(head.startswith("\x59\xa6\x6a\x95")):
+        return "rast"
+    if(head.startswith("#define ")):
+        return "xbm"
+    if(head.startswith("\x01\xda")):
+        return "rgb"
+    if(head.startswith("\x00\x00\x01\x00")):
+        return "ico"
+    return None
+
+
+def _listDirectory(directory):
+    """
+    List a directory with scandir, or listdir where scandir isn't available.
+    Symbolic links to directories are listed as directories, but aren't
+    to be walked, like os.walk does. A directory that can't be listed
+    is empty, like os.walk treats it.
+    Return: (list of file names, list of (directory name, is symbolic link))
+    """
+    files = []
+    directories = []
+    try:
+        if(scandir is None):
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                if(os.path.isdir(path)):
+                    directories.append((name, os.path.islink(path)))
+                else:
+                    files.append(name)
+        else:
+            for entry in scandir(directory):
+                try:
+                    is_directory = entry.is_dir()
+                except OSError:
+                    is_directory = False
+                if(is_directory):
+                    directories.append((entry.name, entry.is_symlink()))
+                else:
+                    files.append(entry.name)
+    except OSError:
+        pass
+    return (files, directories)
+
+
+class DirectoryScanner(object):
+    """
+    Scan a directory tree for image files. Files are filtered by extension
+    first, files with an image extension are taken without being read, even
+    if they aren't images, and files without one are detected by their
+    content when sniffing and otherwise skipped. Files and directories can be
+    included and excluded by glob patterns, matched against the path relative
+    to the scanned directory if the pattern has a slash and otherwise against
+    the name. Excluded directories aren't scanned. When sniffing, the
+    directories of each level of the tree are scanned concurrently by a pool
+    of threads. The files are returned in the order os.walk would find them.
+    """
+    def __init__(self, include = (), exclude = (), sniff = True, workers = 1):
+        """
+        Initialize the scanner with the glob patterns of files to include, all
+        files if none, and of files and directories to exclude, whether to
+        sniff files without an image extension and the number of threads.
+        """
+        self.include = list(include)
+        self.exclude = list(exclude)
+        self.sniff = sniff
+        self.workers = workers
+
+    def __matches(self, relative, patterns):
+        """
+        Check if the relative path matches any of the glob patterns.
+        """
+        name = os.path.basename(relative)
+        for pattern in patterns:
+            if("/" in pattern):
+                if(fnmatch(relative, pattern)):
+                    return True
+            elif(fnmatch(name, pattern)):
+                return True
+        return False
+
+    def __isImage(self, path, name, relative, known):
+        """
+        Check if a file is an image to include.
+        """
+        if(self.include and not self.__matches(relative, self.include)):
+            return False
+        if(self.exclude and self.__matches(relative, self.exclude)):
+            return False
+        if(os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS):
+            return True
+        if(not self.sniff):
+            return False
+        if((not known is None) and known(path)):
+            return True
+        return not sniffImage(path) is None
+
+    def __scanDirectory(self, arguments):
+        """
+        Scan a directory, given with its path relative to the scanned directory
+        and the predicate telling if a file is a known image.
+        Return: (list of image files, list of (subdirectory, relative path) to scan)
+        """
+        (directory, relative, known) = arguments
+        (files, directories) = _listDirectory(directory)
+        # Joined by hand, os.path.join is a large part of the time in big directories
+        prefix = os.path.join(directory, "")
+        relativePrefix = relative and relative + "/"
+        images = []
+        for name in files:
+            path = prefix + name
+            if(self.__isImage(path, name, relativePrefix + name, known)):
+                images.append(path)
+        subdirectories = []
+        for (name, link) in directories:
+            subrelative = relativePrefix + name
+            if(not link and not self.__matches(subrelative, self.exclude)):
+                subdirectories.append((prefix + name, subrelative))
+        return (images, subdirectories)
+
+    def scan(self, directory, known = None):
+        """
+        Scan the directory tree for image files. The known predicate tells if a
+        file is known to be an image, like an unchanged image in a build cache,
+        so it isn't sniffed.
+        Return: list of the image filenames
+        """
+        scanned = {}
+        level = [(directory, "")]
+        pool = None
+        # Listing directories is mostly done by the interpreter, holding the
+        # GIL, so the threads only pay off when files are read for sniffing
+        if(self.sniff and 1 < self.workers):
+            pool = ThreadPool(self.workers)
+        try:
+            while level:
+                work = [(path, relative, known) for (path, relative) in level]
+                if(pool is None or 1 == len(work)):
+                    results = map(self.__scanDirectory, work)
+                else:
+                    results = pool.map(self.__scanDirectory, work)
+                level = []
+                for ((path, relative, predicate), result) in zip(work, results):
+                    scanned[path] = result
+                    level.extend(result[1])
+        finally:
+            if(not pool is None):
+                pool.close()
+                pool.join()
+        # Order the images like a top down os.walk, the files of a directory
+        # before those of its subdirectories
+        images = []
+        stack = [directory]
+        while stack:
+            (files, subdirectories) = scanned[stack.pop()]
+            images.extend(files)
+            stack.extend(path for (path, relative) in reversed(subdirectories))
+        return images
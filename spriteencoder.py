@@ -0,0 +1,342 @@
+__copyright__ = """
+Copyright 2011 James Lindstorff
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from array import array
+import os
+import struct
+import threading
+import time
+import zlib
+from PIL import Image
+from atomicfile import AtomicFile
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Encoder presets trading encoding time against file size. The compression
+# level is the zlib level and optimize lets PIL search for the best filters.
+ENCODER_PRESETS = {
+    "fast" : {"compress_level" : 1, "optimize" : False},
+    "default" : {"compress_level" : 6, "optimize" : False},
+    "max" : {"compress_level" : 9, "optimize" : True},
+}
+
+# Settings for the other sprite formats by preset. WebP is written lossless,
+# where the quality is the compression effort, while AVIF is lossy.
+FORMAT_PRESETS = {
+    "webp" : {
+        "fast" : {"lossless" : True, "quality" : 0, "method" : 0},
+        "default" : {"lossless" : True, "quality" : 80, "method" : 4},
+        "max" : {"lossless" : True, "quality" : 100, "method" : 6},
+    },
+    "avif" : {
+        "fast" : {"quality" : 90, "speed" : 10},
+        "default" : {"quality" : 90, "speed" : 6},
+        "max" : {"quality" : 90, "speed" : 0},
+    },
+}
+
+# MIME types of the sprite formats.
+FORMAT_TYPES = {
+    "png" : "image/png",
+    "webp" : "image/webp",
+    "avif" : "image/avif",
+}
+
+PNG_SIGNATURE = "\x89PNG\r\n\x1a\n"
+
+
+def formatSupported(format):
+    """
+    Check if PIL can write the sprite format, which depends on the
+    libraries PIL was built with and the plugins installed.
+    """
+    Image.init()
+    return format.upper() in Image.SAVE
+
+
+def formatFilename(filename, format):
+    """
+    Get the filename of a sprite in a format. PNG sprites are written
+    to the filename while other formats replace its extension.
+    """
+    if("png" == format):
+        return filename
+    return os.path.splitext(filename)[0] + "." + format
+
+
+def reducePalette(image):
+    """
+    Reduce an RGBA image to a palette image if it has 256 colours or fewer.
+    The reduction is lossless, every colour including its alpha value gets
+    an entry in the palette, unlike PIL's quantize. None is returned if
+    the image has more than 256 colours. The pixels are looked up as 32-bit
+    keys in a table of the colours, by numpy if it's installed and otherwise
+    by a dict lookup mapped over the pixels.
+    """
+    colors = image.getcolors(256)
+    if(colors is None):
+        return None
+    palette = [color for (count, color) in colors]
+    keys = "".join(struct.pack("4B", *color) for color in palette)
+    data = image.tobytes()
+    if(numpy is None):
+        lookup = dict((key, index) for (index, key) in enumerate(array("I", keys)))
+        pixels = array("I")
+        pixels.fromstring(data)
+        indices = str(bytearray(map(lookup.__getitem__, pixels)))
+    else:
+        keys = numpy.frombuffer(keys, numpy.uint32)
+        order = numpy.argsort(keys)
+        indices = order[numpy.searchsorted(keys[order], numpy.frombuffer(data, numpy.uint32))].astype(numpy.uint8).tobytes()
+    reduced = Image.frombytes("P", image.size, indices)
+    rgb = []
+    for color in palette:
+        rgb.extend(color[:3])
+    reduced.putpalette(rgb)
+    reduced.info["transparency"] = "".join(chr(color[3]) for color in palette)
+    return reduced
+
+
+def _chunk(kind, data):
+    """
+    Build a PNG chunk of the kind with the data.
+    """
+    checksum = zlib.crc32(kind + data) & 0xffffffff
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", checksum)
+
+
+def _deflateBand(data, level, last, streams, index):
+    """
+    Compress a band of scanlines to a raw deflate stream stored in the
+    streams list at the index. All but the last band are ended with a
+    full flush, so the streams can be concatenated into a single stream.
+    This runs in a thread, zlib releases the GIL while compressing.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    if(last):
+        streams[index] = compressor.compress(data) + compressor.flush(zlib.Z_FINISH)
+    else:
+        streams[index] = compressor.compress(data) + compressor.flush(zlib.Z_FULL_FLUSH)
+
+
+def writeBandedPNG(image, filename, level, threads):
+    """
+    Write an RGBA or palette image as a PNG file, deflating bands of
+    scanlines in parallel with a thread per band. The scanlines are written
+    without filtering, which is what makes them independent of each other,
+    and the compressed bands are joined into a single zlib stream.
+    """
+    (width, height) = image.size
+    if("P" == image.mode):
+        header = struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0)
+        stride = width
+    else:
+        image = image.convert("RGBA")
+        header = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+        stride = 4 * width
+    data = image.tobytes()
+    rows = ["\x00" + data[row * stride:(row + 1) * stride] for row in xrange(height)]
+    bands = max(1, min(threads, height))
+    band_rows = (height + bands - 1) // bands
+    work = ["".join(rows[start:start + band_rows]) for start in xrange(0, height, band_rows)]
+    streams = [None] * len(work)
+    deflaters = []
+    for (index, band) in enumerate(work):
+        deflater = threading.Thread(target = _deflateBand, args = (band, level, index == len(work) - 1, streams, index))
+        deflater.start()
+        deflaters.append(deflater)
+    checksum = 1
+    for band in work:
+        checksum = zlib.adler32(band, checksum)
+    for deflater in deflaters:
+        deflater.join()
+    # The zlib header of a deflate stream with a 32K window
+    compressed = "\x78\x9c" + "".join(streams) + struct.pack(">I", checksum & 0xffffffff)
+    f = AtomicFile(filename, "wb")
+    try:
+        f.write(PNG_SIGNATURE)
+        f.write(_chunk("IHDR", header))
+        if("P" == image.mode):
+            f.write(_chunk("PLTE", "".join(chr(value) for value in image.getpalette()[:3 * len(image.info["transparency"])])))
+            f.write(_chunk("tRNS", image.info["transparency"]))
+        f.write(_chunk("IDAT", compressed))
+        f.write(_chunk("IEND", ""))
+    except:
+        f.discard()
+        raise
+    f.close()
+
+
+class PNGStreamWriter(object):
+    """
+    Write an RGBA PNG file from bands of scanlines, top to bottom, so the
+    whole image is never held in memory. The scanlines are deflated as the
+    bands arrive, without filtering, and written as IDAT chunks of about
+    chunkSize bytes to an AtomicFile.
+    """
+    def __init__(self, filename, size, level, chunkSize = 262144):
+        """
+        Initialize the writer with the filename and size, (width, height),
+        of the image and the zlib compression level.
+        """
+        (self.width, self.height) = size
+        self.rows = 0
+        self.written = 0
+        self._chunkSize = chunkSize
+        self._pending = []
+        self._pendingSize = 0
+        self._compressor = zlib.compressobj(level)
+        self._file = AtomicFile(filename, "wb")
+        try:
+            self.__write(PNG_SIGNATURE)
+            self.__write(_chunk("IHDR", struct.pack(">IIBBBBB", self.width, self.height, 8, 6, 0, 0, 0)))
+        except:
+            self._file.discard()
+            raise
+
+    def __write(self, data):
+        self._file.write(data)
+        self.written += len(data)
+
+    def __compressed(self, data, final = False):
+        """
+        Collect compressed data, writing an IDAT chunk when enough is
+        collected or when final.
+        """
+        if(data):
+            self._pending.append(data)
+            self._pendingSize += len(data)
+        if(self._pendingSize >= self._chunkSize or (final and self._pending)):
+            self.__write(_chunk("IDAT", "".join(self._pending)))
+            self._pending = []
+            self._pendingSize = 0
+
+    def write(self, band):
+        """
+        Write the next band, an RGBA image as wide as the PNG image.
+        """
+        (width, rows) = band.size
+        if(width != self.width or self.rows + rows > self.height):
+            raise ValueError(str.format("Band of {0} x {1} doesn't fit the image", width, rows))
+        data = band.tobytes()
+        stride = 4 * width
+        scanlines = "".join("\x00" + data[row * stride:(row + 1) * stride] for row in xrange(rows))
+        self.__compressed(self._compressor.compress(scanlines))
+        self.rows += rows
+
+    def close(self):
+        """
+        Finish the PNG file and replace the file with it.
+        Return: bytes written
+        """
+        if(self.rows != self.height):
+            self.discard()
+            raise ValueError(str.format("Only {0} of {1} rows were written", self.rows, self.height))
+        try:
+            self.__compressed(self._compressor.flush(), True)
+            self.__write(_chunk("IEND", ""))
+        except:
+            self._file.discard()
+            raise
+        self._file.close()
+        return self.written
+
+    def discard(self):
+        """
+        Remove the partially written file, leaving the file as it was.
+        """
+        self._file.discard()
+
+
+def _save(image, filename, format, settings):
+    """
+    Save the image in the format with the settings of PIL to an AtomicFile.
+    """
+    f = AtomicFile(filename, "wb")
+    try:
+        image.save(f, format, **settings)
+    except:
+        f.discard()
+        raise
+    f.close()
+
+
+class SpriteEncoder(object):
+    """
+    Encode sprites in one or more formats using an encoder preset.
+    PNG files can optionally be reduced to palette images when they have
+    256 colours or fewer and be deflated in bands of scanlines in parallel.
+    """
+    def __init__(self, preset = "default", palette = False, threads = 1, formats = ("png",)):
+        """
+        Initialize the encoder with the name of a preset from ENCODER_PRESETS,
+        whether to try palette reduction and the number of threads deflating
+        bands of scanlines, where a single thread lets PIL encode the PNG file,
+        and the formats to encode the sprites in.
+        """
+        self.preset = preset
+        self.palette = palette
+        self.threads = threads
+        self.formats = formats
+
+    def encode(self, image, filename):
+        """
+        Encode the image, an RGBA sprite, in each of the formats. All formats
+        are encoded from the same image, which is never copied, and written
+        to the filename of the format given by formatFilename. Each file is
+        written as an AtomicFile, replacing the file when it's complete.
+        Return: list of (filename, format, mode, bytes written, seconds used)
+        """
+        encoded = []
+        for format in self.formats:
+            format_filename = formatFilename(filename, format)
+            if("png" == format):
+                (mode, written, seconds) = self.encodePNG(image, format_filename)
+            else:
+                start = time.time()
+                _save(image, format_filename, format.upper(), FORMAT_PRESETS[format][self.preset])
+                (mode, written, seconds) = (image.mode, os.path.getsize(format_filename), time.time() - start)
+            encoded.append((format_filename, format, mode, written, seconds))
+        return encoded
+
+    def streamPNG(self, filename, size):
+        """
+        Create a PNGStreamWriter for a sprite of the size written in bands,
+        compressed at the level of the preset. Streamed sprites are only
+        written as RGBA PNG files.
+        """
+        return PNGStreamWriter(filename, size, ENCODER_PRESETS[self.preset]["compress_level"])
+
+    def encodePNG(self, image, filename):
+        """
+        Encode the image, an RGBA sprite, to a PNG file named by the filename.
+        Return: (mode, bytes written, seconds used)
+        """
+        start = time.time()
+        settings = ENCODER_PRESETS[self.preset]
+        if(self.palette):
+            reduced = reducePalette(image)
+            if(not reduced is None):
+                image = reduced
+        if(1 < self.threads):
+            writeBandedPNG(image, filename, settings["compress_level"], self.threads)
+        elif("P" == image.mode):
+            _save(image, filename, "PNG", dict(settings, transparency = image.info["transparency"]))
+        else:
+            _save(image, filename, "PNG", settings)
+        return (image.mode, os.path.getsize(filename), time.time() - start)
@@ -13,78 +13,422 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
-import imghdr
+import hashlib
+import itertools
+import json
+import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 from optparse import OptionParser
 from optparse import OptionGroup
+from optparse import OptionValueError
 import os
 import os.path
 import re
 import string
 import sys
+import time
 from PIL import Image
-from rectanglelayout import Layout
+from atomicfile import AtomicFile
+from atomicfile import isTemporary
+from buildcache import BuildCache
+from buildcache import fileFingerprint
+from buildcache import fileHash
+from buildcache import fileStat
+from compositor import PILCompositor
+from csswriter import BUFFER_SIZE
+from csswriter import COMPRESSIONS
+from csswriter import ClassNames
+from csswriter import compressionSupported
+from emitters import EMITTERS
+from emitters import EmitterError
+from emitters import SpriteEntry
+from emitters import SpriteSheet
+from emitters import createEmitter
+from emitters import cssEntries
+from instrumentation import Stats
+from instrumentation import log
+from instrumentation import logOutput
+from instrumentation import profiled
+from instrumentation import tracemalloc
+from layoutoptimizer import optimizeLayout
+from rectanglelayout import LAYOUTS
+from rectanglelayout import MaxRectsLayout
+from rectanglelayout import PlacementLayout
 from rectanglelayout import RectangleLayoutError
+from rectanglelayout import SpacedLayout
+from rectanglelayout import Spacing
+from rectanglelayout import createLayout
+from scanner import DirectoryScanner
+from spriteencoder import ENCODER_PRESETS
+from spriteencoder import FORMAT_TYPES
+from spriteencoder import SpriteEncoder
+from spriteencoder import formatFilename
+from spriteencoder import formatSupported
+from watcher import createWatcher
+
+
+class SpritifyError(Exception):
+    """
+    Error raised when spritifying fails or, for library use, when
+    the configuration is invalid.
+    """
+    def __init__(self, value):
+        """
+        Initialize the error with a value.
+        """
+        self.value = value
+
+    def __str__(self):
+        """
+        String representation of the spritify error.
+        """
+        return repr(self.value)
+
+
+class _LibraryOptionParser(OptionParser):
+    """
+    OptionParser raising SpritifyError instead of exiting the
+    program on errors, for parsing arguments given by a library user.
+    """
+    def error(self, msg):
+        raise SpritifyError(msg)
+
+    def exit(self, status = 0, msg = None):
+        raise SpritifyError(msg)
 
 
 class SpritifyConfiguration(object):
     """
     Create a configuration for running the spritification from the command line arguments supplied.
     """
-    def __init__(self):
+    def __init__(self, arguments = None, **options):
         """
         Create a SprifityConfiguration object by parsing command line arguments.
+        Without arguments sys.argv is parsed and errors exit the program with
+        a usage message. For library use the arguments are a list of command
+        line arguments and the options, named like the destinations of the
+        command line options (css, sprite, layout, ...), override the parsed
+        options. Errors then raise SpritifyError.
         """
         self.directory = None
         self.verbose = None
+        self.logLevel = None
+        self.stats = None
+        self.profile = None
+        self.traceMemory = None
+        self.scanStarted = None
+        self.scanSeconds = None
         self.stop = None
         self.writeHtmlOverview = None
         self.cssfilename = None
         self.cssClassname = None
         self.cssimagepath = None
+        self.minify = None
+        self.compressions = None
+        self.emitters = None
         self.spriteFilename = None
+        self.layout = None
+        self.workers = None
+        self.decodeProcesses = None
+        self.cachefilename = None
+        self.cache = None
+        self.stable = None
+        self.repackThreshold = None
+        self.duplicates = None
+        self.trim = None
+        self.maxSize = None
+        self.group = None
+        self.encoder = None
+        self.palette = None
+        self.encodeThreads = None
+        self.canvas = None
+        self.canvasMemory = None
+        self.optimize = None
+        self.candidates = None
+        self.timeBudget = None
+        self.seed = None
+        self.spacing = None
+        self.rotate = None
+        self.formats = None
+        self.densities = None
+        self.variants = None
+        self.include = None
+        self.exclude = None
+        self.sniff = None
         self.imagefiles = None
-        parser = self._setupOptionParser()
-        self._parseArguments(parser)
+        self.batch = None
+        self.jobs = None
+        self.watch = None
+        self.debounce = None
+        self.pollInterval = None
+        library = (not arguments is None) or (0 < len(options))
+        parser = self._setupOptionParser(library)
+        if(library and arguments is None):
+            arguments = []
+        self._parseArguments(parser, arguments, options)
         parser.destroy()
         pass
 
-    def _setupOptionParser(self):
+    def _setupOptionParser(self, library = False):
         """
-        Setup the OptionParser for the command line parsing.
+        Setup the OptionParser for the command line parsing. For library
+        use the parser raises SpritifyError instead of exiting and doesn't
+        write the HTML overview by default.
         """
         usage = """usage: %prog [options] directory"""
         version = """%prog 0.1"""
         description = """Create a sprint and a corresponding CSS file from images in the directory argument. If the directory isn't supplied the current directory will be used."""
-        parser = OptionParser(usage = usage, version=version, description=description)
-        parser.add_option("-v", "--verbose", action="store_true", default=False, dest="verbose", help="Verbose output during sprite and CSS generation.")
+        if(library):
+            parser = _LibraryOptionParser(usage = usage, version=version, description=description)
+        else:
+            parser = OptionParser(usage = usage, version=version, description=description)
+        parser.add_option("-v", "--verbose", action="store_true", default=False, dest="verbose", help="Verbose output during sprite and CSS generation, down to every image placed in the sprite.")
+        parser.add_option("-q", "--quiet", action="store_true", default=False, dest="quiet", help="Only output warnings and errors.")
+        parser.add_option("--stats", dest="stats", type="choice", choices=["text", "json"], default=None, help="Report the counts, bytes and durations of the stages of the build, scan, probe, layout, decode, compose, encode and write, as text or as a JSON document on a line of its own. With json the progress output goes to stderr, so stdout only holds the report.")
+        parser.add_option("--profile", dest="profile", default=None, help="Profile the build with cProfile and write the profile to this file, for pstats or other profile viewers.")
+        parser.add_option("--trace-memory", action="store_true", default=False, dest="traceMemory", help="Trace memory allocations with tracemalloc and report the peak of the traced memory in the stats. Requires tracemalloc.")
         parser.add_option("-f", "--stop", action="store_true", default=False, dest="stop", help="Stop if PIL fails to open an image file, normal operation is simply skipping files that can't be opened.")
+        parser.add_option("-w", "--workers", dest="workers", type="int", default=8, help="Number of threads opening image files and reading their headers. (Default: 8)")
+        parser.add_option("-d", "--decode-processes", dest="decodeProcesses", type="int", default=0, help="Number of processes decoding the image files while the sprite is drawn. Normally the images are decoded one at a time by the drawing process. (Default: 0)")
+        parser.add_option("-i", "--include", dest="include", action="append", default=[], help="Glob pattern of the image files to include, like *.png or icons/*. Patterns with a slash match the path relative to the directory, others the file name. Can be given several times. (Default: all images)")
+        parser.add_option("-x", "--exclude", dest="exclude", action="append", default=[], help="Glob pattern of image files and directories to exclude, like *.jpg or node_modules. Excluded directories aren't scanned. Can be given several times.")
+        parser.add_option("--no-sniff", action="store_false", default=True, dest="sniff", help="Skip files without an image extension instead of detecting images by their content, so only files with an image extension, like .png, are considered images.")
+        parser.add_option("--cache", dest="cache", default=None, help="Name of a build cache file. Image sizes are reused from the cache for unchanged files and nothing is written if neither the images, the options nor the written files changed since the previous build.")
+        parser.add_option("--batch", dest="batch", default=None, help="Run the jobs in a JSON manifest instead of spritifying a directory. The manifest is a list of jobs, each a list of command line arguments or an object with the directory and options named like the destinations of the command line options. Other options are ignored.")
+        parser.add_option("-j", "--jobs", dest="jobs", type="int", default=multiprocessing.cpu_count(), help="Number of processes running batch jobs or scoring candidate layouts when optimizing. (Default: number of CPUs)")
+        parser.add_option("--watch", action="store_true", default=False, dest="watch", help="Keep running and build the sprite again when images in the directory change. Image sizes and the drawn sprites are kept in memory, so only changed images are read again.")
+        parser.add_option("--debounce", dest="debounce", type="int", default=50, help="Milliseconds without changes to wait for before building the sprite again when watching. (Default: 50)")
+        parser.add_option("--poll-interval", dest="pollInterval", type="float", default=0.5, help="Seconds between checks for changed images when watching without inotify. (Default: 0.5)")
         parser.add_option("-o", "--nooverview", action="store_false", default=True, dest="overview", help="HTML overview file will be created if this option is set. The file is named overview.html and written in current directory.")
+        parser.add_option("--overview", action="store_true", dest="overview", help="Write the HTML overview file, which library calls and batch jobs don't do by default, because they would all write overview.html in the current directory.")
         # Group for CSS options
         cssGroup = OptionGroup(parser, "CSS options")
         cssGroup.add_option("-c", "--css", dest="css", default="sprite.css", help="Name of the CSS file. (Default: sprite.css)")
         cssGroup.add_option("-n", "--classname", dest="classname", default="sprite", help="Name of the CSS class defining the background url. Don't prefix the classname with a period that is done by the CSS writer. (Default: sprite)")
         cssGroup.add_option("-p", "--cssimagepath", dest="cssimagepath", default="", help="Path to prefix the sprite name with in the background-image url. Should be used if the sprite and CSS files are not written to the same directory.")
+        cssGroup.add_option("--minify", action="store_true", default=False, dest="minify", help="Write a minified CSS file alongside the CSS file, named like sprite.min.css.")
+        cssGroup.add_option("--precompress", dest="precompress", default="", help=str.format("Comma separated list of compressions, from {0}, to write pre-compressed copies of the CSS files with, named like sprite.css.gz, for servers sending them without compressing at request time. Brotli requires the brotli module.", ", ".join(sorted(COMPRESSIONS.keys()))))
+        cssGroup.add_option("-E", "--emitters", dest="emitters", default="css", help=str.format("Comma separated list of emitters writing the sprite classes and coordinates, from {0}, or emitter classes named like module:class. The css and compact emitters write the CSS file, where compact sizes and positions the images through custom properties, while the others write a file named by replacing the extension of the CSS file. (Default: css)", ", ".join(sorted(EMITTERS.keys()))))
         parser.add_option_group(cssGroup)
         # Group for sprite options
         spriteGroup = OptionGroup(parser, "Sprite options")
         spriteGroup.add_option("-s", "--sprite", dest="sprite", default="sprite.png", help="Name of the sprite file. (Default: sprite.png)")
+        spriteGroup.add_option("-u", "--duplicates", dest="duplicates", type="choice", choices=["keep", "file", "pixels"], default="file", help="Detection of duplicate images, which are packed once in the sprite with a CSS class per image. Use file to detect identical files, pixels to also detect images with identical pixels and keep to pack every image. (Default: file)")
+        spriteGroup.add_option("-t", "--trim", action="store_true", default=False, dest="trim", help="Trim transparent borders from the images before packing them. The CSS pads the trimmed images back to their original size.")
+        spriteGroup.add_option("-m", "--max-size", dest="maxSize", default=None, help="Maximum size, WIDTHxHEIGHT, of a sprite. Images that don't fit in one sprite are spread over several sprites named by numbering the sprite file, each with its own CSS background class.")
+        spriteGroup.add_option("-g", "--group", dest="group", type="choice", choices=["none", "directory"], default="none", help="Grouping of the images when they are spread over several sprites. Use directory to give the images of each directory sprites of their own, so pages only load the sprites they need. (Default: none)")
+        spriteGroup.add_option("--stable", action="store_true", default=False, dest="stable", help="Keep images in the place they had in the previous build and place new images in the free space left. Requires a build cache.")
+        spriteGroup.add_option("--repack-threshold", dest="repackThreshold", type="float", default=0.35, help="Fraction of the sprite area left empty by a stable layout before all images are packed again. (Default: 0.35)")
+        spriteGroup.add_option("-e", "--encoder", dest="encoder", type="choice", choices=sorted(ENCODER_PRESETS.keys()), default="default", help=str.format("PNG encoder preset, one of {0}. The fast preset encodes quickly to larger files while max searches for the smallest file. (Default: default)", ", ".join(sorted(ENCODER_PRESETS.keys()))))
+        spriteGroup.add_option("--palette", action="store_true", default=False, dest="palette", help="Write sprites with 256 colours or fewer as palette PNG files. The reduction is lossless.")
+        spriteGroup.add_option("--encode-threads", dest="encodeThreads", type="int", default=1, help="Number of threads deflating bands of the sprite in parallel. Bands are written without PNG filtering, which is faster but gives larger files. (Default: 1)")
+        spriteGroup.add_option("--canvas", dest="canvas", type="choice", choices=["memory", "stream"], default="memory", help="Canvas the sprites are drawn on. Use stream to draw the sprites in bands of scanlines, written to the PNG file as they are drawn, so memory use is bounded whatever the size of the sprite. Streamed sprites are RGBA PNG files written without filtering, which are larger. (Default: memory)")
+        spriteGroup.add_option("--canvas-memory", dest="canvasMemory", type="int", default=64, help="Megabytes of memory a streamed sprite is drawn in, holding the band drawn and the images spanning several bands. (Default: 64)")
+        spriteGroup.add_option("-F", "--formats", dest="formats", default="png", help=str.format("Comma separated list of formats to write the sprite in, from {0}. The PNG sprite is always written, as the fallback, and the other formats replace the extension of the sprite file. The CSS lets browsers pick the first format they support, in the order given, with PNG last if it isn't given. (Default: png)", ", ".join(sorted(FORMAT_TYPES.keys()))))
+        spriteGroup.add_option("-D", "--densities", dest="densities", default="1", help="Comma separated list of pixel densities to write sprites for, like 1,2,3. The images are laid out once and a sprite is drawn per density, named like sprite@2x.png, from image files named like icon@2x.png if found and otherwise by resampling the image. The CSS selects the sprite by the device pixel ratio. (Default: 1)")
+        spriteGroup.add_option("-l", "--layout", dest="layout", type="choice", choices=sorted(LAYOUTS.keys()), default="guillotine", help=str.format("Layout algorithm used to pack the images, one of {0}. The shelf layout is the fastest for very large sets while maxrects gives the densest, and smallest, sprites. (Default: guillotine)", ", ".join(sorted(LAYOUTS.keys()))))
+        spriteGroup.add_option("--padding", dest="padding", type="int", default=0, help="Pixels of transparent space between neighbouring images in the sprite, so scaled or zoomed backgrounds don't bleed the pixels of the neighbours into the images. The padding is shared by neighbours, so images are this far apart, plus their extrusion. (Default: 0)")
+        spriteGroup.add_option("--extrude", dest="extrude", type="int", default=0, help="Pixels to extrude the edges of the images by, repeating the outermost pixels of an image around it, so scaled backgrounds blend with the edge of the image itself. (Default: 0)")
+        spriteGroup.add_option("--align", dest="align", type="int", default=1, help="Align the positions of the images in the sprite to multiples of this many pixels. (Default: 1)")
+        spriteGroup.add_option("--power-of-two", action="store_true", default=False, dest="powerOfTwo", help="Round the width and height of the sprites up to powers of two. A maximum sprite size must be powers of two as well.")
+        spriteGroup.add_option("--rotate", action="store_true", default=False, dest="rotate", help="Let the layout turn images 90 degrees clockwise where that packs them better. The json and msgpack emitters mark the rotated images, for consumers turning them back, like WebGL texture atlases, while CSS can't show them, so the css, compact and scss emitters leave them out.")
+        spriteGroup.add_option("--optimize", action="store_true", default=False, dest="optimize", help="Search for the layout with the smallest sprite by trying several orders of the images, sorted by area, longest side, perimeter, width and height, in strips of several widths, and then randomly jittered orders. The candidates are scored in parallel by the --jobs processes. Can't be combined with a maximum sprite size.")
+        spriteGroup.add_option("--candidates", dest="candidates", type="int", default=64, help="Number of candidate layouts the optimizer scores. The same images, candidates and seed always give the same sprite. (Default: 64)")
+        spriteGroup.add_option("--time-budget", dest="timeBudget", type="float", default=None, help="Seconds after which the optimizer stops scoring candidates, even if fewer than --candidates are scored. The layout found then depends on the speed and load of the machine, so builds aren't reproducible. (Default: no limit)")
+        spriteGroup.add_option("--seed", dest="seed", type="int", default=0, help="Seed of the random orders tried by the optimizer. The same images and seed give the same candidates. (Default: 0)")
         parser.add_option_group(spriteGroup)
+        if(library):
+            # Library calls and batch jobs would all write the overview
+            # to the current directory, so they only write it if asked to
+            parser.set_defaults(overview = False)
         return parser
 
-    def _parseArguments(self, parser):
+    def _checkOverride(self, parser, option, value):
+        """
+        Check an override of the option and convert it like the value given on
+        the command line. Flags take True or False and options without a
+        default take None. Options given several times take a list of values,
+        or a string for a single value. Numbers are taken as the string they are
+        written as, so densities = 2 is like --densities=2.
+        Return: the converted value
+        """
+        if(not option.takes_value()):
+            if(not isinstance(value, bool)):
+                parser.error(str.format("Option {0} takes True or False, not {1!r}", option.dest, value))
+            return value
+        if(value is None and parser.defaults.get(option.dest) is None):
+            return None
+        if("append" == option.action):
+            if(isinstance(value, basestring)):
+                # A single pattern, like giving the option once
+                value = [value]
+            if(not isinstance(value, (list, tuple))):
+                parser.error(str.format("Option {0} takes a list of values, not {1!r}", option.dest, value))
+            return [self._checkValue(parser, option, item) for item in value]
+        return self._checkValue(parser, option, value)
+
+    def _checkValue(self, parser, option, value):
+        """
+        Check a single value of an override and convert it to the type of the option.
+        Return: the converted value
+        """
+        if(isinstance(value, (int, long, float)) and not isinstance(value, bool)):
+            value = str(value)
+        if(not isinstance(value, basestring)):
+            parser.error(str.format("Option {0} takes a string or a number, not {1!r}", option.dest, value))
+        try:
+            return option.check_value(option.get_opt_string(), value)
+        except OptionValueError as error:
+            parser.error(str(error))
+
+    def _parseArguments(self, parser, arguments = None, overrides = None):
         """
         Parse the command line arguments with the OptionParser supplied in the parser argument
         and supply the validation of the positional argument directory and other
         options that needs further validation before the configuration is finalized.
+        The arguments are parsed from sys.argv if None and the options are
+        overridden by the overrides, named by their destination, which are
+        converted and checked like the command line options.
         """
-        (options, arguments) = parser.parse_args()
+        (options, arguments) = parser.parse_args(arguments)
+        destinations = {}
+        for option in parser.option_list + sum([group.option_list for group in parser.option_groups], []):
+            destinations[option.dest] = option
+        for (name, value) in (overrides or {}).items():
+            if(not name in destinations):
+                parser.error(str.format("Unknown option {0}", name))
+            setattr(options, name, self._checkOverride(parser, destinations[name], value))
+        if(options.verbose and options.quiet):
+            parser.error("Verbose and quiet can't be combined")
         self.verbose = options.verbose
+        self.logLevel = logging.INFO
+        if(options.verbose):
+            self.logLevel = logging.DEBUG
+        elif(options.quiet):
+            self.logLevel = logging.WARNING
+        if(options.traceMemory and tracemalloc is None):
+            parser.error("Tracing memory requires the tracemalloc module")
+        self.stats = options.stats
+        self.profile = options.profile
+        self.traceMemory = options.traceMemory
+        if(not options.batch is None):
+            if(1 > options.jobs):
+                parser.error("The number of jobs must be at least 1")
+            self.batch = os.path.abspath(os.path.expanduser(options.batch))
+            self.jobs = options.jobs
+            return
         self.stop = options.stop
         self.writeHtmlOverview = options.overview
         self.cssfilename = os.path.abspath(os.path.expanduser(options.css))
         self.cssClassname = options.classname
         self.cssimagepath = options.cssimagepath
+        self.minify = options.minify
+        self.compressions = []
+        for compression in options.precompress.split(","):
+            compression = compression.strip().lower()
+            if(not compression):
+                continue
+            if(not compression in COMPRESSIONS):
+                parser.error(str.format("Unknown compression {0}", compression))
+            if(not compressionSupported(compression)):
+                parser.error(str.format("The {0} compression requires the {0} module", compression))
+            if(not compression in self.compressions):
+                self.compressions.append(compression)
+        self.emitters = []
+        for name in options.emitters.split(","):
+            name = name.strip()
+            if(not name or name in self.emitters):
+                continue
+            try:
+                createEmitter(name, self.cssfilename)
+            except EmitterError as error:
+                parser.error(error.value)
+            self.emitters.append(name)
+        if(0 == len(self.emitters)):
+            parser.error("At least one emitter is needed")
+        if("css" in self.emitters and "compact" in self.emitters):
+            parser.error("The css and compact emitters both write the CSS file, use one of them")
         self.spriteFilename = os.path.abspath(os.path.expanduser(options.sprite))
+        self.layout = options.layout
+        if(1 > options.workers):
+            parser.error("The number of workers must be at least 1")
+        self.workers = options.workers
+        if(0 > options.decodeProcesses):
+            parser.error("The number of decode processes can't be negative")
+        self.decodeProcesses = options.decodeProcesses
+        self.include = options.include
+        self.exclude = options.exclude
+        self.sniff = options.sniff
+        if(not options.cache is None):
+            self.cachefilename = os.path.abspath(os.path.expanduser(options.cache))
+            self.cache = BuildCache(self.cachefilename)
+        if(options.stable and self.cache is None):
+            parser.error("A stable layout requires a build cache, use --cache")
+        self.stable = options.stable
+        if(not 0.0 <= options.repackThreshold <= 1.0):
+            parser.error("The repack threshold must be between 0 and 1")
+        self.repackThreshold = options.repackThreshold
+        self.duplicates = options.duplicates
+        self.trim = options.trim
+        if(not options.maxSize is None):
+            match = re.match("""^(\d+)x(\d+)$""", options.maxSize)
+            if(match is None):
+                parser.error(str.format("{0} is not a size like 2048x2048", options.maxSize))
+            self.maxSize = (int(match.group(1)), int(match.group(2)))
+            if(options.stable):
+                parser.error("A stable layout can't be combined with a maximum sprite size")
+        self.group = options.group
+        self.encoder = options.encoder
+        self.palette = options.palette
+        if(1 > options.encodeThreads):
+            parser.error("The number of encode threads must be at least 1")
+        self.encodeThreads = options.encodeThreads
+        if(1 > options.canvasMemory):
+            parser.error("The canvas memory must be at least 1 megabyte")
+        self.canvas = options.canvas
+        if(options.optimize and not options.maxSize is None):
+            parser.error("The optimizer places the images in a single sheet and can't be combined with a maximum sprite size")
+        if(1 > options.candidates):
+            parser.error("The optimizer needs at least 1 candidate")
+        if((not options.timeBudget is None) and 0 > options.timeBudget):
+            parser.error("The time budget can't be negative")
+        if(1 > options.jobs):
+            parser.error("The number of jobs must be at least 1")
+        if(0 > options.padding):
+            parser.error("The padding can't be negative")
+        if(0 > options.extrude):
+            parser.error("The extrusion can't be negative")
+        if(1 > options.align):
+            parser.error("The alignment must be at least 1 pixel")
+        if(options.powerOfTwo and (not self.maxSize is None) and any(0 != size & (size - 1) for size in self.maxSize)):
+            parser.error("Sprites sized to powers of two need a maximum sprite size of powers of two")
+        self.spacing = Spacing(options.padding, options.extrude, options.align, options.powerOfTwo)
+        self.rotate = options.rotate
+        self.optimize = options.optimize
+        self.candidates = options.candidates
+        self.timeBudget = options.timeBudget
+        self.seed = options.seed
+        self.jobs = options.jobs
+        self.canvasMemory = 1048576 * options.canvasMemory
+        formats = [format.strip().lower() for format in options.formats.split(",") if format.strip()]
+        for format in formats:
+            if(not format in FORMAT_TYPES):
+                parser.error(str.format("Unknown sprite format {0}", format))
+            if(not formatSupported(format)):
+                parser.error(str.format("PIL can't write the sprite format {0}", format))
+        # PNG is always written, as the fallback, after the formats given
+        # if it isn't one of them, the formats keep the order of preference
+        self.formats = []
+        for format in formats + ["png"]:
+            if(not format in self.formats):
+                self.formats.append(format)
+        densities = set([1])
+        for density in options.densities.split(","):
+            if(not re.match("""^\s*\d+\s*$""", density) or 1 > int(density)):
+                parser.error(str.format("{0} is not a pixel density like 2", density.strip()))
+            densities.add(int(density))
+        self.densities = sorted(densities)
         # Directory will be current working directory unless a positional argument is
         # supplied on the command line. If the argument isn't a directory it's considered
         # a parse error.
@@ -97,47 +441,459 @@ class SpritifyConfiguration(object):
         self.directory = arg_dir
         # Check for image files in the directory and fail with parse error if no
         # image files where found in the directory tree.
-        self.imagefiles = self._imagefiles(arg_dir)
+        self.rescan()
+        if(0 > options.debounce):
+            parser.error("The debounce time can't be negative")
+        if(0 >= options.pollInterval):
+            parser.error("The poll interval must be positive")
+        self.watch = options.watch
+        if("stream" == self.canvas):
+            if(1 < len(self.formats)):
+                parser.error("Streamed sprites are only written as PNG files")
+            if(self.palette):
+                parser.error("Streamed sprites can't be palette images")
+            if(self.watch):
+                parser.error("Streamed sprites can't be drawn again when watching, use the memory canvas")
+        self.debounce = options.debounce
+        self.pollInterval = options.pollInterval
+        if(self.watch and self.cache is None):
+            self.cache = BuildCache(None)
         if(0 == len(self.imagefiles)):
             parser.error(str.format("No image files found in {0}", self.directory))
 
+    def rescan(self):
+        """
+        Find the image files in the directory tree again, after files
+        were added or removed. Unchanged images in the build cache
+        are not detected again. The time the scan started is kept in
+        scanStarted and the time used in scanSeconds.
+        """
+        self.scanStarted = time.time()
+        self.imagefiles = self._imagefiles(self.directory)
+        self.scanSeconds = time.time() - self.scanStarted
+
     def _imagefiles(self, directory):
         """
         Traverse the directory and get a list of all images in the directory tree.
-        Image files are detected using imghdr module and all file returning 
-        something other that None will be included in the image file list.
+        The tree is scanned by a DirectoryScanner with the include and exclude
+        patterns, taking files with an image extension and, unless sniffing is
+        turned off, detecting images by their content. Files that are unchanged images
+        in the build cache are not sniffed again.
+        With several densities, images named like icon@2x.png are collected
+        as the variants of icon.png instead of being images of their own.
         """
         imagefiles = []
-        imagefilesnoext = []
-        for root, dirs, files in os.walk(directory):
-            for filename in files:
-                absfilename = os.path.join(root, filename);
-                imagetype = imghdr.what(absfilename)
-                if not None is imagetype:
-                    (noextension, extension) = os.path.splitext(absfilename)
-                    if noextension in imagefilesnoext:
-                        print str.format("File [{0}] already exists with another extension, skipping the file", absfilename)
-                    else:
-                        imagefiles.append(absfilename)
-                        imagefilesnoext.append(noextension)
+        imagefilesnoext = set()
+        self.variants = {}
+        known = None
+        if(not self.cache is None):
+            known = self.cache.isKnownImage
+        scanner = DirectoryScanner(self.include, self.exclude, self.sniff, self.workers)
+        for absfilename in scanner.scan(directory, known):
+            (noextension, extension) = os.path.splitext(absfilename)
+            variant = re.match("""^(.+)@(\d+)x$""", noextension)
+            if((not variant is None) and int(variant.group(2)) in self.densities[1:]):
+                self.variants.setdefault(variant.group(1), {})[int(variant.group(2))] = absfilename
+            elif noextension in imagefilesnoext:
+                log.warning(str.format("File [{0}] already exists with another extension, skipping the file", absfilename))
+            else:
+                imagefiles.append(absfilename)
+                imagefilesnoext.add(noextension)
         return imagefiles
 
 
+def _probeImage(filename):
+    """
+    Open an image file with PIL reading only the header of the image to
+    get its size. The file is closed again before returning, so no file
+    handles or pixel data is kept from probing the image.
+    Return: (filename, size, error) where either size or error is None
+    """
+    try:
+        image = Image.open(filename)
+        try:
+            return (filename, image.size, None)
+        finally:
+            image.close()
+    except IOError as ioe:
+        return (filename, None, ioe)
+
+
+def _probeFingerprintedImage(filename):
+    """
+    Probe an image file like _probeImage and take the fingerprint of the
+    file for the build cache as well, its mtime, size and content hash, so
+    the files are read by the threads probing them instead of one after
+    another when the cache is updated.
+    Return: (filename, size, error, fingerprint) where fingerprint is None on errors
+    """
+    (filename, size, ioe) = _probeImage(filename)
+    if(not ioe is None):
+        return (filename, None, ioe, None)
+    try:
+        return (filename, size, None, fileFingerprint(filename))
+    except (IOError, OSError) as error:
+        return (filename, None, error, None)
+
+
+def _openImage(filename, box, density = 1, variant = None):
+    """
+    Open an image file as a PIL image cropped to the box, or the whole
+    image if the box is None, at a pixel density. Above density 1 the image
+    is taken from the variant file, if it's density times the size of the
+    image, and otherwise resampled from the image. The box is always
+    within the image, so it's scaled by the density for the variant.
+    """
+    image = Image.open(filename)
+    if(1 == density):
+        if(box is None):
+            return image
+        cropped = image.crop(box)
+        image.close()
+        return cropped
+    (width, height) = image.size
+    if(box is None):
+        box = (0, 0, width, height)
+    if(not variant is None):
+        scaled = Image.open(variant)
+        if(scaled.size == (density * width, density * height)):
+            image.close()
+            cropped = scaled.crop(tuple(density * edge for edge in box))
+            scaled.close()
+            return cropped
+        log.warning(str.format("Image [{0}] is not {1} times the size of [{2}], resampling the image", variant, density, filename))
+        scaled.close()
+    (left, top, right, bottom) = box
+    resampled = image.convert("RGBA").crop(box).resize((density * (right - left), density * (bottom - top)), Image.LANCZOS)
+    image.close()
+    return resampled
+
+
+def _decodeImage(arguments):
+    """
+    Open and decode an image file to RGBA, which is the mode of the sprite.
+    The arguments are the filename, the box to crop the image to, or None
+    if the image isn't trimmed, the pixel density and the variant file for
+    the density, or None. This runs in a worker process so the decoded
+    image is returned as the raw data needed to rebuild it in the parent
+    process.
+    Return: (mode, size, data)
+    """
+    (filename, box, density, variant) = arguments
+    image = _openImage(filename, box, density, variant).convert("RGBA")
+    return (image.mode, image.size, image.tobytes())
+
+
+def _alphaBox(filename):
+    """
+    Find the bounding box of the pixels that aren't fully transparent in an
+    image file. The box is found by PIL on the alpha band, so the pixels
+    are not visited in Python. A fully transparent image gives a box with
+    its top left pixel, because an image can't be trimmed to nothing.
+    Return: (left, top, right, bottom)
+    """
+    image = Image.open(filename)
+    try:
+        if(not "A" in image.getbands() and not "transparency" in image.info):
+            return (0, 0) + image.size
+        box = image.convert("RGBA").split()[-1].getbbox()
+        if(box is None):
+            return (0, 0, 1, 1)
+        return box
+    finally:
+        image.close()
+
+
+def _drawPlacements(size, placements, density, extrude, processes):
+    """
+    Draw a sprite of the size from the placements, given as (source filename,
+    trim box, variant, x, y, rotated) tuples, where the box is None for images
+    that aren't trimmed and the variant None for images without a file for the
+    density, extruding the images by the pixels of extrude. The size, positions
+    and extrusion are in pixels of the density. The images are decoded by the
+    number of decode processes, if any.
+    Return: (sprite image, (seconds decoding, seconds compositing))
+    """
+    compositor = PILCompositor(size)
+    seconds = _paste(compositor, _decodedPlacements(placements, density, processes), extrude)
+    return (compositor.image(), seconds)
+
+
+def _drawSheet(arguments):
+    """
+    Draw and encode a sprite sheet. This runs in a worker process, so the
+    arguments are the filename, size and pixel density of the sheet, its
+    placements as for _drawPlacements, the SpriteEncoder to encode it with,
+    the pixels to extrude the images by and the number of decode processes,
+    which a worker process of a pool can't start.
+    Return: (seconds decoding, seconds compositing, list of (filename, format, mode, bytes written, seconds used encoding))
+    """
+    (filename, size, density, placements, encoder, extrude, processes) = arguments
+    (sprite, (decoding, compositing)) = _drawPlacements(size, placements, density, extrude, processes)
+    return (decoding, compositing, encoder.encode(sprite, filename))
+
+
+def _streamSheet(arguments):
+    """
+    Draw a sprite sheet band by band, top to bottom, and stream the bands
+    to a PNG file, so only a band of the sprite is held in memory. This may
+    run in a worker process, so the arguments are the filename, size and
+    pixel density of the sheet, its placements as (source filename, trim
+    box, variant, x, y, width, height, rotated) tuples, where the width and
+    height are those of the image as placed, the SpriteEncoder, the bytes
+    of memory to use and the pixels to extrude the images by. Positions,
+    sizes and extrusion are in pixels of the density. A quarter of the memory
+    goes to the band, the rest keeps images spanning several bands decoded
+    until the last band they are in. Images that don't fit are decoded
+    again for each band.
+    Return: (seconds decoding, seconds compositing, list of (filename, format, mode, bytes written, seconds used encoding))
+    """
+    (filename, (width, height), density, placements, encoder, memory, extrude) = arguments
+    rows = max(1, min(height, memory // 4 // (4 * width)))
+    budget = memory - 4 * width * rows
+    pending = sorted(placements, key = lambda placement: placement[4])
+    following = 0
+    active = []
+    kept = {}
+    kept_bytes = 0
+    (decoding, compositing, encoding) = (0.0, 0.0, 0.0)
+    start = time.time()
+    writer = encoder.streamPNG(filename, (width, height))
+    encoding += time.time() - start
+    try:
+        for top in xrange(0, height, rows):
+            bottom = min(height, top + rows)
+            while(following < len(pending) and pending[following][4] - extrude < bottom):
+                active.append(pending[following])
+                following += 1
+            band = Image.new("RGBA", (width, bottom - top))
+            for placement in active:
+                (source, box, variant, x, y, image_width, image_height, rotated) = placement
+                start = time.time()
+                image = kept.get(placement)
+                if(image is None):
+                    image = _openImage(source, box, density, variant)
+                    image.load()
+                    if(rotated):
+                        image = image.transpose(Image.ROTATE_270)
+                    if(0 < extrude):
+                        image = _extruded(image, extrude)
+                    size = 4 * (image_width + 2 * extrude) * (image_height + 2 * extrude)
+                    if(y + image_height + extrude > bottom and kept_bytes + size <= budget):
+                        kept[placement] = image
+                        kept_bytes += size
+                loaded = time.time()
+                # Paste clips the image to the band
+                band.paste(image, (x - extrude, y - extrude - top))
+                if(not placement in kept):
+                    image.close()
+                pasted = time.time()
+                decoding += loaded - start
+                compositing += pasted - loaded
+            start = time.time()
+            writer.write(band)
+            encoding += time.time() - start
+            remaining = []
+            for placement in active:
+                if(placement[4] + placement[6] + extrude > bottom):
+                    remaining.append(placement)
+                elif(placement in kept):
+                    kept.pop(placement).close()
+                    kept_bytes -= 4 * (placement[5] + 2 * extrude) * (placement[6] + 2 * extrude)
+            active = remaining
+        start = time.time()
+        written = writer.close()
+        encoding += time.time() - start
+    except:
+        if(writer.rows != height):
+            writer.discard()
+        raise
+    return (decoding, compositing, [(filename, "png", "RGBA", written, encoding)])
+
+
+def _openPlacements(placements, density):
+    """
+    Generator function for (image, position, rotated) tuples for the
+    placements, given as (source filename, trim box, variant, x, y, rotated)
+    tuples, opening one image at a time and closing it when the next one
+    is asked for.
+    """
+    for (source, box, variant, x, y, rotated) in placements:
+        image = _openImage(source, box, density, variant)
+        try:
+            yield (image, (x, y), rotated)
+        finally:
+            image.close()
+
+
+def _decodedPlacements(placements, density, processes):
+    """
+    Generator function for (image, position, rotated) tuples for the
+    placements, given as for _openPlacements. With decode processes, and
+    where a pool is allowed, the images are decoded by a pool of processes
+    a chunk at a time, which keeps the number of decoded images held
+    bounded, and otherwise they are opened one at a time.
+    """
+    if(0 < processes and _poolAllowed()):
+        chunksize = 4 * processes
+        pool = multiprocessing.Pool(processes)
+        try:
+            for start in xrange(0, len(placements), chunksize):
+                chunk = placements[start:start + chunksize]
+                decoded = pool.map(_decodeImage, [(source, box, density, variant) for (source, box, variant, x, y, rotated) in chunk])
+                for ((source, box, variant, x, y, rotated), (mode, size, pixels)) in zip(chunk, decoded):
+                    yield (Image.frombytes(mode, size, pixels), (x, y), rotated)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for placed in _openPlacements(placements, density):
+            yield placed
+
+
+def _extruded(image, pixels):
+    """
+    Extrude the edges of an image by repeating its outermost rows and
+    columns of pixels the number of pixels out from the image, corners
+    included, so a scaled background blends with the edge of the image
+    instead of the transparent padding or a neighbouring image.
+    Return: RGBA image, pixels larger than the image on every side
+    """
+    if("RGBA" != image.mode):
+        image = image.convert("RGBA")
+    (width, height) = image.size
+    extruded = Image.new("RGBA", (width + 2 * pixels, height + 2 * pixels))
+    extruded.paste(image, (pixels, pixels))
+    # The edges are pasted a row or column at a time, because resizing
+    # them would premultiply the alpha and change translucent pixels.
+    top = image.crop((0, 0, width, 1))
+    bottom = image.crop((0, height - 1, width, height))
+    for offset in xrange(pixels):
+        extruded.paste(top, (pixels, offset))
+        extruded.paste(bottom, (pixels, pixels + height + offset))
+    # The columns are taken from the extruded rows, which fills the corners
+    height = height + 2 * pixels
+    left = extruded.crop((pixels, 0, pixels + 1, height))
+    right = extruded.crop((pixels + width - 1, 0, pixels + width, height))
+    for offset in xrange(pixels):
+        extruded.paste(left, (offset, 0))
+        extruded.paste(right, (pixels + width + offset, 0))
+    return extruded
+
+
+def _paste(sprite, placed, extrude = 0):
+    """
+    Paste the images onto the sprite, a PIL image or a compositor, given
+    as (image, position, rotated) tuples, turning the rotated images 90
+    degrees clockwise and extruding the edges of the images by the pixels
+    of extrude, in the same pass.
+    PIL opens images lazily, so each image is loaded before it's pasted,
+    which tells the time spent decoding from the time spent compositing.
+    Return: (seconds decoding, seconds compositing)
+    """
+    decoding = 0.0
+    compositing = 0.0
+    start = time.time()
+    for (image, position, rotated) in placed:
+        image.load()
+        loaded = time.time()
+        if(rotated):
+            image = image.transpose(Image.ROTATE_270)
+        if(0 < extrude):
+            image = _extruded(image, extrude)
+            position = (position[0] - extrude, position[1] - extrude)
+        sprite.paste(image, position)
+        pasted = time.time()
+        decoding += loaded - start
+        compositing += pasted - loaded
+        start = pasted
+    return (decoding, compositing)
+
+
+def _poolAllowed():
+    """
+    Check if this process can start a pool of processes. The worker
+    processes of a pool, like those running batch jobs, can't.
+    """
+    return not multiprocessing.current_process().daemon
+
+
+def _densityFilename(filename, density):
+    """
+    Get the filename of a sprite at a pixel density. Density 1 is
+    written to the filename while the others are named like sprite@2x.png.
+    """
+    if(1 == density):
+        return filename
+    (base, extension) = os.path.splitext(filename)
+    return str.format("{0}@{1}x{2}", base, density, extension)
+
+
+def _pixelHash(filename):
+    """
+    Calculate the SHA-1 hash of the decoded RGBA pixels of an image file,
+    so images with identical pixels stored in different files, or formats,
+    get the same hash.
+    """
+    image = Image.open(filename)
+    try:
+        return hashlib.sha1(image.convert("RGBA").tobytes()).hexdigest()
+    finally:
+        image.close()
+
+
 class SpriteImage(object):
     """
     Represents an image to include in the sprite.
-    Its basically a container holding a PIL Image of the actual image
-    and metadata about the image to facilitate placing the image in
-    the final sprite.
+    Its a lightweight record of the image filename and size, which is
+    all the layout needs. The pixel data is only read when the sprite
+    is drawn, by opening the image file again. The aliases are the
+    filenames of duplicate images sharing the placement of the image.
+    A trimmed image has the width and height of the box it's trimmed
+    to, while source_width and source_height keep the original size and
+    offset_x and offset_y the position of the box in the original image.
+    The variants are the filenames of the image at other pixel densities.
     """
-    def __init__(self, image, filename):
+    def __init__(self, filename, size):
         """
-        Initialize a SpriteImage with a PIL image and
-        the full path filename of the PIL image.
+        Initialize a SpriteImage with the full path filename
+        of the image and the size, (width, height), of the image.
         """
-        self.image = image
-        (self.width, self.height) = self.image.size
         self.filename = filename
+        (self.width, self.height) = size
+        (self.source_width, self.source_height) = size
+        self.offset_x = 0
+        self.offset_y = 0
+        self.aliases = []
+        self.variants = {}
+
+    def trim(self, box):
+        """
+        Trim the image to the box, (left, top, right, bottom),
+        within the original image.
+        """
+        (left, top, right, bottom) = box
+        self.offset_x = left
+        self.offset_y = top
+        self.width = right - left
+        self.height = bottom - top
+
+    def box(self):
+        """
+        Get the box the image is trimmed to, or None if it isn't trimmed.
+        """
+        if(not self.trimmed):
+            return None
+        return (self.offset_x, self.offset_y, self.offset_x + self.width, self.offset_y + self.height)
+
+    trimmed = property(lambda self : (self.width, self.height) != (self.source_width, self.source_height), None, None, None)
+
+    def open(self, density = 1):
+        """
+        Open the image file as a PIL image, cropped to the trim box,
+        at the pixel density.
+        """
+        return _openImage(self.filename, self.box(), density, self.variants.get(density))
 
     def __str__(self):
         """
@@ -146,48 +902,196 @@ class SpriteImage(object):
         return str.format("{0} width={1} height={2}", self.filename, self.width, self.height)
 
 
+class SpritifyResult(object):
+    """
+    Result of spritifying a directory. The sheets are the layouts of the
+    sprite sheets, or None if the sprite was up to date, the classes are
+    the CSS class names and the outputs the filenames of the written files.
+    The stats are the counts, bytes and durations of the build.
+    """
+    def __init__(self, sheets, classes, outputs, stats = None):
+        self.sheets = sheets
+        self.classes = classes
+        self.outputs = outputs
+        self.stats = stats
+
+    upToDate = property(lambda self : self.sheets is None, None, None, None)
+
+
 class Spritify(object):
     """
     Spritify a directory of images based on a SpritifyConfiguration.
     """
-    def __init__(self, configuration):
+    def __init__(self, configuration, output = None):
         """
-        Create a Spritify object with using a SpritifyConfiguration.
+        Create a Spritify object with using a SpritifyConfiguration and
+        the stream the stats are reported to, if configured, like stdout
+        for the command line. Without a stream the stats are only returned.
         """
         self.__conf = configuration
-        pass
+        self.__output = output
+        self._canvases = {}
+        self.stats = Stats()
+
+    def _probeImages(self, imagefilenames):
+        """
+        Probe the image files for their sizes concurrently using a pool
+        of threads, because reading the headers is bound on I/O.
+        Sizes of images that are unchanged in the build cache are reused.
+        With a cache the threads also take the fingerprints of the other
+        images, so new and changed files are hashed concurrently, and the
+        cache is updated with the sizes of the probed images.
+        The results are returned in the order of the image filenames.
+        Return: list of (filename, size, error) where either size or error is None
+        """
+        cache = self.__conf.cache
+        cached = {}
+        probe = _probeImage
+        if(not cache is None):
+            probe = _probeFingerprintedImage
+            for f in imagefilenames:
+                if(cache.isKnownImage(f)):
+                    size = cache.lookup(f)
+                    if(not size is None):
+                        cached[f] = size
+        unprobed = [f for f in imagefilenames if not f in cached]
+        if(1 >= self.__conf.workers or 1 >= len(unprobed)):
+            probed = map(probe, unprobed)
+        else:
+            pool = ThreadPool(self.__conf.workers)
+            try:
+                probed = pool.map(probe, unprobed)
+            finally:
+                pool.close()
+                pool.join()
+        results = dict((f, (f, size, None)) for (f, size) in cached.items())
+        for result in probed:
+            (f, size, ioe) = result[:3]
+            if((not cache is None) and (ioe is None)):
+                # Touched files with unchanged content keep their cached trim box
+                if(cache.lookup(f, result[3]) is None):
+                    cache.update(f, size, result[3])
+            results[f] = (f, size, ioe)
+        return [results[f] for f in imagefilenames]
 
     def _buildImageList(self, imagefilenames):
         """
         Build a list of SpriteImage objects from a list of image filenames.
+        Only the image headers are read and the images are probed
+        concurrently, but errors are handled in the order of the
+        filenames, so output is the same as a serial probe.
         """
         sprite_images = []
-        for f in imagefilenames:
-            try:
-                img = Image.open(f)
-                sprite_image = SpriteImage(img, f)
+        for (f, size, ioe) in self._probeImages(imagefilenames):
+            if(ioe is None):
+                sprite_image = SpriteImage(f, size)
+                sprite_image.variants = self.__conf.variants.get(os.path.splitext(f)[0], {})
                 sprite_images.append(sprite_image)
-            except IOError as ioe:
+            else:
                 if self.__conf.stop:
-                    print str.format("Error: PIL failed to open [{0}], with {1}", f, ioe)
-                    sys.exit(1);
+                    raise SpritifyError(str.format("PIL failed to open [{0}], with {1}", f, ioe))
                 else:
-                    print str.format("Skipping file [{0}], PIL error: {1}", f, ioe)
+                    log.warning(str.format("Skipping file [{0}], PIL error: {1}", f, ioe))
+                    self.stats.count("skipped")
         return sprite_images
 
 
+    def _mergeDuplicates(self, images):
+        """
+        Merge duplicate images, so they are placed once in the sprite.
+        Only images of the same size can be duplicates, so only those
+        are compared by the hash of the file content or, if configured,
+        by the hash of the decoded pixels, which is computed once for
+        files with the same content. The first image of a set of
+        duplicates is kept and the filenames of the others are added to
+        its aliases.
+        Return: list of the images without duplicates in the original order
+        """
+        if("keep" == self.__conf.duplicates):
+            return images
+        groups = {}
+        for image in images:
+            groups.setdefault((image.width, image.height), []).append(image)
+        candidates = []
+        for group in groups.values():
+            if(1 == len(group)):
+                continue
+            by_hash = {}
+            pixel_hashes = {}
+            for image in group:
+                key = self._fileHash(image.filename)
+                if("pixels" == self.__conf.duplicates):
+                    if(not key in pixel_hashes):
+                        pixel_hashes[key] = _pixelHash(image.filename)
+                    key = pixel_hashes[key]
+                by_hash.setdefault(key, []).append(image)
+            candidates.extend(by_hash.values())
+        duplicates = set()
+        for group in candidates:
+            for image in group[1:]:
+                group[0].aliases.append(image.filename)
+                group[0].aliases.extend(image.aliases)
+                duplicates.add(image.filename)
+                log.info(str.format("File [{0}] is a duplicate of [{1}]", image.filename, group[0].filename))
+        self.stats.count("duplicates", len(duplicates))
+        return [image for image in images if not image.filename in duplicates]
+
+    def _trimImages(self, images):
+        """
+        Trim the transparent borders of the images, so only the box holding
+        visible pixels is packed. The boxes are found concurrently, each image
+        being decoded and released again, and boxes of images unchanged in
+        the build cache are reused.
+        """
+        cache = self.__conf.cache
+        boxes = {}
+        if(not cache is None):
+            for image in images:
+                box = cache.lookupTrim(image.filename)
+                if(not box is None):
+                    boxes[image.filename] = box
+        untrimmed = [image.filename for image in images if not image.filename in boxes]
+        if(1 >= self.__conf.workers or 1 >= len(untrimmed)):
+            found = map(_alphaBox, untrimmed)
+        else:
+            pool = ThreadPool(self.__conf.workers)
+            try:
+                found = pool.map(_alphaBox, untrimmed)
+            finally:
+                pool.close()
+                pool.join()
+        for (filename, box) in zip(untrimmed, found):
+            boxes[filename] = box
+            if(not cache is None):
+                cache.updateTrim(filename, box)
+        for image in images:
+            image.trim(boxes[image.filename])
+
+    def _fileHash(self, filename):
+        """
+        Get the hash of the file content, from the build cache if possible.
+        """
+        if(not self.__conf.cache is None):
+            content_hash = self.__conf.cache.contentHash(filename)
+            if(not content_hash is None):
+                return content_hash
+        return fileHash(filename)
+
     def _virtualSpriteSize(self, images):
         """
         Find the virtual sprite size, which is a sprite where either 
         width or height is open-ended (sys.maxint) depending on
         which dimension has the largest size among the images.
+        The size is that of the layout packing the cells of the images,
+        which are the images themselves unless they are spaced.
         return: (width, height)
         """
         width = 0
         height = 0
         for image in images:
-            width = max(width, image.width)
-            height = max(height, image.height)
+            (cell_width, cell_height) = self.__conf.spacing.cell(image.width, image.height)
+            width = max(width, cell_width)
+            height = max(height, cell_height)
         if(width < height):
             width = sys.maxint
         else:
@@ -212,35 +1116,345 @@ class Spritify(object):
         Layout the sprite images in a container that is only bound be height or width
         depending on which is largest the other dimension will de unlimited in size
         and the final height and width of the sprite will be determined when the layout
-        is complete. 
+        is complete. The layout algorithm is selected by the configuration.
         """
+        if self.__conf.optimize:
+            return self._optimizedLayout(images)
         (width, height) = self._virtualSpriteSize(images)
-        print str.format("Virtual sprite size {0} x {1}", width, height)
-        layout = Layout(width, height)
+        log.debug(str.format("Virtual sprite size {0} x {1}", width, height))
+        layout = self._createLayout(width, height)
         sorted_images = self._sortSpriteImages(images, width, height)
         for image in sorted_images:
             layout.insert(image.width, image.height, image)
         layout.prune()
         return layout
 
-    def _drawLayout(self, layout):
+    def _optimizedLayout(self, images):
         """
-        Draw an image, the sprite, from a layout.
+        Layout the sprite images as the candidate layout with the smallest
+        bounding area found by the optimizer within the time budget.
         """
-        (image_width, image_height) = layout.bounding()
-        print "Draw image: ", image_width, image_height
-        sprite = Image.new("RGBA", (image_width, image_height))
+        sizes = [self.__conf.spacing.cell(image.width, image.height) for image in images]
+        processes = 1
+        if(_poolAllowed()):
+            processes = self.__conf.jobs
+        start = time.time()
+        (candidate, (area, side), default, scored) = optimizeLayout(self.__conf.layout, sizes, self.__conf.candidates, self.__conf.seed, processes, self.__conf.rotate, self.__conf.timeBudget)
+        log.info(str.format("Tried {0} layouts in {1:.3f}s, using {2}", scored, time.time() - start, candidate.description))
+        if(scored < self.__conf.candidates):
+            log.warning(str.format("The time budget stopped the optimizer after {0} candidates, the layout depends on the speed of the machine", scored))
+        if(not default is None):
+            log.info(str.format("Layout area is {0} pixels, {1:.1%} smaller than the default layout", area, 1.0 - float(area) / default[0]))
+        layout = self._spacedLayout(createLayout(self.__conf.layout, candidate.width, candidate.height, self.__conf.rotate))
+        for index in candidate.order:
+            layout.insert(images[index].width, images[index].height, images[index])
+        layout.prune()
+        return layout
+
+    def _createLayout(self, width, height, algorithm = None):
+        """
+        Create a layout of the configured algorithm, or the algorithm given,
+        packing the cells of the images within the width and height.
+        """
+        return self._spacedLayout(createLayout(algorithm or self.__conf.layout, width, height, self.__conf.rotate))
+
+    def _spacedLayout(self, layout):
+        """
+        Wrap the layout in a SpacedLayout if the images are spaced by padding,
+        extrusion or alignment, so the layout packs the cells of the images.
+        """
+        if(not self.__conf.spacing.spaced):
+            return layout
+        return SpacedLayout(layout, self.__conf.spacing)
+
+    def _layoutSheets(self, images):
+        """
+        Layout the sprite images in sprite sheets. Without a maximum sprite
+        size all images are placed in a single sheet. Otherwise the images,
+        grouped by the configuration, are placed in sheets of the maximum
+        size, trying the sheets of their group in order and adding a sheet
+        when none of them has room for the image.
+        Return: list of layouts, one per sheet
+        """
+        if(self.__conf.maxSize is None):
+            return [self._layoutSprintImages(images)]
+        (width, height) = self.__conf.maxSize
+        spacing = self.__conf.spacing
+        (limit_width, limit_height) = (spacing.limit(width), spacing.limit(height))
+        groups = {}
+        for image in images:
+            if("directory" == self.__conf.group):
+                key = os.path.dirname(image.filename)
+            else:
+                key = ""
+            groups.setdefault(key, []).append(image)
+        sheets = []
+        for key in sorted(groups.keys()):
+            group_sheets = []
+            for image in sorted(groups[key], reverse = True, key = lambda sprite_image: (sprite_image.height, sprite_image.width)):
+                (cell_width, cell_height) = spacing.cell(image.width, image.height)
+                if((cell_width > limit_width or cell_height > limit_height) and not (self.__conf.rotate and cell_height <= limit_width and cell_width <= limit_height)):
+                    raise SpritifyError(str.format("image [{0}] is larger than the maximum sprite size {1} x {2}", image.filename, width, height))
+                for layout in group_sheets:
+                    try:
+                        layout.insert(image.width, image.height, image)
+                        break
+                    except RectangleLayoutError:
+                        pass
+                else:
+                    layout = self._createLayout(limit_width, limit_height)
+                    layout.insert(image.width, image.height, image)
+                    group_sheets.append(layout)
+            sheets.extend(group_sheets)
+        for layout in sheets:
+            layout.prune()
+        log.info(str.format("Images placed in {0} sprite sheets", len(sheets)))
+        return sheets
+
+    def _sheetFilenames(self, count):
+        """
+        Get the filenames of the sprite sheets. A single sheet is written
+        to the sprite file, while several sheets are numbered.
+        """
+        if(1 == count):
+            return [self.__conf.spriteFilename]
+        (base, extension) = os.path.splitext(self.__conf.spriteFilename)
+        return [str.format("{0}-{1}{2}", base, index, extension) for index in xrange(count)]
+
+    def _placements(self, layout, density):
+        """
+        Get the placements of the nodes in the layout at the pixel density, as
+        (source filename, trim box, variant, x, y, rotated) tuples for drawing,
+        logging every node when debugging.
+        """
+        debug = log.isEnabledFor(logging.DEBUG)
+        placements = []
         for node in layout.nodes():
-            sprite.paste(node.item.image, (node.x, node.y))
-            print node
-        sprite.save(self.__conf.spriteFilename, "PNG")
+            if(debug):
+                log.debug(str(node))
+            placements.append((node.item.filename, node.item.box(), node.item.variants.get(density), density * node.x, density * node.y, node.rotated))
+        return placements
+
+    def _stableLayout(self, images, placements):
+        """
+        Layout the sprite images keeping the images from the previous layout, given
+        as (filename, sheet, x, y, width, height, rotated) placements, in place. The
+        previous placements must have the same spacing. New images, and images
+        that changed size, are placed by the maxrects algorithm, whatever the
+        layout option, in the cells of removed or changed images or after the
+        kept images, as are rotated images when the layout may no longer rotate
+        them. Only that space is free, so the cost is bounded by the number of
+        changed images and gaps left empty by the previous layout aren't filled.
+        The fixed dimension of the virtual sprite is widened to hold the
+        previous placements if needed.
+        None is returned if the fraction of the sprite left empty is above the
+        repack threshold, meaning all the images should be packed again.
+        """
+        spacing = self.__conf.spacing
+        by_filename = dict((image.filename, image) for image in images)
+        (width, height) = self._virtualSpriteSize(images)
+        seeds = []
+        freed = []
+        extent = 0
+        for (filename, sheet, x, y, seed_width, seed_height, rotated) in placements:
+            image = by_filename.pop(filename, None)
+            (cell_width, cell_height) = spacing.cell(seed_width, seed_height)
+            cell = (x - spacing.offset, y - spacing.offset, cell_width, cell_height)
+            if(rotated):
+                (seed_width, seed_height) = (seed_height, seed_width)
+            if((not image is None) and (image.width, image.height) == (seed_width, seed_height) and (self.__conf.rotate or not rotated)):
+                seeds.append((image, x, y, rotated))
+                if(width < height):
+                    width = max(width, cell[0] + cell_width)
+                    extent = max(extent, cell[1] + cell_height)
+                else:
+                    height = max(height, cell[1] + cell_height)
+                    extent = max(extent, cell[0] + cell_width)
+            else:
+                freed.append(cell)
+                if(not image is None):
+                    by_filename[filename] = image
+        added = [image for image in images if image.filename in by_filename]
+        if(width < height):
+            freed.append((0, extent, width, height - extent))
+        else:
+            freed.append((extent, 0, width - extent, height))
+        layout = self._spacedLayout(MaxRectsLayout(width, height, self.__conf.rotate, freed))
+        try:
+            for (image, x, y, rotated) in seeds:
+                if(rotated):
+                    layout.place(x, y, image.height, image.width, image, rotated)
+                else:
+                    layout.place(x, y, image.width, image.height, image)
+            for image in self._sortSpriteImages(added, width, height):
+                layout.insert(image.width, image.height, image)
+        except RectangleLayoutError as error:
+            log.info(str.format("Previous layout can't be kept, {0}", error))
+            return None
+        (sprite_width, sprite_height) = layout.bounding()
+        cells = [spacing.cell(image.width, image.height) for image in images]
+        used = sum(cell_width * cell_height for (cell_width, cell_height) in cells)
+        empty = 1.0 - float(used) / max(1, sprite_width * sprite_height)
+        if(empty > self.__conf.repackThreshold):
+            log.info(str.format("Stable layout leaves {0:.0%} of the sprite empty, packing all images again", empty))
+            return None
+        log.info(str.format("Kept {0} images in place and placed {1} new images", len(seeds), len(added)))
+        return layout
+
+    def _placedSheets(self, images, placements):
+        """
+        Create the sheet layouts from the placements of a previous
+        build given as (filename, sheet, x, y, width, height, rotated) tuples.
+        """
+        by_filename = dict((image.filename, image) for image in images)
+        sheets = []
+        for (filename, sheet, x, y, width, height, rotated) in placements:
+            while(sheet >= len(sheets)):
+                sheets.append(self._spacedLayout(PlacementLayout(sys.maxint, sys.maxint)))
+            sheets[sheet].place(x, y, width, height, by_filename[filename], rotated)
+        return sheets
+
+    def _drawLayout(self, layout, filename, density = 1):
+        """
+        Draw an image, the sprite, from a layout at a pixel density.
+        The images are streamed in one at a time, so only the
+        sprite and a single image are held in memory, or a chunk
+        of images when decoded by the decode processes.
+        When watching, the sprite is kept and drawn again by only
+        painting the placements that changed since it was drawn.
+        """
+        (image_width, image_height) = layout.bounding()
+        (image_width, image_height) = (density * image_width, density * image_height)
+        log.debug(str.format("Draw sprite {0} of {1} x {2}", filename, image_width, image_height))
+        if self.__conf.watch:
+            sprite = self._redrawLayout(layout, filename, density)
+        else:
+            (sprite, seconds) = _drawPlacements((image_width, image_height), self._placements(layout, density), density, density * self.__conf.spacing.extrude, self.__conf.decodeProcesses)
+            self._reportDrawn(seconds)
+        self._reportEncoded(self._encoder().encode(sprite, filename))
+
+    def _placementKey(self, node, density):
+        """
+        Key of what is painted by a node at a pixel density, the content of
+        the image and its variant, the trim box, the rotation and the position
+        and size.
+        """
+        variant = node.item.variants.get(density)
+        if(not variant is None):
+            variant = (variant,) + fileStat(variant)
+        return (self._fileHash(node.item.filename), node.item.box(), variant, node.rotated, node.x, node.y, node.width, node.height)
+
+    def _redrawLayout(self, layout, filename, density):
+        """
+        Draw the sprite of a layout starting from the sprite drawn for the
+        filename and density by the previous build. Placements that are gone
+        are cleared and only new placements, including those of changed
+        images, are painted, so unchanged images aren't read again.
+        A sprite that changed size is drawn from scratch.
+        """
+        extrude = density * self.__conf.spacing.extrude
+        (width, height) = layout.bounding()
+        size = (density * width, density * height)
+        (sprite, painted) = self._canvases.get((filename, density), (None, {}))
+        if(sprite is None or sprite.size != size):
+            (sprite, painted) = (Image.new("RGBA", size), {})
+        placements = dict((self._placementKey(node, density), node) for node in layout.nodes())
+        for key in painted:
+            if(not key in placements):
+                (x, y, node_width, node_height) = key[-4:]
+                sprite.paste((0, 0, 0, 0), (density * x - extrude, density * y - extrude, density * (x + node_width) + extrude, density * (y + node_height) + extrude))
+        changed = [(node.item.filename, node.item.box(), node.item.variants.get(density), density * node.x, density * node.y, node.rotated) for (key, node) in placements.items() if not key in painted]
+        self._reportDrawn(_paste(sprite, _decodedPlacements(changed, density, self.__conf.decodeProcesses), extrude))
+        self._canvases[(filename, density)] = (sprite, placements)
+        return sprite
+
+    def _reportDrawn(self, seconds):
+        """
+        Add the seconds spent decoding and compositing a sprite to the stats.
+        """
+        (decoding, compositing) = seconds
+        self.stats.addDuration("decode", decoding)
+        self.stats.addDuration("compose", compositing)
+
+    def _reportEncoded(self, encoded):
+        """
+        Report the files written by the SpriteEncoder.
+        """
+        for (filename, format, mode, written, seconds) in encoded:
+            log.info(str.format("Encoded {0} as {1} {2}, {3} bytes in {4:.3f}s", filename, mode, format.upper(), written, seconds))
+            self.stats.addDuration("encode", seconds)
+            self.stats.addBytes("sprites", written)
+            self.stats.count("sprites")
+
+    def _encoder(self):
+        """
+        Create the SpriteEncoder configured for the sprites.
+        """
+        return SpriteEncoder(self.__conf.encoder, self.__conf.palette, self.__conf.encodeThreads, self.__conf.formats)
+
+    def _drawSheets(self, sheets):
+        """
+        Draw the sprite sheets at each pixel density. A single sheet at a
+        single density is drawn by this process, while several sheets are
+        drawn and encoded in parallel by a pool of processes, a sheet per
+        process at a time, unless this is a worker process of a pool.
+        When watching every sheet is drawn by this process, which keeps the
+        sprites for the next build. Every density is drawn from the same layout.
+        Streamed sheets are drawn and written band by band, by this process
+        or, for several sheets, by a pool of processes.
+        """
+        filenames = self._sheetFilenames(len(sheets))
+        densities = self.__conf.densities
+        if("stream" == self.__conf.canvas):
+            work = []
+            for (layout, filename) in zip(sheets, filenames):
+                (width, height) = layout.bounding()
+                for density in densities:
+                    placements = [(node.item.filename, node.item.box(), node.item.variants.get(density), density * node.x, density * node.y, density * node.width, density * node.height, node.rotated) for node in layout.nodes()]
+                    work.append((_densityFilename(filename, density), (density * width, density * height), density, placements, self._encoder(), self.__conf.canvasMemory, density * self.__conf.spacing.extrude))
+            self._runDrawing(_streamSheet, work)
+            return
+        if(1 == len(sheets) and 1 == len(densities)):
+            self._drawLayout(sheets[0], filenames[0])
+            return
+        if self.__conf.watch:
+            for (layout, filename) in zip(sheets, filenames):
+                for density in densities:
+                    self._drawLayout(layout, _densityFilename(filename, density), density)
+            return
+        work = []
+        for (layout, filename) in zip(sheets, filenames):
+            (width, height) = layout.bounding()
+            for density in densities:
+                work.append((_densityFilename(filename, density), (density * width, density * height), density, self._placements(layout, density), self._encoder(), density * self.__conf.spacing.extrude, self.__conf.decodeProcesses))
+        self._runDrawing(_drawSheet, work)
+
+    def _runDrawing(self, draw, work):
+        """
+        Run the draw function, _drawSheet or _streamSheet, on the work for each
+        sheet, on a pool of processes if there are several sheets and a pool
+        is allowed, and report the sheets drawn.
+        """
+        if(1 == len(work) or not _poolAllowed()):
+            for (decoding, compositing, encoded) in itertools.imap(draw, work):
+                self._reportDrawn((decoding, compositing))
+                self._reportEncoded(encoded)
+            return
+        pool = multiprocessing.Pool(min(len(work), multiprocessing.cpu_count()))
+        try:
+            for (decoding, compositing, encoded) in pool.map(draw, work):
+                self._reportDrawn((decoding, compositing))
+                self._reportEncoded(encoded)
+        finally:
+            pool.close()
+            pool.join()
 
 
-    def _spriteClassFromNode(self, node, existing):
+    def _spriteClassFromFilename(self, filename, classNames):
         """
-        Get a sprite class name from a node.
+        Get a sprite class name from an image filename, adding it to the
+        ClassNames. A name that is taken already is made unique.
         """
-        filename = node.item.filename
         basename = os.path.basename(filename)
         match = re.search("""^[^\.]+""", basename)
         if(match is None):
@@ -249,37 +1463,67 @@ class Spritify(object):
             classname = match.group(0)
         # No spaces allowed in class names
         classname = classname.replace(" ", "-")
-        if classname in existing:
-            print "Already a class named", classname
-        return classname
+        return classNames.add(classname)
 
 
-    def _writeCSS(self, layout):
+    def _spriteSheets(self, sheets):
         """
-        Write CSS for the layout returning a list of classes in the file.
+        Describe the sheet layouts as SpriteSheet objects for the emitters.
+        Duplicate images get a class each with the position of the node.
+        Class names are kept unique, a name that is taken by another image
+        or a background class gets a number appended.
+        Return: (list of SpriteSheet, list of the class names in order)
         """
-        css = open(self.__conf.cssfilename, "w")
-        # Register the image as background:url
-        url = self.__conf.cssimagepath + os.path.basename(self.__conf.spriteFilename)
-        css.write(str.format(".{0} {{background-image: url(\"{1}\");}}\n",  self.__conf.cssClassname, url))
-        # Register the images as classes by there filenames
-        cssClasses = []
-        for node in layout.nodes():
-            name = self._spriteClassFromNode(node, cssClasses)
-            cssClasses.append(name)
-            css.write(str.format(".{0} {{", name))
-            css.write(str.format("width: {0}px; height: {1}px; ", node.width, node.height))
-            css.write(str.format("background-position: {0}px {1}px;", 0 - node.x, 0 - node.y))
-            css.write("}\n");
-        css.close()
-        return cssClasses
+        if(1 == len(sheets)):
+            backgroundClasses = [self.__conf.cssClassname]
+        else:
+            backgroundClasses = [str.format("{0}-{1}", self.__conf.cssClassname, index) for index in xrange(len(sheets))]
+        # Find the class names of the images by there filenames
+        cssClasses = ClassNames(backgroundClasses)
+        spriteSheets = []
+        for (layout, filename, backgroundClass) in zip(sheets, self._sheetFilenames(len(sheets)), backgroundClasses):
+            entries = []
+            for node in layout.nodes():
+                image = node.item
+                padding = None
+                if image.trimmed:
+                    padding = (image.offset_y, image.source_width - image.offset_x - image.width, image.source_height - image.offset_y - image.height, image.offset_x)
+                for name in [image.filename] + image.aliases:
+                    entries.append(SpriteEntry(self._spriteClassFromFilename(name, cssClasses), node.x, node.y, image.width, image.height, padding, node.rotated))
+            images = []
+            for density in self.__conf.densities:
+                urls = [(format, self.__conf.cssimagepath + os.path.basename(formatFilename(_densityFilename(filename, density), format))) for format in self.__conf.formats]
+                images.append((density, urls))
+            (width, height) = layout.bounding()
+            spriteSheets.append(SpriteSheet(backgroundClass, width, height, images, entries))
+        return (spriteSheets, cssClasses.names)
 
-    def _writeHtml(self, cssClasses):
+    def _emitters(self):
+        """
+        Create the configured emitters.
+        """
+        return [createEmitter(name, self.__conf.cssfilename, self.__conf.minify, self.__conf.compressions) for name in self.__conf.emitters]
+
+    def _writeCSS(self, sheets):
+        """
+        Write the CSS, and the other outputs of the configured emitters,
+        for the sheet layouts returning the SpriteSheet objects emitted and
+        a list of the classes of the images.
+        """
+        (spriteSheets, cssClasses) = self._spriteSheets(sheets)
+        for emitter in self._emitters():
+            emitter.emit(spriteSheets)
+        return (spriteSheets, cssClasses)
+
+    def _writeHtml(self, spriteSheets):
         """
         Write an overview HTML document referencing all classes added
-        to the CSS file written.
+        to the CSS file written, which leaves out the rotated images.
+        The document is written through a buffer to an AtomicFile,
+        replacing the overview when it's complete.
         """
-        html = open("overview.html", "w")
+        cssClasses = [entry.name for sheet in spriteSheets for entry in cssEntries(sheet)]
+        html = AtomicFile("overview.html", "w", BUFFER_SIZE)
         html.write("<!DOCTYPE html><html><head><meta charset=\"utf-8\">")
         html.write(str.format("<link rel=\"stylesheet\" type=\"text/css\" href=\"{0}\" />", self.__conf.cssfilename))
         html.write("</head><body>")
@@ -291,23 +1535,324 @@ class Spritify(object):
         html.close()
 
 
+    def _buildOptions(self):
+        """
+        Get the options affecting the output of a build, which
+        are used to tell if a cached build can be reused. The
+        options are compared after a JSON round trip, so sizes
+        are given as lists.
+        """
+        maxsize = None
+        if(not self.__conf.maxSize is None):
+            maxsize = list(self.__conf.maxSize)
+        return {
+            "layout" : self.__conf.layout,
+            "sprite" : self.__conf.spriteFilename,
+            "css" : self.__conf.cssfilename,
+            "classname" : self.__conf.cssClassname,
+            "cssimagepath" : self.__conf.cssimagepath,
+            "minify" : self.__conf.minify,
+            "compressions" : self.__conf.compressions,
+            "emitters" : self.__conf.emitters,
+            "include" : self.__conf.include,
+            "exclude" : self.__conf.exclude,
+            "sniff" : self.__conf.sniff,
+            "overview" : self.__conf.writeHtmlOverview,
+            "stable" : self.__conf.stable,
+            "duplicates" : self.__conf.duplicates,
+            "trim" : self.__conf.trim,
+            "maxsize" : maxsize,
+            "group" : self.__conf.group,
+            "encoder" : self.__conf.encoder,
+            "palette" : self.__conf.palette,
+            "encodethreads" : self.__conf.encodeThreads,
+            "canvas" : self.__conf.canvas,
+            "optimize" : self.__conf.optimize and [self.__conf.candidates, self.__conf.timeBudget, self.__conf.seed],
+            "rotate" : self.__conf.rotate,
+            "spacing" : [self.__conf.spacing.padding, self.__conf.spacing.extrude, self.__conf.spacing.align, self.__conf.spacing.powerOfTwo],
+            "formats" : self.__conf.formats,
+            "densities" : self.__conf.densities,
+            "variants" : self._variantStats(),
+        }
+
+    def _variantStats(self):
+        """
+        Get the filenames of the density variants with their modification
+        times and sizes, so a build using changed variants isn't reused.
+        """
+        stats = []
+        for variants in self.__conf.variants.values():
+            for filename in variants.values():
+                stats.append([filename] + list(fileStat(filename)))
+        return sorted(stats)
+
+    def _outputFilenames(self, sheets):
+        """
+        Get the filenames of the files written by a build.
+        """
+        outputs = []
+        for filename in self._sheetFilenames(len(sheets)):
+            for density in self.__conf.densities:
+                outputs.extend(formatFilename(_densityFilename(filename, density), format) for format in self.__conf.formats)
+        for emitter in self._emitters():
+            outputs.extend(emitter.filenames())
+        if self.__conf.writeHtmlOverview:
+            outputs.append(os.path.abspath("overview.html"))
+        return outputs
+
+
     def generate(self):
         """
         Generate the sprite and CSS file
+        Return: SpritifyResult
         """
-        print str.format("Traverse directory {0} for images", self.__conf.directory)
-        print "Verbose output:", self.__conf.verbose
+        # The build started with the scan of the directory, by the configuration
+        self.stats = stats = Stats(self.__conf.scanStarted)
+        stats.addDuration("scan", self.__conf.scanSeconds)
+        stats.count("files", len(self.__conf.imagefiles))
+        log.info(str.format("Traverse directory {0} for images", self.__conf.directory))
 
-        sprite_images = self._buildImageList(self.__conf.imagefiles)
-        layout = self._layoutSprintImages(sprite_images)        
-        self._drawLayout(layout)
-        cssClasses = self._writeCSS(layout)
-        print "Classes in the CSS", cssClasses
-        if self.__conf.writeHtmlOverview:
-            self._writeHtml(cssClasses)
+        cache = self.__conf.cache
+        with stats.timer("probe"):
+            sprite_images = self._buildImageList(self.__conf.imagefiles)
+        stats.count("images", len(sprite_images))
+        filenames = [image.filename for image in sprite_images]
+        options = self._buildOptions()
+        if((not cache is None) and cache.isUpToDate(options, filenames)):
+            log.info("Sprite is up to date")
+            cache.save()
+            self._reportStats(stats)
+            return SpritifyResult(None, [], [], stats)
+        with stats.timer("duplicates"):
+            sprite_images = self._mergeDuplicates(sprite_images)
+        if self.__conf.trim:
+            with stats.timer("trim"):
+                self._trimImages(sprite_images)
+        with stats.timer("layout"):
+            sheets = None
+            if(not cache is None):
+                placements = cache.placements(options, filenames)
+                if(not placements is None):
+                    sheets = self._placedSheets(sprite_images, placements)
+                elif(self.__conf.stable):
+                    placements = cache.previousPlacements(options, ("spacing",))
+                    if(not placements is None):
+                        layout = self._stableLayout(sprite_images, placements)
+                        if(not layout is None):
+                            sheets = [layout]
+            if(sheets is None):
+                sheets = self._layoutSheets(sprite_images)
+        stats.count("sheets", len(sheets))
+        stats.count("placements", sum(len(list(layout.nodes())) for layout in sheets))
+        if self.__conf.rotate:
+            rotated = sum(1 for layout in sheets for node in layout.nodes() if node.rotated)
+            log.info(str.format("Rotated {0} images to pack them better", rotated))
+            stats.count("rotated", rotated)
+        self._drawSheets(sheets)
+        with stats.timer("write"):
+            (spriteSheets, cssClasses) = self._writeCSS(sheets)
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug(str.format("Classes of the images {0}", cssClasses))
+            if self.__conf.writeHtmlOverview:
+                self._writeHtml(spriteSheets)
+            outputs = self._outputFilenames(sheets)
+            if(not cache is None):
+                placements = []
+                for (sheet, layout) in enumerate(sheets):
+                    for node in layout.nodes():
+                        placements.append((node.item.filename, sheet, node.x, node.y, node.width, node.height, node.rotated))
+                cache.store(options, filenames, placements, outputs)
+                cache.save()
+        stats.count("classes", len(cssClasses))
+        stats.count("outputs", len(outputs))
+        stats.addBytes("outputs", sum(os.path.getsize(f) for f in outputs if os.path.isfile(f)))
+        self._reportStats(stats)
+        return SpritifyResult(sheets, cssClasses, outputs, stats)
 
-if __name__ == '__main__':
+    def _reportStats(self, stats):
+        """
+        Write the stats of a build to the output stream, if configured, as
+        lines of text or as a JSON document on a single line.
+        """
+        if(self.__output is None):
+            return
+        if("text" == self.__conf.stats):
+            for line in stats.summary():
+                self.__output.write(line + "\n")
+        elif("json" == self.__conf.stats):
+            self.__output.write(json.dumps(stats.report(), sort_keys = True) + "\n")
+        self.__output.flush()
+
+    def watch(self):
+        """
+        Generate the sprite and generate it again whenever images in the
+        directory change, until interrupted. Changes are collected until
+        none arrive for the debounce time, so a burst of changes, like a
+        checkout, gives a single build. The image sizes are kept in the
+        build cache and the sprites in memory between builds, so only
+        changed images are read. Changes to the written files are ignored.
+        """
+        result = self.generate()
+        watcher = createWatcher(self.__conf.directory, self.__conf.pollInterval)
+        log.info(str.format("Watching {0} using {1}", self.__conf.directory, watcher.method))
+        ignored = set(result.outputs)
+        if(not self.__conf.cachefilename is None):
+            ignored.add(self.__conf.cachefilename)
+        try:
+            while True:
+                changed = watcher.wait()
+                while True:
+                    more = watcher.wait(self.__conf.debounce / 1000.0)
+                    if(not more):
+                        break
+                    changed.update(more)
+                changed = set(f for f in changed if not (f in ignored or isTemporary(f)))
+                if(not changed):
+                    continue
+                start = time.time()
+                imagefiles = set(self.__conf.imagefiles)
+                self.__conf.scanStarted = start
+                self.__conf.scanSeconds = 0.0
+                if(any((not f in imagefiles) or (not os.path.exists(f)) for f in changed)):
+                    self.__conf.rescan()
+                try:
+                    result = self.generate()
+                    ignored.update(result.outputs)
+                except (SpritifyError, IOError) as error:
+                    log.error(str.format("Error: {0}", getattr(error, "value", error)))
+                log.info(str.format("Built {0} changed files in {1:.3f}s", len(changed), time.time() - start))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+
+
+def spritify(directory, quiet = True, **options):
+    """
+    Spritify the images in the directory, with the options named like the
+    destinations of the command line options, like spritify("icons",
+    sprite = "icons.png", css = "icons.css", layout = "maxrects").
+    The progress, and the stats if configured, are written to stdout unless
+    quiet. The progress is always sent to the spritify logger, which
+    applications can add handlers to, and the stats are always returned.
+    Raises SpritifyError if the options are invalid or spritifying fails.
+    Return: SpritifyResult
+    """
+    return _generate([directory], options, quiet)
+
+
+def _generate(arguments, options, quiet):
+    """
+    Configure and spritify from the list of command line arguments and
+    the options, writing the progress and stats to stdout unless quiet.
+    The level of the logger is restored, in case it was lowered for
+    verbose output.
+    Return: SpritifyResult
+    """
+    conf = SpritifyConfiguration(arguments, **options)
+    if(quiet):
+        return Spritify(conf).generate()
+    level = log.level
+    handler = logOutput(sys.stdout, conf.logLevel)
+    try:
+        return Spritify(conf, sys.stdout).generate()
+    finally:
+        log.removeHandler(handler)
+        log.setLevel(level)
+
+
+def _runJob(job):
+    """
+    Run a batch job, given as a list of command line arguments or a dict with
+    the directory and options of spritify. This runs in a worker process,
+    reused for many jobs, so the progress of the job isn't logged to stdout
+    and errors are returned instead of raised. The sheets of the result are
+    replaced by their sizes, the layouts aren't sent back to the caller.
+    Return: (seconds used, SpritifyResult or None, error message or None)
+    """
+    start = time.time()
+    try:
+        if(isinstance(job, dict)):
+            options = dict((str(name), value) for (name, value) in job.items())
+            result = _generate([options.pop("directory", os.getcwd())], options, True)
+        else:
+            result = _generate([str(argument) for argument in job], {}, True)
+        if(not result.sheets is None):
+            result.sheets = [layout.bounding() for layout in result.sheets]
+        return (time.time() - start, result, None)
+    except SpritifyError as error:
+        return (time.time() - start, None, error.value)
+    except Exception as error:
+        return (time.time() - start, None, str.format("{0}: {1}", type(error).__name__, error))
+
+
+def runBatch(manifest, jobs):
+    """
+    Run the jobs in the JSON manifest file on a pool of processes, reporting
+    the time used by each job. The processes are forked from this process,
+    so PIL and the modules are imported once, and each process runs jobs
+    until all have run.
+    Return: number of failed jobs
+    """
+    try:
+        f = open(manifest, "r")
+        try:
+            work = json.load(f)
+        finally:
+            f.close()
+    except (IOError, ValueError) as error:
+        raise SpritifyError(str.format("Can't read the batch manifest {0}, {1}", manifest, error))
+    if(not isinstance(work, list)):
+        raise SpritifyError(str.format("The batch manifest {0} isn't a list of jobs", manifest))
+    start = time.time()
+    if(1 == jobs or 1 >= len(work)):
+        pool = None
+        results = itertools.imap(_runJob, work)
+    else:
+        pool = multiprocessing.Pool(min(jobs, len(work)))
+        results = pool.imap(_runJob, work)
+    failed = 0
+    try:
+        for (index, (job, (seconds, result, error))) in enumerate(itertools.izip(work, results)):
+            if(not error is None):
+                failed += 1
+                log.error(str.format("Job {0} failed in {1:.3f}s, {2}", index, seconds, error))
+            elif(result.upToDate):
+                log.info(str.format("Job {0} was up to date in {1:.3f}s", index, seconds))
+            else:
+                log.info(str.format("Job {0} wrote {1} files in {2:.3f}s", index, len(result.outputs), seconds))
+    finally:
+        if(not pool is None):
+            pool.close()
+            pool.join()
+    log.info(str.format("Ran {0} jobs in {1:.3f}s, {2} failed", len(work), time.time() - start, failed))
+    return failed
+
+
+def main():
+    """
+    Run spritify from the command line, logging the progress to stdout,
+    or to stderr when the stats are reported as JSON on stdout.
+    """
     conf = SpritifyConfiguration()
-    sprite = Spritify(conf)
-    sprite.generate()
+    if("json" == conf.stats):
+        logOutput(sys.stderr, conf.logLevel)
+    else:
+        logOutput(sys.stdout, conf.logLevel)
+    try:
+        with profiled(conf.profile, conf.traceMemory):
+            if(not conf.batch is None):
+                if(0 < runBatch(conf.batch, conf.jobs)):
+                    sys.exit(1)
+            elif conf.watch:
+                Spritify(conf, sys.stdout).watch()
+            else:
+                sprite = Spritify(conf, sys.stdout)
+                sprite.generate()
+    except SpritifyError as error:
+        print "Error:", error.value
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
 
@@ -0,0 +1,54 @@
+import unittest
+
+from benchrectanglelayout import compareResults
+from benchrectanglelayout import scalingResults
+
+
+class TestCompareResults(unittest.TestCase):
+    def result(self, inserts, efficiency):
+        return {"inserts_per_second" : inserts, "efficiency" : efficiency}
+
+    def test_no_regressions(self):
+        baseline = {"icons-1000/guillotine" : self.result(1000.0, 0.9), "icons-1000/shelf" : self.result(2000.0, 0.8)}
+        results = {"icons-1000/guillotine" : self.result(950.0, 0.9), "icons-1000/shelf" : self.result(3000.0, 0.85)}
+        self.assertEqual([], compareResults(results, baseline, 0.1))
+
+    def test_regressions(self):
+        baseline = {
+            "icons-1000/guillotine" : self.result(1000.0, 0.9),
+            "icons-1000/maxrects" : self.result(500.0, 0.95),
+            "icons-1000/shelf" : self.result(2000.0, 0.8),
+        }
+        results = {
+            "icons-1000/guillotine" : self.result(850.0, 0.9),
+            "icons-1000/maxrects" : None,
+            "icons-1000/shelf" : self.result(2000.0, 0.75),
+        }
+        self.assertEqual([
+            "icons-1000/guillotine: 850 inserts/s, was 1000",
+            "icons-1000/maxrects: timed out",
+            "icons-1000/shelf: efficiency 0.750, was 0.800",
+        ], compareResults(results, baseline, 0.1))
+        self.assertEqual(["icons-1000/maxrects: timed out", "icons-1000/shelf: efficiency 0.750, was 0.800"], compareResults(results, baseline, 0.2))
+
+    def test_new_and_timed_out_before(self):
+        baseline = {"icons-1000/maxrects" : None, "icons-1000/shelf" : self.result(2000.0, 0.8)}
+        results = {"icons-1000/maxrects" : None, "icons-1000/shelf" : None, "icons-1000/guillotine" : self.result(1.0, 0.1), "banners-1000/shelf" : None}
+        self.assertEqual(["icons-1000/shelf: timed out"], compareResults(results, baseline, 0.1))
+
+
+class TestScalingResults(unittest.TestCase):
+    def test_scaling(self):
+        results = {
+            "icons-1000/guillotine" : {"inserts_per_second" : 30000.0},
+            "icons-10000/guillotine" : {"inserts_per_second" : 25000.0},
+            "icons-100000/guillotine" : {"inserts_per_second" : 20000.0},
+            "icons-1000/maxrects" : {"inserts_per_second" : 600.0},
+            "icons-100000/maxrects" : None,
+        }
+        self.assertEqual([("icons/guillotine", 1.5), ("icons/maxrects", None)], scalingResults(results, ["icons"], [100000, 1000, 10000], ["guillotine", "maxrects"]))
+        self.assertEqual([], scalingResults(results, ["icons"], [1000], ["guillotine"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import unittest
+
+import os
+import os.path
+import shutil
+import tempfile
+
+from buildcache import BuildCache
+from buildcache import fileFingerprint
+
+
+class TestBuildCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manifest = os.path.join(self.directory, "cache.json")
+        self.image = os.path.join(self.directory, "icon.png")
+        self.output = os.path.join(self.directory, "sprite.png")
+        self.write(self.image, "icon")
+        self.write(self.output, "sprite")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, filename, content, mtime = 1000):
+        f = open(filename, "w")
+        f.write(content)
+        f.close()
+        os.utime(filename, (mtime, mtime))
+
+
+    def test_lookup_missing(self):
+        cache = BuildCache(self.manifest)
+        self.assertEqual(None, cache.lookup(self.image))
+        self.assertFalse(cache.isKnownImage(self.image))
+
+    def test_lookup_after_save(self):
+        cache = BuildCache(self.manifest)
+        cache.update(self.image, (16, 16))
+        cache.save()
+        cache = BuildCache(self.manifest)
+        self.assertTrue(cache.isKnownImage(self.image))
+        self.assertEqual((16, 16), cache.lookup(self.image))
+
+    def test_lookup_touched_file(self):
+        cache = BuildCache(self.manifest)
+        cache.update(self.image, (16, 16))
+        self.write(self.image, "icon", 2000)
+        self.assertFalse(cache.isKnownImage(self.image))
+        self.assertEqual((16, 16), cache.lookup(self.image))
+        self.assertTrue(cache.isKnownImage(self.image))
+
+    def test_lookup_changed_file(self):
+        cache = BuildCache(self.manifest)
+        cache.update(self.image, (16, 16))
+        self.write(self.image, "other", 2000)
+        self.assertEqual(None, cache.lookup(self.image))
+
+    def test_lookup_fingerprint(self):
+        cache = BuildCache(self.manifest)
+        cache.update(self.image, (16, 16), (1000, 4, "not the content hash"))
+        self.assertTrue(cache.isKnownImage(self.image))
+        self.write(self.image, "icon", 2000)
+        fingerprint = fileFingerprint(self.image)
+        self.assertEqual((2000, 4), fingerprint[:2])
+        self.assertEqual(None, cache.lookup(self.image, fingerprint))
+        cache.update(self.image, (16, 16), fingerprint)
+        self.write(self.image, "icon", 3000)
+        # Only the given fingerprint is compared, the file isn't read again
+        self.assertEqual((16, 16), cache.lookup(self.image, fileFingerprint(self.image)))
+        self.assertEqual(fingerprint[2], cache.contentHash(self.image))
+
+    def test_up_to_date(self):
+        options = {"layout" : "guillotine"}
+        placements = [(self.image, 0, 0, 0, 16, 16, False)]
+        cache = BuildCache(self.manifest)
+        cache.update(self.image, (16, 16))
+        cache.store(options, [self.image], placements, [self.output])
+        cache.save()
+        cache = BuildCache(self.manifest)
+        self.assertTrue(cache.isUpToDate(options, [self.image]))
+        self.assertEqual(placements, cache.placements(options, [self.image]))
+        self.assertFalse(cache.isUpToDate({"layout" : "shelf"}, [self.image]))
+        self.write(self.output, "changed", 2000)
+        self.assertFalse(cache.isUpToDate(options, [self.image]))
+        self.assertEqual(placements, cache.placements(options, [self.image]))
+
+    def test_prune_inputs(self):
+        removed = os.path.join(self.directory, "removed.png")
+        self.write(removed, "removed")
+        cache = BuildCache(self.manifest)
+        cache.update(self.image, (16, 16))
+        cache.update(removed, (8, 8))
+        cache.store({}, [self.image], [], [self.output])
+        cache.save()
+        cache = BuildCache(self.manifest)
+        self.assertTrue(cache.isKnownImage(self.image))
+        self.assertFalse(cache.isKnownImage(removed))
+
+    def test_save(self):
+        umask = os.umask(022)
+        try:
+            cache = BuildCache(self.manifest)
+            cache.update(self.image, (16, 16))
+            cache.save()
+            self.assertEqual(0644, os.stat(self.manifest).st_mode & 0777)
+            os.umask(027)
+            cache.save()
+            self.assertEqual(0640, os.stat(self.manifest).st_mode & 0777)
+            cache.store({"unserializable" : object()}, [self.image], [], [self.output])
+            self.assertRaises(TypeError, cache.save)
+        finally:
+            os.umask(umask)
+        self.assertEqual(["cache.json", "icon.png", "sprite.png"], sorted(os.listdir(self.directory)))
+        self.assertTrue(BuildCache(self.manifest).isKnownImage(self.image))
+
+    def test_unreadable_manifest(self):
+        self.write(self.manifest, "not json")
+        cache = BuildCache(self.manifest)
+        self.assertEqual(None, cache.lookup(self.image))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+from PIL import Image
+
+from compositor import COMPOSITORS
+from compositor import compositorSupported
+from compositor import createCompositor
+
+
+class TestCompositor(unittest.TestCase):
+    def images(self):
+        rgba = Image.new("RGBA", (3, 2), (10, 20, 30, 40))
+        rgb = Image.new("RGB", (2, 2), (50, 60, 70))
+        keyed = Image.new("RGB", (2, 1), (1, 2, 3))
+        keyed.info["transparency"] = (1, 2, 3)
+        grey = Image.new("L", (1, 3), 128)
+        palette = Image.new("RGB", (2, 2), (200, 100, 0)).convert("P")
+        return [(rgba, (0, 0)), (rgb, (3, 0)), (keyed, (0, 2)), (grey, (5, 0)), (palette, (2, 3))]
+
+    def test_compositors_agree(self):
+        drawn = []
+        for name in sorted(COMPOSITORS.keys()):
+            if(not compositorSupported(name)):
+                continue
+            compositor = createCompositor(name, (6, 5))
+            for (image, position) in self.images():
+                compositor.paste(image, position)
+            sprite = compositor.image()
+            self.assertEqual("RGBA", sprite.mode)
+            self.assertEqual((6, 5), sprite.size)
+            drawn.append(sprite.tobytes())
+        self.assertTrue(drawn)
+        for pixels in drawn[1:]:
+            self.assertEqual(drawn[0], pixels)
+
+    def test_pil_pixels(self):
+        compositor = createCompositor("pil", (6, 5))
+        for (image, position) in self.images():
+            compositor.paste(image, position)
+        sprite = compositor.image()
+        self.assertEqual((10, 20, 30, 40), sprite.getpixel((0, 0)))
+        self.assertEqual((50, 60, 70, 255), sprite.getpixel((3, 0)))
+        self.assertEqual(0, sprite.getpixel((0, 2))[3])
+        self.assertEqual((128, 128, 128, 255), sprite.getpixel((5, 2)))
+        self.assertEqual((0, 0, 0, 0), sprite.getpixel((5, 4)))
+
+
+if __name__ == '__main__':
+    unittest.main()
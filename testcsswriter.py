@@ -0,0 +1,62 @@
+import unittest
+
+import gzip
+import os
+import os.path
+import shutil
+import tempfile
+
+from csswriter import CSSWriter
+from csswriter import ClassNames
+from csswriter import cssFilenames
+
+
+class TestClassNames(unittest.TestCase):
+    def test_unique_names(self):
+        names = ClassNames(["sprite"])
+        self.assertEqual("icon", names.add("icon"))
+        self.assertEqual("icon-2", names.add("icon"))
+        self.assertEqual("icon-3", names.add("icon"))
+        self.assertEqual("sprite-2", names.add("sprite"))
+        self.assertEqual(["icon", "icon-2", "icon-3", "sprite-2"], names.names)
+        self.assertTrue("sprite" in names)
+
+
+class TestCSSWriter(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "sprite.css")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self, filename):
+        f = open(filename, "rb")
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+
+    def test_rules(self):
+        css = CSSWriter(self.filename)
+        css.rule([".sprite"], [("background-image", "url(\"sprite.png\")")])
+        css.beginBlock("@media (min-resolution: 192dpi)")
+        css.rule([".a", ".b"], [("width", "16px"), ("height", "16px")])
+        css.endBlock()
+        css.close()
+        self.assertEqual(".sprite {background-image: url(\"sprite.png\");}\n@media (min-resolution: 192dpi) {\n.a, .b {width: 16px; height: 16px;}\n}\n", self.read(self.filename))
+
+    def test_minified_and_compressed(self):
+        css = CSSWriter(self.filename, True, ["gzip"])
+        css.rule([".a", ".b"], [("width", "16px"), ("height", "16px")])
+        css.close()
+        self.assertEqual([self.filename, self.filename[:-4] + ".min.css", self.filename + ".gz", self.filename[:-4] + ".min.css.gz"], cssFilenames(self.filename, True, ["gzip"]))
+        self.assertEqual(".a,.b{width:16px;height:16px}", self.read(self.filename[:-4] + ".min.css"))
+        compressed = gzip.open(self.filename + ".gz")
+        self.assertEqual(self.read(self.filename), compressed.read())
+        compressed.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+
+import json
+import os
+import os.path
+import shutil
+import tempfile
+
+from emitters import EmitterError
+from emitters import SpriteEntry
+from emitters import SpriteSheet
+from emitters import createEmitter
+from emitters import manifest
+
+
+class TestEmitters(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "sprite.css")
+        entries = [
+            SpriteEntry("a", 0, 0, 16, 16),
+            SpriteEntry("b", 16, 0, 16, 16),
+            SpriteEntry("c", 0, 16, 32, 8, (1, 0, 1, 0)),
+        ]
+        self.sheets = [SpriteSheet("sprite", 32, 24, [(1, [("png", "sprite.png")])], entries)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self, filename):
+        f = open(filename, "rb")
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+
+    def test_unknown_emitter(self):
+        self.assertRaises(EmitterError, createEmitter, "unknown", self.filename)
+        self.assertRaises(EmitterError, createEmitter, "nomodule:Emitter", self.filename)
+
+    def test_css(self):
+        createEmitter("css", self.filename).emit(self.sheets)
+        css = self.read(self.filename).splitlines()
+        self.assertEqual(".sprite {background-image: url(\"sprite.png\");}", css[0])
+        self.assertEqual(".b {width: 16px; height: 16px; background-position: -16px 0px;}", css[2])
+        self.assertEqual(".c {width: 32px; height: 8px; padding: 1px 0px 1px 0px; box-sizing: content-box; background-origin: content-box; background-clip: content-box; background-position: 0px -16px;}", css[3])
+
+    def test_compact_css(self):
+        createEmitter("compact", self.filename).emit(self.sheets)
+        css = self.read(self.filename).splitlines()
+        self.assertTrue("--sprite-w: 16px; --sprite-h: 16px;" in css[0])
+        self.assertEqual(".b {--sprite-xy: -16px 0px;}", css[2])
+        self.assertEqual(".c {--sprite-xy: 0px -16px; --sprite-w: 32px; --sprite-h: 8px; --sprite-pad: 1px 0px 1px 0px;}", css[3])
+
+    def test_json_manifest(self):
+        emitter = createEmitter("json", self.filename)
+        self.assertEqual([os.path.join(self.directory, "sprite.json")], emitter.filenames())
+        emitter.emit(self.sheets)
+        written = json.loads(self.read(emitter.filename))
+        self.assertEqual(json.loads(json.dumps(manifest(self.sheets))), written)
+        self.assertEqual({"sheet" : 0, "x" : 16, "y" : 0, "width" : 16, "height" : 16}, written["images"]["b"])
+        self.assertEqual([1, 0, 1, 0], written["images"]["c"]["padding"])
+
+    def test_rotated(self):
+        self.sheets[0].entries.append(SpriteEntry("d", 16, 16, 8, 16, None, True))
+        createEmitter("css", self.filename).emit(self.sheets)
+        css = self.read(self.filename)
+        self.assertFalse(".d " in css)
+        written = manifest(self.sheets)
+        self.assertEqual(True, written["images"]["d"]["rotated"])
+        self.assertEqual((8, 16), (written["images"]["d"]["width"], written["images"]["d"]["height"]))
+        self.assertFalse("rotated" in written["images"]["b"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+
+import json
+import logging
+import os
+import os.path
+import pstats
+import tempfile
+import time
+from StringIO import StringIO
+
+from instrumentation import Stats
+from instrumentation import log
+from instrumentation import logOutput
+from instrumentation import profiled
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.level = log.level
+
+    def tearDown(self):
+        log.setLevel(self.level)
+
+    def test_stats(self):
+        stats = Stats()
+        with stats.timer("layout"):
+            pass
+        stats.addDuration("encode", 0.5)
+        stats.addDuration("encode", 0.25)
+        stats.count("images", 3)
+        stats.count("images")
+        stats.addBytes("sprites", 100)
+        report = json.loads(json.dumps(stats.report()))
+        self.assertEqual(0.75, report["durations"]["encode"])
+        self.assertTrue(0.0 <= report["durations"]["layout"])
+        self.assertEqual({"images" : 4}, report["counts"])
+        self.assertEqual({"sprites" : 100}, report["bytes"])
+        summary = stats.summary()
+        self.assertTrue(summary[0].startswith("layout"))
+        self.assertTrue(summary[1].startswith("encode"))
+        started = time.time() - 10.0
+        self.assertEqual(started, Stats(started).started)
+        self.assertTrue(10.0 <= Stats(started).report()["seconds"])
+
+    def test_log_output(self):
+        stream = StringIO()
+        handler = logOutput(stream)
+        try:
+            log.setLevel(logging.INFO)
+            log.info("shown")
+            log.debug("hidden")
+            self.assertFalse(log.isEnabledFor(logging.DEBUG))
+        finally:
+            log.removeHandler(handler)
+        log.info("not written")
+        self.assertEqual("shown\n", stream.getvalue())
+
+    def test_profiled(self):
+        (fd, filename) = tempfile.mkstemp(suffix = ".prof")
+        os.close(fd)
+        try:
+            with profiled(filename):
+                sorted(range(100))
+            self.assertTrue(0 < pstats.Stats(filename).total_calls)
+        finally:
+            os.remove(filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
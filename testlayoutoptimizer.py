@@ -0,0 +1,55 @@
+import unittest
+
+import sys
+
+from layoutoptimizer import candidateWidths
+from layoutoptimizer import candidates
+from layoutoptimizer import layoutCandidate
+from layoutoptimizer import optimizeLayout
+
+
+class TestLayoutOptimizer(unittest.TestCase):
+    def setUp(self):
+        self.sizes = [(320, 600)] + [(16, 16)] * 200 + [(32, 32)] * 50
+
+    def test_candidates_are_seeded(self):
+        first = [(candidate.description, candidate.order) for candidate in candidates(self.sizes, 1, 60)]
+        second = [(candidate.description, candidate.order) for candidate in candidates(self.sizes, 1, 60)]
+        other = [(candidate.description, candidate.order) for candidate in candidates(self.sizes, 2, 60)]
+        self.assertEqual(60, len(first))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertEqual("default", first[0][0])
+
+    def test_default_candidate(self):
+        default = candidates(self.sizes).next()
+        self.assertEqual((sys.maxint, 600), (default.width, default.height))
+        self.assertEqual(0, default.order[0])
+
+    def test_candidate_widths(self):
+        widths = candidateWidths(self.sizes)
+        self.assertEqual(320, widths[0])
+        self.assertTrue(all(320 <= width for width in widths))
+
+    def test_optimize_beats_default(self):
+        (candidate, (area, side), default, scored) = optimizeLayout("skyline", self.sizes, 48)
+        self.assertEqual(48, scored)
+        self.assertTrue(area < default[0])
+        (width, height) = layoutCandidate("skyline", self.sizes, candidate).bounding()
+        self.assertEqual(area, width * height)
+
+    def test_optimize_exhausted_budget(self):
+        (candidate, score, default, scored) = optimizeLayout("shelf", self.sizes, timeBudget = 0.0)
+        self.assertEqual(1, scored)
+        self.assertEqual("default", candidate.description)
+        self.assertEqual(default, score)
+
+    def test_optimize_deterministic(self):
+        first = optimizeLayout("maxrects", self.sizes, 40, 3)
+        second = optimizeLayout("maxrects", self.sizes, 40, 3, 2)
+        self.assertEqual((first[0].description, first[0].order), (second[0].description, second[0].order))
+        self.assertEqual(first[1:], second[1:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,18 @@
 import unittest
 
+import random
 import sys
 
+from rectanglelayout import FreeSpaceIndex
+from rectanglelayout import LAYOUTS
 from rectanglelayout import Layout
+from rectanglelayout import MaxRectsLayout
+from rectanglelayout import Node
+from rectanglelayout import PlacementLayout
 from rectanglelayout import RectangleLayoutError
+from rectanglelayout import SpacedLayout
+from rectanglelayout import Spacing
+from rectanglelayout import createLayout
 
 class TestLayout(unittest.TestCase):
     def setUp(self):
@@ -44,6 +53,213 @@ class TestLayout(unittest.TestCase):
             node_count = node_count + 1
         self.assertEqual(14, node_count)
 
+    def test_layout_first_fit_reuses_free_space(self):
+        layout = Layout(10, sys.maxint)
+        layout.insert(10, 4, 1)
+        layout.insert(6, 4, 2)
+        layout.insert(10, 2, 3)
+        layout.insert(4, 4, 4)
+        placements = [(node.item, node.x, node.y) for node in layout.nodes()]
+        self.assertEqual([(1, 0, 0), (2, 0, 4), (3, 0, 8), (4, 6, 4)], placements)
+
+    def test_layout_deep_tree(self):
+        layout = Layout(16, sys.maxint)
+        for item in range(1500):
+            layout.insert(16, 16, item)
+        last = list(layout.nodes())[-1]
+        self.assertEqual(1499, last.item)
+        self.assertEqual(0, last.x)
+        self.assertEqual(1499 * 16, last.y)
+        layout.prune()
+        self.assertEqual((16, 1500 * 16), layout.bounding())
+
+    def test_free_space_index_first_fit(self):
+        # Small blocks, so the blocks split and empty often
+        class SmallBlocksIndex(FreeSpaceIndex):
+            BLOCK_SIZE = 4
+        rnd = random.Random(0)
+        free = [Node(0, 0, rnd.randint(1, 1024), rnd.randint(1, 1024)) for item in range(40)]
+        index = SmallBlocksIndex(free)
+        for item in range(400):
+            (width, height) = (rnd.randint(1, 48), rnd.randint(1, 48))
+            fits = [node for node in free if width <= node.width and height <= node.height]
+            node = index.first(width, height)
+            self.assertEqual((fits or [None])[0], node)
+            # Free space left beside and below the rectangle, some of it
+            # slivers that are wide or high but not both, or none at all
+            split = [Node(0, 0, node.width - width, rnd.randint(1, node.height)), Node(0, 0, rnd.randint(1, node.width), node.height - height)]
+            split = [child for child in split if 0 < child.width and 0 < child.height][:rnd.choice((0, 1, 2, 2, 2))]
+            index.replace(node, split)
+            position = free.index(node)
+            free[position:position + 1] = split
+        self.assertEqual(None, index.first(1025, 1))
+        # Take all the free space, emptying every block
+        while(free):
+            node = index.first(1, 1)
+            self.assertEqual(free.pop(0), node)
+            index.replace(node, [])
+        self.assertEqual(None, index.first(1, 1))
+
+
+class TestLayoutAlgorithms(unittest.TestCase):
+    RECTANGLES = [(12, 2), (10, 4), (10, 2), (8, 4), (8, 4), (6, 2), (6, 4),
+                  (4, 2), (4, 2), (2, 2), (2, 2), (2, 2), (2, 2), (2, 2)]
+
+    def assertValidLayout(self, layout, width, height, count):
+        nodes = list(layout.nodes())
+        self.assertEqual(count, len(nodes))
+        for node in nodes:
+            self.assertTrue(0 <= node.x and node.x + node.width <= width)
+            self.assertTrue(0 <= node.y and node.y + node.height <= height)
+        for (index, node) in enumerate(nodes):
+            for other in nodes[index + 1:]:
+                overlap = (node.x < other.x + other.width and other.x < node.x + node.width and
+                           node.y < other.y + other.height and other.y < node.y + node.height)
+                self.assertFalse(overlap, str.format("{0} overlaps {1}", node, other))
+
+    def test_unknown_algorithm(self):
+        self.assertRaises(RectangleLayoutError, createLayout, "unknown", 10, 10)
+
+    def test_algorithms_raise_out_of_space(self):
+        for algorithm in LAYOUTS:
+            layout = createLayout(algorithm, 10, 10)
+            self.assertRaises(RectangleLayoutError, layout.insert, 12, 12, "fail")
+
+    def test_algorithms_locked_width(self):
+        for algorithm in LAYOUTS:
+            layout = createLayout(algorithm, 12, sys.maxint)
+            for (item, (width, height)) in enumerate(self.RECTANGLES):
+                layout.insert(width, height, item)
+            layout.prune()
+            self.assertValidLayout(layout, 12, sys.maxint, len(self.RECTANGLES))
+            self.assertEqual(12, layout.bounding()[0])
+
+    def test_algorithms_locked_height(self):
+        for algorithm in LAYOUTS:
+            layout = createLayout(algorithm, sys.maxint, 12)
+            for (item, (height, width)) in enumerate(self.RECTANGLES):
+                layout.insert(width, height, item)
+            layout.prune()
+            self.assertValidLayout(layout, sys.maxint, 12, len(self.RECTANGLES))
+            self.assertEqual(12, layout.bounding()[1])
+
+    def test_algorithms_rotate(self):
+        sizes = [(14, 2)] + [(height, width) for (width, height) in self.RECTANGLES]
+        for algorithm in LAYOUTS:
+            layout = createLayout(algorithm, 12, sys.maxint, True)
+            for (item, (width, height)) in enumerate(sizes):
+                layout.insert(width, height, item)
+            layout.prune()
+            self.assertValidLayout(layout, 12, sys.maxint, len(sizes))
+            for node in layout.nodes():
+                (width, height) = sizes[node.item]
+                if(node.rotated):
+                    (width, height) = (height, width)
+                self.assertEqual((width, height), (node.width, node.height))
+            self.assertTrue(layout.nodes().next().rotated, algorithm)
+
+    def test_algorithms_no_rotate(self):
+        for algorithm in LAYOUTS:
+            layout = createLayout(algorithm, 12, sys.maxint)
+            self.assertRaises(RectangleLayoutError, layout.insert, 14, 2, "fail")
+            layout.insert(2, 12, 1)
+            self.assertFalse(layout.nodes().next().rotated)
+
+    def test_maxrects_denser_than_guillotine(self):
+        bounding = {}
+        for algorithm in ("guillotine", "maxrects"):
+            layout = createLayout(algorithm, 12, sys.maxint)
+            for (item, (width, height)) in enumerate(self.RECTANGLES):
+                layout.insert(width, height, item)
+            layout.prune()
+            bounding[algorithm] = layout.bounding()
+        self.assertEqual((12, 22), bounding["guillotine"])
+        self.assertEqual((12, 20), bounding["maxrects"])
+
+    def test_placement_layout(self):
+        layout = PlacementLayout(sys.maxint, sys.maxint)
+        layout.place(4, 2, 3, 5, 1)
+        self.assertEqual((7, 7), layout.bounding())
+        self.assertRaises(RectangleLayoutError, layout.insert, 2, 2, 2)
+
+    def test_maxrects_place_seeds(self):
+        layout = createLayout("maxrects", 12, sys.maxint)
+        layout.place(0, 0, 12, 2, 1)
+        layout.place(0, 6, 12, 2, 2)
+        layout.insert(12, 4, 3)
+        layout.insert(12, 2, 4)
+        placements = [(node.item, node.x, node.y) for node in layout.nodes()]
+        self.assertEqual([(1, 0, 0), (2, 0, 6), (3, 0, 2), (4, 0, 8)], placements)
+        self.assertRaises(RectangleLayoutError, layout.place, 0, 1, 2, 2, 5)
+        self.assertRaises(RectangleLayoutError, layout.place, 11, 10, 2, 2, 5)
+
+    def test_maxrects_free(self):
+        layout = MaxRectsLayout(12, sys.maxint, False, [(0, 2, 12, 4), (0, 8, 12, sys.maxint)])
+        layout.place(0, 0, 12, 2, 1)
+        layout.place(0, 6, 12, 2, 2)
+        layout.insert(12, 2, 3)
+        layout.insert(12, 6, 4)
+        layout.insert(6, 2, 5)
+        placements = [(node.item, node.x, node.y) for node in layout.nodes()]
+        self.assertEqual([(1, 0, 0), (2, 0, 6), (3, 0, 2), (4, 0, 8), (5, 0, 4)], placements)
+        self.assertRaises(RectangleLayoutError, layout.place, 0, 13, 2, 2, 6)
+
+
+class TestSpacedLayout(unittest.TestCase):
+    RECTANGLES = TestLayoutAlgorithms.RECTANGLES
+
+    def test_spacing_cell(self):
+        spacing = Spacing(3, 2, 4)
+        self.assertEqual((20, 8), spacing.cell(10, 1))
+        self.assertEqual(2, spacing.margin)
+        self.assertEqual(4, spacing.offset)
+        self.assertEqual(13, spacing.limit(12))
+        self.assertEqual(sys.maxint, spacing.limit(sys.maxint))
+        self.assertFalse(Spacing().spaced)
+        self.assertEqual((10, 1), Spacing().cell(10, 1))
+
+    def test_algorithms_spaced(self):
+        spacing = Spacing(3, 2, 4)
+        for algorithm in LAYOUTS:
+            layout = SpacedLayout(createLayout(algorithm, spacing.limit(40), sys.maxint), spacing)
+            for (item, (width, height)) in enumerate(self.RECTANGLES):
+                layout.insert(width, height, item)
+            layout.prune()
+            nodes = list(layout.nodes())
+            self.assertEqual(len(self.RECTANGLES), len(nodes))
+            (width, height) = layout.bounding()
+            self.assertTrue(width <= 40)
+            for (index, node) in enumerate(nodes):
+                self.assertEqual((0, 0), (node.x % 4, node.y % 4))
+                self.assertTrue(2 <= node.x and node.x + node.width + 2 <= width)
+                self.assertTrue(2 <= node.y and node.y + node.height + 2 <= height)
+                for other in nodes[index + 1:]:
+                    apart = max(other.x - node.x - node.width, node.x - other.x - other.width,
+                                other.y - node.y - node.height, node.y - other.y - other.height)
+                    self.assertTrue(3 + 2 * 2 <= apart, str.format("{0} is too close to {1}", node, other))
+
+    def test_trailing_padding_outside_bounding(self):
+        layout = SpacedLayout(createLayout("shelf", Spacing(4).limit(20), sys.maxint), Spacing(4))
+        layout.insert(8, 8, 1)
+        layout.insert(8, 8, 2)
+        self.assertEqual([(0, 0), (12, 0)], [(node.x, node.y) for node in layout.nodes()])
+        self.assertEqual((20, 8), layout.bounding())
+
+    def test_power_of_two(self):
+        layout = SpacedLayout(createLayout("guillotine", 12, sys.maxint), Spacing(powerOfTwo = True))
+        for (item, (width, height)) in enumerate(self.RECTANGLES):
+            layout.insert(width, height, item)
+        self.assertEqual((16, 32), layout.bounding())
+
+    def test_spaced_place(self):
+        spacing = Spacing(2, 1, 2)
+        layout = SpacedLayout(PlacementLayout(sys.maxint, sys.maxint), spacing)
+        node = layout.place(2, 6, 4, 4, 1)
+        self.assertEqual((2, 6, 4, 4), (node.x, node.y, node.width, node.height))
+        self.assertEqual((7, 11), layout.bounding())
+        self.assertRaises(RectangleLayoutError, layout.place, 3, 6, 4, 4, 2)
+        self.assertRaises(RectangleLayoutError, layout.place, 0, 6, 4, 4, 2)
+
 
 if __name__ == '__main__':
     unittest.main()
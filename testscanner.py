@@ -0,0 +1,69 @@
+import unittest
+
+import os
+import os.path
+import shutil
+import tempfile
+
+from scanner import DirectoryScanner
+from scanner import sniffImage
+
+
+PNG = "\x89PNG\r\n\x1a\n" + "\0" * 24
+
+
+class TestScanner(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for filename in ["a.png", "notes.txt", "noext", "icons/b.PNG", "icons/c.gif",
+                         "icons/deep/d.jpg", "node_modules/e.png", "z/f.png"]:
+            self.write(filename, PNG)
+        self.write("notes.txt", "not an image")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, filename, content):
+        path = os.path.join(self.directory, filename)
+        if(not os.path.isdir(os.path.dirname(path))):
+            os.makedirs(os.path.dirname(path))
+        f = open(path, "wb")
+        f.write(content)
+        f.close()
+
+    def relative(self, images):
+        return sorted(os.path.relpath(image, self.directory).replace(os.sep, "/") for image in images)
+
+    def test_extension_filter(self):
+        images = DirectoryScanner(sniff = False).scan(self.directory)
+        self.assertEqual(["a.png", "icons/b.PNG", "icons/c.gif", "icons/deep/d.jpg", "node_modules/e.png", "z/f.png"], self.relative(images))
+
+    def test_sniff(self):
+        images = DirectoryScanner().scan(self.directory)
+        self.assertTrue(os.path.join(self.directory, "noext") in images)
+        self.assertFalse(os.path.join(self.directory, "notes.txt") in images)
+
+    def test_sniff_known(self):
+        noext = os.path.join(self.directory, "noext")
+        self.write("noext", "not an image")
+        images = DirectoryScanner(sniff = True).scan(self.directory, lambda filename: filename == noext)
+        self.assertTrue(noext in images)
+
+    def test_include_exclude(self):
+        scanner = DirectoryScanner(include = ["*.png", "icons/*"], exclude = ["node_modules", "icons/deep/*"])
+        self.assertEqual(["a.png", "icons/b.PNG", "icons/c.gif", "z/f.png"], self.relative(scanner.scan(self.directory)))
+
+    def test_walk_order(self):
+        expected = []
+        for root, dirs, files in os.walk(self.directory):
+            expected.extend(os.path.join(root, filename) for filename in files if not filename in ("notes.txt", "noext"))
+        self.assertEqual(expected, DirectoryScanner(sniff = False).scan(self.directory))
+        self.assertEqual(expected, DirectoryScanner(sniff = True, exclude = ["notes.txt", "noext"], workers = 4).scan(self.directory))
+
+    def test_sniff_image(self):
+        self.assertEqual("png", sniffImage(os.path.join(self.directory, "a.png")))
+        self.assertEqual(None, sniffImage(os.path.join(self.directory, "missing.png")))
+
+
+if __name__ == '__main__':
+    unittest.main()
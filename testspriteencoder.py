@@ -0,0 +1,80 @@
+import unittest
+
+import os
+import os.path
+import shutil
+import tempfile
+
+from PIL import Image
+
+import spriteencoder
+from spriteencoder import PNGStreamWriter
+from spriteencoder import SpriteEncoder
+from spriteencoder import reducePalette
+from spriteencoder import writeBandedPNG
+
+
+class TestSpriteEncoder(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "sprite.png")
+        self.image = Image.new("RGBA", (5, 7))
+        for y in xrange(7):
+            for x in xrange(5):
+                self.image.putpixel((x, y), (x * 50, y * 30, 7, x * y))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_stream_png(self):
+        writer = PNGStreamWriter(self.filename, (5, 7), 6, chunkSize = 8)
+        for top in (0, 3, 6):
+            writer.write(self.image.crop((0, top, 5, min(7, top + 3))))
+        written = writer.close()
+        self.assertEqual(os.path.getsize(self.filename), written)
+        self.assertEqual(self.image.tobytes(), Image.open(self.filename).tobytes())
+
+    def test_stream_png_incomplete(self):
+        writer = PNGStreamWriter(self.filename, (5, 7), 6)
+        self.assertRaises(ValueError, writer.write, Image.new("RGBA", (4, 1)))
+        writer.write(self.image.crop((0, 0, 5, 3)))
+        self.assertRaises(ValueError, writer.close)
+        self.assertEqual([], os.listdir(self.directory))
+
+    def test_encode_formats(self):
+        encoded = SpriteEncoder("fast").encode(self.image, self.filename)
+        self.assertEqual([(self.filename, "png", "RGBA")], [entry[:3] for entry in encoded])
+        self.assertEqual(self.image.tobytes(), Image.open(self.filename).tobytes())
+
+    def test_reduce_palette(self):
+        numpy = spriteencoder.numpy
+        try:
+            for module in set([numpy, None]):
+                spriteencoder.numpy = module
+                reduced = reducePalette(self.image)
+                self.assertEqual("P", reduced.mode)
+                self.assertEqual(self.image.tobytes(), reduced.convert("RGBA").tobytes())
+        finally:
+            spriteencoder.numpy = numpy
+        colorful = Image.new("RGBA", (17, 16))
+        colorful.putdata([(index, 0, 0, 255 - index // 2) for index in xrange(17 * 16)])
+        self.assertEqual(None, reducePalette(colorful))
+
+    def test_encode_palette(self):
+        for threads in (1, 3):
+            encoded = SpriteEncoder("fast", True, threads).encode(self.image, self.filename)
+            self.assertEqual("P", encoded[0][2])
+            written = Image.open(self.filename)
+            self.assertEqual("P", written.mode)
+            self.assertEqual(self.image.tobytes(), written.convert("RGBA").tobytes())
+
+    def test_banded_png(self):
+        for threads in (1, 3, 10):
+            writeBandedPNG(self.image, self.filename, 6, threads)
+            self.assertEqual(self.image.tobytes(), Image.open(self.filename).tobytes())
+        writeBandedPNG(reducePalette(self.image), self.filename, 9, 2)
+        self.assertEqual(self.image.tobytes(), Image.open(self.filename).convert("RGBA").tobytes())
+
+
+if __name__ == '__main__':
+    unittest.main()
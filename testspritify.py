@@ -0,0 +1,638 @@
+import unittest
+
+import json
+import logging
+import os
+import os.path
+import random
+import shutil
+import sys
+import tempfile
+import threading
+from StringIO import StringIO
+
+from PIL import Image
+
+import buildcache
+import spritify as spritifymodule
+from instrumentation import log
+from spriteencoder import SpriteEncoder
+from spriteencoder import formatSupported
+from spritify import SpritifyConfiguration
+from spritify import SpritifyError
+from spritify import _runJob
+from spritify import _streamSheet
+from spritify import runBatch
+from spritify import spritify
+from watcher import PollingWatcher
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test")
+
+
+class SpritifyTestCase(unittest.TestCase):
+    def setUp(self):
+        # Work in the temporary directory, where the overview is written
+        self.directory = tempfile.mkdtemp()
+        self.sprite = os.path.join(self.directory, "sprite.png")
+        self.css = os.path.join(self.directory, "sprite.css")
+        self.cwd = os.getcwd()
+        os.chdir(self.directory)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def writeImage(self, name, size, mode = "RGBA"):
+        # Random pixels, so any misplaced pixel shows
+        filename = os.path.join(self.directory, "images", name)
+        if(not os.path.isdir(os.path.dirname(filename))):
+            os.makedirs(os.path.dirname(filename))
+        rnd = random.Random(name)
+        image = Image.new("RGBA", size)
+        image.putdata([tuple(rnd.randrange(256) for band in xrange(3)) + (255,) for pixel in xrange(size[0] * size[1])])
+        image.convert(mode).save(filename)
+        return filename
+
+    def writeImages(self):
+        self.writeImage("banner.png", (120, 12))
+        for index in xrange(6):
+            self.writeImage(str.format("tall{0}.png", index), (8 + index, 40 - 3 * index))
+        for index in xrange(6):
+            self.writeImage(str.format("icon{0}.png", index), (16, 16), ("RGBA", "RGB", "P")[index % 3])
+        return os.path.join(self.directory, "images")
+
+    def build(self, source = "img_set_2", **options):
+        options.setdefault("jobs", 1)
+        return spritify(os.path.join(FIXTURES, source), sprite = self.sprite, css = self.css, **options)
+
+    def read(self, filename):
+        f = open(filename, "rb")
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def assertDrawn(self, layout, filename):
+        sprite = Image.open(filename)
+        self.assertEqual(layout.bounding(), sprite.size)
+        for node in layout.nodes():
+            drawn = sprite.crop((node.x, node.y, node.x + node.width, node.y + node.height))
+            if(node.rotated):
+                drawn = drawn.transpose(Image.ROTATE_90)
+            image = node.item.open()
+            self.assertEqual(image.convert("RGBA").tobytes(), drawn.tobytes(), node.item.filename)
+            image.close()
+
+
+class TestProbe(SpritifyTestCase):
+    def writeBroken(self, names):
+        for name in names:
+            f = open(os.path.join(self.directory, "images", name), "w")
+            f.write("not an image")
+            f.close()
+
+    def test_probe_order(self):
+        images = self.writeImages()
+        self.writeBroken(["broken0.png", "broken1.png"])
+        conf = SpritifyConfiguration([images], workers = 8)
+        probed = spritifymodule.Spritify(conf)._probeImages(conf.imagefiles)
+        self.assertEqual(conf.imagefiles, [f for (f, size, error) in probed])
+        broken = sorted(os.path.basename(f) for (f, size, error) in probed if not error is None)
+        self.assertEqual(["broken0.png", "broken1.png"], broken)
+        sizes = [size for (f, size, error) in spritifymodule.Spritify(SpritifyConfiguration([images], workers = 1))._probeImages(conf.imagefiles)]
+        self.assertEqual(sizes, [size for (f, size, error) in probed])
+        self.build(images, workers = 1)
+        (sprite, css) = (self.read(self.sprite), self.read(self.css))
+        self.build(images, workers = 8)
+        self.assertEqual(sprite, self.read(self.sprite))
+        self.assertEqual(css, self.read(self.css))
+
+    def test_hash_on_probe_threads(self):
+        images = self.writeImages()
+        cache = os.path.join(self.directory, "cache.json")
+        threads = []
+        fileHash = buildcache.fileHash
+        def recordingHash(filename):
+            threads.append(threading.current_thread())
+            return fileHash(filename)
+        buildcache.fileHash = recordingHash
+        try:
+            self.build(images, cache = cache, workers = 4)
+            self.assertEqual(13, len(threads))
+            # Touched files are hashed again, to compare the content
+            for name in ("icon0.png", "icon1.png"):
+                os.utime(os.path.join(images, name), (1000, 1000))
+            self.build(images, cache = cache, workers = 4, layout = "shelf")
+        finally:
+            buildcache.fileHash = fileHash
+        self.assertEqual(15, len(threads))
+        self.assertFalse(threading.current_thread() in threads)
+
+    def test_stop_and_skip(self):
+        images = self.writeImages()
+        names = [str.format("broken{0}.png", index) for index in xrange(6)]
+        self.writeBroken(names)
+        conf = SpritifyConfiguration([images], workers = 8)
+        first = [os.path.basename(f) for f in conf.imagefiles if os.path.basename(f) in names][0]
+        try:
+            self.build(images, workers = 8, stop = True)
+            self.fail("No SpritifyError for the broken images")
+        except SpritifyError as error:
+            self.assertTrue(str.format("{0}]", first) in error.value, error.value)
+        warnings = []
+        handler = logging.Handler(logging.WARNING)
+        handler.emit = lambda record: warnings.append(record.getMessage())
+        log.addHandler(handler)
+        try:
+            result = self.build(images, workers = 8)
+        finally:
+            log.removeHandler(handler)
+        self.assertEqual(6, result.stats.counts["skipped"])
+        self.assertEqual(13, len(result.classes))
+        skipped = [os.path.basename(f) for f in conf.imagefiles if os.path.basename(f) in names]
+        self.assertEqual([str.format("Skipping file [{0}]", os.path.join(images, name)) for name in skipped], [warning.split(",")[0] for warning in warnings])
+
+
+class TestDecodeProcesses(SpritifyTestCase):
+    def test_decode_processes(self):
+        images = self.writeImages()
+        framed = Image.new("RGBA", (20, 20))
+        framed.paste(Image.open(os.path.join(images, "icon1.png")).crop((0, 0, 10, 8)), (4, 6))
+        framed.save(os.path.join(images, "framed.png"))
+        self.writeImage("wide.png", (30, 10), "P")
+        for options in (dict(), dict(trim = True, extrude = 1, rotate = True, layout = "maxrects")):
+            outputs = []
+            for decodeProcesses in (0, 3):
+                result = self.build(images, decodeProcesses = decodeProcesses, **options)
+                outputs.append([self.read(f) for f in result.outputs])
+            self.assertEqual(outputs[0], outputs[1])
+
+
+class TestDuplicates(SpritifyTestCase):
+    def positions(self):
+        # Position and size of every class in the CSS
+        positions = {}
+        for line in self.read(self.css).splitlines():
+            if("background-position" in line):
+                (name, declarations) = line.split(" {", 1)
+                positions[name[1:]] = declarations
+        return positions
+
+    def test_duplicates(self):
+        images = self.writeImages()
+        shutil.copy(os.path.join(images, "icon0.png"), os.path.join(images, "copy.png"))
+        Image.open(os.path.join(images, "icon0.png")).convert("RGB").save(os.path.join(images, "converted.bmp"))
+        self.writeImage("other.png", (16, 16))
+        expected = {"keep" : [], "file" : ["copy"], "pixels" : ["converted", "copy"]}
+        for (duplicates, aliases) in sorted(expected.items()):
+            result = self.build(images, duplicates = duplicates)
+            nodes = list(result.sheets[0].nodes())
+            self.assertEqual(16 - len(aliases), len(nodes))
+            names = [sorted(os.path.basename(f)[:-4] for f in [node.item.filename] + node.item.aliases) for node in nodes]
+            self.assertTrue(sorted(["icon0"] + aliases) in names, names)
+            positions = self.positions()
+            self.assertEqual(16, len(positions))
+            for alias in aliases:
+                self.assertEqual(positions["icon0"], positions[alias])
+            self.assertNotEqual(positions["icon0"], positions["other"])
+            if(not "converted" in aliases):
+                self.assertNotEqual(positions["icon0"], positions["converted"])
+            self.assertDrawn(result.sheets[0], self.sprite)
+
+
+class TestTrim(SpritifyTestCase):
+    def test_trim(self):
+        images = self.writeImages()
+        framed = Image.new("RGBA", (20, 16))
+        framed.paste(Image.open(os.path.join(images, "icon0.png")).crop((0, 0, 10, 8)), (3, 5))
+        framed.save(os.path.join(images, "framed.png"))
+        Image.new("RGBA", (6, 4)).save(os.path.join(images, "blank.png"))
+        cache = os.path.join(self.directory, "cache.json")
+        for build in xrange(2):
+            result = self.build(images, trim = True, emitters = "css,json", cache = cache, duplicates = "keep")
+            self.assertDrawn(result.sheets[0], self.sprite)
+            nodes = dict((os.path.basename(node.item.filename)[:-4], node) for node in result.sheets[0].nodes())
+            css = self.read(self.css)
+            manifest = json.loads(self.read(os.path.join(self.directory, "sprite.json")))["images"]
+            expected = {"framed" : (10, 8, [5, 7, 3, 3]), "blank" : (1, 1, [0, 5, 3, 0]), "icon1" : (16, 16, None)}
+            for (name, (width, height, padding)) in expected.items():
+                node = nodes[name]
+                self.assertEqual((width, height), (node.width, node.height))
+                image = {"sheet" : 0, "x" : node.x, "y" : node.y, "width" : width, "height" : height}
+                declarations = str.format("width: {0}px; height: {1}px; ", width, height)
+                if(not padding is None):
+                    image["padding"] = padding
+                    declarations += str.format("padding: {0}px {1}px {2}px {3}px; box-sizing: content-box; background-origin: content-box; background-clip: content-box; ", *padding)
+                declarations += str.format("background-position: {0}px {1}px;", 0 - node.x, 0 - node.y)
+                self.assertEqual(image, manifest[name])
+                self.assertTrue(str.format(".{0} {{{1}}}", name, declarations) in css, css)
+            # Trim boxes are reused from the cache by the second build
+            os.remove(self.sprite)
+
+
+class TestFormats(SpritifyTestCase):
+    def test_image_set(self):
+        if(not formatSupported("webp")):
+            self.skipTest("PIL can't write WebP")
+        sets = {
+            "webp" : ["webp", "png"],
+            "webp,png" : ["webp", "png"],
+            "png,webp" : ["png", "webp"],
+        }
+        types = {"png" : "image/png", "webp" : "image/webp"}
+        images = self.writeImages()
+        for (formats, order) in sorted(sets.items()):
+            result = self.build(images, formats = formats, densities = "1,2", emitters = "css,scss")
+            (width, height) = result.sheets[0].bounding()
+            css = self.read(self.css).splitlines()
+            for (line, suffix) in ((css[0], ""), (css[2], "@2x")):
+                candidates = ", ".join(str.format("url(\"sprite{0}.{1}\") type(\"{2}\")", suffix, format, types[format]) for format in order)
+                declarations = str.format("background-image: url(\"sprite{0}.png\"); background-image: image-set({1});", suffix, candidates)
+                self.assertTrue(line.startswith(".sprite {" + declarations), line)
+            self.assertTrue("(url: \"sprite.png\", url-2x: \"sprite@2x.png\"," in self.read(self.css[:-4] + ".scss"))
+            for format in order:
+                image = Image.open(os.path.join(self.directory, "sprite@2x." + format))
+                self.assertEqual(format.upper(), image.format)
+                self.assertEqual((2 * width, 2 * height), image.size)
+
+
+class TestDensities(SpritifyTestCase):
+    def test_densities(self):
+        images = self.writeImages()
+        variant = self.writeImage("icon0@2x.png", (32, 32))
+        mismatched = self.writeImage("icon1@2x.png", (20, 20))
+        result = self.build(images, densities = "1,2")
+        # Variants are drawn in place of the image, not packed as images of their own
+        self.assertEqual(13, len(result.classes))
+        self.assertDrawn(result.sheets[0], self.sprite)
+        (width, height) = result.sheets[0].bounding()
+        sprite = Image.open(os.path.join(self.directory, "sprite@2x.png"))
+        self.assertEqual((2 * width, 2 * height), sprite.size)
+        for node in result.sheets[0].nodes():
+            drawn = sprite.crop((2 * node.x, 2 * node.y, 2 * (node.x + node.width), 2 * (node.y + node.height)))
+            if(node.item.filename == variant[:-7] + ".png"):
+                expected = Image.open(variant).convert("RGBA")
+            else:
+                expected = Image.open(node.item.filename).convert("RGBA").resize((2 * node.width, 2 * node.height), Image.LANCZOS)
+            self.assertEqual(expected.tobytes(), drawn.tobytes(), node.item.filename)
+        # The sheets are drawn by worker processes, so the warning is checked here
+        warnings = []
+        handler = logging.Handler(logging.WARNING)
+        handler.emit = lambda record: warnings.append(record.getMessage())
+        log.addHandler(handler)
+        try:
+            spritifymodule._openImage(mismatched[:-7] + ".png", None, 2, mismatched)
+        finally:
+            log.removeHandler(handler)
+        self.assertEqual([str.format("Image [{0}] is not 2 times the size of [{1}], resampling the image", mismatched, mismatched[:-7] + ".png")], warnings)
+        css = self.read(self.css).splitlines()
+        self.assertEqual(str.format(".sprite {{background-image: url(\"sprite.png\"); background-size: {0}px {1}px;}}", width, height), css[0])
+        self.assertEqual(["@media (-webkit-min-device-pixel-ratio: 2), (min-resolution: 192dpi) {", ".sprite {background-image: url(\"sprite@2x.png\");}", "}"], css[1:4])
+
+
+class TestOptimize(SpritifyTestCase):
+    def test_optimize(self):
+        default = self.build().sheets[0].bounding()
+        result = self.build(optimize = True, candidates = 24)
+        (width, height) = result.sheets[0].bounding()
+        self.assertTrue(width * height < default[0] * default[1])
+        self.assertDrawn(result.sheets[0], self.sprite)
+        sprite = self.read(self.sprite)
+        self.build(optimize = True, candidates = 24, jobs = 2)
+        self.assertEqual(sprite, self.read(self.sprite))
+
+    def test_optimize_spaced_rotated(self):
+        images = self.writeImages()
+        result = self.build(images, optimize = True, candidates = 24, padding = 2, rotate = True, layout = "maxrects", emitters = "json")
+        nodes = list(result.sheets[0].nodes())
+        self.assertTrue(any(node.rotated for node in nodes))
+        for (index, node) in enumerate(nodes):
+            for other in nodes[index + 1:]:
+                apart = max(other.x - node.x - node.width, node.x - other.x - other.width,
+                            other.y - node.y - node.height, node.y - other.y - other.height)
+                self.assertTrue(2 <= apart, str.format("{0} is too close to {1}", node, other))
+        self.assertDrawn(result.sheets[0], self.sprite)
+        manifest = json.loads(self.read(os.path.join(self.directory, "sprite.json")))
+        self.assertEqual(len(nodes), len(manifest["images"]))
+        rotated = sorted(name for (name, image) in manifest["images"].items() if image.get("rotated"))
+        self.assertEqual(sorted(os.path.basename(node.item.filename)[:-4] for node in nodes if node.rotated), rotated)
+
+
+class TestStable(SpritifyTestCase):
+    def positions(self, layout):
+        return dict((os.path.basename(node.item.filename), (node.x, node.y, node.width, node.height)) for node in layout.nodes())
+
+    def test_stable(self):
+        images = self.writeImages()
+        cache = os.path.join(self.directory, "cache.json")
+        before = self.positions(self.build(images, cache = cache, stable = True, padding = 1, layout = "maxrects").sheets[0])
+        os.remove(os.path.join(images, "tall0.png"))
+        self.writeImage("new.png", (6, 30))
+        result = self.build(images, cache = cache, stable = True, padding = 1, layout = "maxrects")
+        after = self.positions(result.sheets[0])
+        (x, y, width, height) = before.pop("tall0.png")
+        self.assertEqual(before, dict((name, after[name]) for name in before))
+        (new_x, new_y, new_width, new_height) = after["new.png"]
+        self.assertTrue(x <= new_x and y <= new_y and new_x + new_width <= x + width and new_y + new_height <= y + height)
+        self.assertDrawn(result.sheets[0], self.sprite)
+        self.assertTrue(".new {" in self.read(self.css))
+
+    def test_stable_extends(self):
+        images = self.writeImages()
+        cache = os.path.join(self.directory, "cache.json")
+        before = self.positions(self.build(images, cache = cache, stable = True, layout = "maxrects").sheets[0])
+        self.writeImage("new.png", (100, 20))
+        result = self.build(images, cache = cache, stable = True, layout = "maxrects", repackThreshold = 1.0)
+        after = self.positions(result.sheets[0])
+        self.assertEqual(before, dict((name, after[name]) for name in before))
+        self.assertEqual(max(y + height for (x, y, width, height) in before.values()), after["new.png"][1])
+        self.assertDrawn(result.sheets[0], self.sprite)
+
+    def test_repack_threshold(self):
+        images = self.writeImages()
+        cache = os.path.join(self.directory, "cache.json")
+        before = self.positions(self.build(images, cache = cache, stable = True).sheets[0])
+        shutil.copy(cache, cache + ".orig")
+        for index in xrange(0, 6, 2):
+            os.remove(os.path.join(images, str.format("tall{0}.png", index)))
+            del before[str.format("tall{0}.png", index)]
+        kept = self.positions(self.build(images, cache = cache, stable = True, repackThreshold = 1.0).sheets[0])
+        self.assertEqual(before, kept)
+        packed = self.positions(self.build(images).sheets[0])
+        self.assertNotEqual(packed, kept)
+        shutil.copy(cache + ".orig", cache)
+        self.assertEqual(packed, self.positions(self.build(images, cache = cache, stable = True, repackThreshold = 0.05).sheets[0]))
+
+
+class TestRotate(SpritifyTestCase):
+    def test_rotate(self):
+        images = self.writeImages()
+        for layout in ("guillotine", "shelf", "skyline", "maxrects"):
+            result = self.build(images, layout = layout, rotate = True, emitters = "css,json", overview = True)
+            nodes = list(result.sheets[0].nodes())
+            self.assertDrawn(result.sheets[0], self.sprite)
+            rotated = [os.path.basename(node.item.filename)[:-4] for node in nodes if node.rotated]
+            if("shelf" != layout):
+                self.assertTrue(rotated, layout)
+            css = self.read(self.css)
+            overview = self.read("overview.html")
+            manifest = json.loads(self.read(os.path.join(self.directory, "sprite.json")))
+            for node in nodes:
+                name = os.path.basename(node.item.filename)[:-4]
+                self.assertEqual(node.rotated, not "." + name + " {" in css)
+                self.assertEqual(node.rotated, not str.format("class=\"sprite {0}\"", name) in overview)
+                self.assertEqual(node.rotated, manifest["images"][name].get("rotated", False))
+
+
+class TestStream(SpritifyTestCase):
+    def pixels(self, filename):
+        return Image.open(filename).convert("RGBA").tobytes()
+
+    def test_stream(self):
+        images = self.writeImages()
+        self.writeImage("large.png", (40, 60), "RGB")
+        options = dict(layout = "maxrects", rotate = True, extrude = 2)
+        layout = self.build(images, **options).sheets[0]
+        drawn = self.pixels(self.sprite)
+        self.build(images, canvas = "stream", canvasMemory = 1, **options)
+        self.assertEqual(drawn, self.pixels(self.sprite))
+        # Bands of 5 rows leave room for a few of the images spanning bands,
+        # the rotated large image is decoded again for every band it's in
+        (width, height) = layout.bounding()
+        placements = [(node.item.filename, node.item.box(), None, node.x, node.y, node.width, node.height, node.rotated) for node in layout.nodes()]
+        streamed = os.path.join(self.directory, "streamed.png")
+        _streamSheet((streamed, (width, height), 1, placements, SpriteEncoder(), 5 * 4 * 4 * width, 2))
+        self.assertEqual(drawn, self.pixels(streamed))
+        _streamSheet((streamed, (width, height), 1, placements, SpriteEncoder(), 1, 2))
+        self.assertEqual(drawn, self.pixels(streamed))
+
+
+class ScriptedWatcher(PollingWatcher):
+    """
+    Polling watcher running the next step of a script, which changes the
+    images, whenever the watch loop waits for the next change. The last
+    step interrupts the loop.
+    """
+    def __init__(self, directory, steps):
+        PollingWatcher.__init__(self, directory, 0.01)
+        self.steps = list(steps)
+
+    def wait(self, timeout = None):
+        if(timeout is None):
+            self.steps.pop(0)()
+        return PollingWatcher.wait(self, timeout)
+
+
+class TestWatch(SpritifyTestCase):
+    def assertBuilt(self, images):
+        # The sprite redrawn when watching matches a sprite drawn from scratch
+        fresh = os.path.join(self.directory, "fresh")
+        if(not os.path.isdir(fresh)):
+            os.mkdir(fresh)
+        result = spritify(images, sprite = os.path.join(fresh, "sprite.png"), css = os.path.join(fresh, "sprite.css"), jobs = 1)
+        self.assertEqual(self.read(os.path.join(fresh, "sprite.css")), self.read(self.css))
+        self.assertDrawn(result.sheets[0], self.sprite)
+        self.built.append(len(result.classes))
+
+    def test_watch(self):
+        images = self.writeImages()
+        icon = os.path.join(images, "icon0.png")
+        def change():
+            self.assertBuilt(images)
+            Image.open(icon).transpose(Image.FLIP_LEFT_RIGHT).save(icon)
+            os.utime(icon, (2000, 2000))
+        def add():
+            self.assertBuilt(images)
+            self.writeImage("new.png", (10, 6))
+        def remove():
+            self.assertBuilt(images)
+            os.remove(os.path.join(images, "tall0.png"))
+        def stop():
+            self.assertBuilt(images)
+            raise KeyboardInterrupt()
+        self.built = []
+        watcher = ScriptedWatcher(images, [change, add, remove, stop])
+        createWatcher = spritifymodule.createWatcher
+        try:
+            spritifymodule.createWatcher = lambda directory, interval: watcher
+            conf = SpritifyConfiguration([images], sprite = self.sprite, css = self.css, watch = True, debounce = 20, jobs = 1)
+            spritifymodule.Spritify(conf).watch()
+        finally:
+            spritifymodule.createWatcher = createWatcher
+        self.assertEqual([13, 13, 14, 13], self.built)
+
+
+class TestSheets(SpritifyTestCase):
+    def names(self, layout):
+        return [os.path.basename(node.item.filename)[:-4] for node in layout.nodes()]
+
+    def test_sheets(self):
+        images = self.writeImages()
+        os.remove(os.path.join(images, "banner.png"))
+        for decodeProcesses in (0, 2):
+            result = self.build(images, maxSize = "48x48", decodeProcesses = decodeProcesses)
+            self.assertTrue(1 < len(result.sheets))
+            self.assertEqual(12, sum(len(self.names(layout)) for layout in result.sheets))
+            css = self.read(self.css)
+            for (index, layout) in enumerate(result.sheets):
+                (width, height) = layout.bounding()
+                self.assertTrue(width <= 48 and height <= 48)
+                sprite = os.path.join(self.directory, str.format("sprite-{0}.png", index))
+                self.assertDrawn(layout, sprite)
+                selectors = ", ".join(["." + str.format("sprite-{0}", index)] + ["." + name for name in self.names(layout)])
+                self.assertTrue(str.format("{0} {{background-image: url(\"sprite-{1}.png\");}}", selectors, index) in css, css)
+
+    def test_group(self):
+        for index in xrange(5):
+            self.writeImage(str.format("a/icon{0}.png", index), (16, 16))
+            self.writeImage(str.format("b/icon{0}.png", index), (16, 16))
+        images = os.path.join(self.directory, "images")
+        sheets = self.build(images, maxSize = "48x48").sheets
+        self.assertEqual(2, len(sheets))
+        self.assertEqual(set(["a", "b"]), set(os.path.basename(os.path.dirname(node.item.filename)) for node in sheets[0].nodes()))
+        sheets = self.build(images, maxSize = "48x48", group = "directory").sheets
+        self.assertEqual(2, len(sheets))
+        for (layout, directory) in zip(sheets, ("a", "b")):
+            self.assertEqual([directory] * 5, [os.path.basename(os.path.dirname(node.item.filename)) for node in layout.nodes()])
+
+    def test_too_large(self):
+        images = self.writeImages()
+        self.assertRaises(SpritifyError, self.build, images, maxSize = "64x64")
+        os.remove(os.path.join(images, "banner.png"))
+        self.assertRaises(SpritifyError, self.build, images, maxSize = "48x32")
+        sheets = self.build(images, maxSize = "48x32", rotate = True).sheets
+        self.assertTrue(all(width <= 48 and height <= 32 for (width, height) in (layout.bounding() for layout in sheets)))
+
+
+class TestLibrary(SpritifyTestCase):
+    def writeManifest(self, jobs):
+        manifest = os.path.join(self.directory, "jobs.json")
+        f = open(manifest, "w")
+        f.write(jobs if isinstance(jobs, str) else json.dumps(jobs))
+        f.close()
+        return manifest
+
+    def test_spritify(self):
+        result = self.build("img_set_1")
+        self.assertEqual(10, len(result.classes))
+        self.assertEqual([self.sprite, self.css], result.outputs)
+        self.assertTrue(all(os.path.isfile(f) for f in result.outputs))
+        self.assertTrue(".plus16x16 {" in self.read(self.css))
+        self.assertFalse(os.path.exists("overview.html"))
+        result = self.build("img_set_1", overview = True)
+        self.assertEqual(os.path.abspath("overview.html"), result.outputs[-1])
+        self.assertTrue("plus16x16" in self.read("overview.html"))
+
+    def test_detect_images(self):
+        images = self.writeImages()
+        os.rename(self.writeImage("logo.png", (10, 10)), os.path.join(images, "logo"))
+        f = open(os.path.join(images, "notes.png"), "w")
+        f.write("not an image")
+        f.close()
+        names = sorted(os.path.basename(node.item.filename) for node in self.build(images).sheets[0].nodes())
+        self.assertTrue("logo" in names)
+        self.assertFalse("notes.png" in names)
+        names = sorted(os.path.basename(node.item.filename) for node in self.build(images, sniff = False).sheets[0].nodes())
+        self.assertFalse("logo" in names)
+        self.assertRaises(SpritifyError, self.build, images, stop = True)
+
+    def test_include_exclude(self):
+        # A single pattern is given as a string, several as a list
+        for (options, count) in ((dict(include = "*.jpg"), 1), (dict(exclude = "*.jpg"), 9), (dict(include = ["*.jpg", "plus*"]), 3), (dict(exclude = [u"*.jpg", u"*16x16.png"]), 5)):
+            result = self.build("img_set_1", **options)
+            self.assertEqual(count, len(result.classes), options)
+        (seconds, result, error) = _runJob({"directory" : os.path.join(FIXTURES, "img_set_1"), "sprite" : self.sprite, "css" : self.css, "include" : u"*.jpg"})
+        self.assertEqual(None, error)
+        self.assertEqual([(980, 282)], result.sheets)
+
+    def test_output(self):
+        (level, handlers, stdout) = (log.level, list(log.handlers), sys.stdout)
+        try:
+            sys.stdout = StringIO()
+            result = self.build("img_set_1", verbose = True, stats = "text")
+            self.assertEqual("", sys.stdout.getvalue())
+            self.assertEqual(10, result.stats.counts["classes"])
+            self.assertEqual(level, log.level)
+            self.build("img_set_1", quiet = False, verbose = True, stats = "json")
+            (progress, report) = sys.stdout.getvalue().rstrip("\n").rsplit("\n", 1)
+            self.assertTrue(" w=16 h=16" in progress, progress)
+            self.assertEqual(10, json.loads(report)["counts"]["classes"])
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(level, log.level)
+        self.assertEqual(handlers, log.handlers)
+
+    def test_stats_total(self):
+        # The configuration scans the directory, which is part of the build
+        conf = SpritifyConfiguration([os.path.join(FIXTURES, "img_set_1")], sprite = self.sprite, css = self.css)
+        result = spritifymodule.Spritify(conf).generate()
+        report = result.stats.report()
+        self.assertEqual(conf.scanStarted, result.stats.started)
+        self.assertEqual(conf.scanSeconds, report["durations"]["scan"])
+        self.assertTrue(sum(report["durations"].values()) <= report["seconds"], report)
+
+    def test_invalid_options(self):
+        directory = os.path.join(FIXTURES, "img_set_1")
+        self.assertRaises(SpritifyError, self.build, layout = "unknown")
+        self.assertRaises(SpritifyError, self.build, unknown = 1)
+        self.assertRaises(SpritifyError, self.build, "missing")
+        self.assertRaises(SpritifyError, SpritifyConfiguration, ["--workers=0", directory])
+        self.assertRaises(SpritifyError, SpritifyConfiguration, ["--no-such-option", directory])
+        self.assertFalse(SpritifyConfiguration([directory]).writeHtmlOverview)
+
+    def test_run_job(self):
+        (seconds, result, error) = _runJob(["-s", self.sprite, "-c", self.css, os.path.join(FIXTURES, "img_set_1")])
+        self.assertEqual(None, error)
+        self.assertEqual([(980, 410)], result.sheets)
+        (seconds, result, error) = _runJob({"directory" : os.path.join(FIXTURES, "missing")})
+        self.assertEqual(None, result)
+        self.assertTrue("is not a directory" in error)
+        (seconds, result, error) = _runJob({"directory" : FIXTURES, "sprite" : None})
+        self.assertEqual(None, result)
+        self.assertEqual("Option sprite takes a string or a number, not None", error)
+
+    def test_override_types(self):
+        errors = [
+            (dict(sprite = None), "Option sprite takes a string or a number, not None"),
+            (dict(maxSize = (48, 48)), "Option maxSize takes a string or a number, not (48, 48)"),
+            (dict(formats = ["png"]), "Option formats takes a string or a number, not ['png']"),
+            (dict(include = 1), "Option include takes a list of values, not 1"),
+            (dict(trim = "yes"), "Option trim takes True or False, not 'yes'"),
+            (dict(padding = 1.5), "option --padding: invalid integer value: '1.5'"),
+            (dict(layout = None), "Option layout takes a string or a number, not None"),
+        ]
+        for (options, message) in errors:
+            try:
+                spritify(os.path.join(FIXTURES, "img_set_1"), **options)
+                self.fail(str.format("No SpritifyError for {0}", options))
+            except SpritifyError as error:
+                self.assertEqual(message, error.value)
+        # Numbers are taken like the command line, and None where there's no default
+        result = self.build("img_set_1", densities = 2, padding = 2, repackThreshold = 1, maxSize = None)
+        self.assertEqual(10, len(result.classes))
+        self.assertTrue(os.path.isfile(os.path.join(self.directory, "sprite@2x.png")))
+
+    def test_batch(self):
+        for jobs in (1, 2):
+            sprites = [os.path.join(self.directory, str.format("{0}-{1}.png", name, jobs)) for name in ("a", "b")]
+            manifest = self.writeManifest([
+                ["-s", sprites[0], "-c", sprites[0][:-4] + ".css", os.path.join(FIXTURES, "img_set_1")],
+                {"directory" : os.path.join(FIXTURES, "img_set_2"), "sprite" : sprites[1], "css" : sprites[1][:-4] + ".css"},
+                {"directory" : os.path.join(FIXTURES, "missing")},
+            ])
+            self.assertEqual(1, runBatch(manifest, jobs))
+            for sprite in sprites:
+                self.assertTrue(os.path.isfile(sprite))
+                self.assertTrue(os.path.isfile(sprite[:-4] + ".css"))
+        self.assertFalse(os.path.exists("overview.html"))
+
+    def test_batch_manifest_errors(self):
+        self.assertRaises(SpritifyError, runBatch, os.path.join(self.directory, "missing.json"), 1)
+        self.assertRaises(SpritifyError, runBatch, self.writeManifest("[not json"), 1)
+        self.assertRaises(SpritifyError, runBatch, self.writeManifest({"jobs" : []}), 1)
+        self.assertEqual(0, runBatch(self.writeManifest([]), 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+
+import os
+import os.path
+import shutil
+import tempfile
+
+from watcher import InotifyWatcher
+from watcher import PollingWatcher
+from watcher import createWatcher
+
+
+class TestWatcher(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.image = os.path.join(self.directory, "icon.png")
+        self.write(self.image, "icon", 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, filename, content, mtime = None):
+        f = open(filename, "w")
+        f.write(content)
+        f.close()
+        if(not mtime is None):
+            os.utime(filename, (mtime, mtime))
+
+    def changes(self, watcher):
+        added = os.path.join(self.directory, "sub", "added.png")
+        os.mkdir(os.path.dirname(added))
+        self.write(added, "added")
+        self.write(self.image, "changed", 2000)
+        changed = set()
+        while(not set([added, self.image]) <= changed):
+            more = watcher.wait(2)
+            self.assertTrue(more)
+            changed.update(more)
+        os.remove(self.image)
+        self.assertTrue(self.image in watcher.wait(2))
+        self.assertEqual(set(), watcher.wait(0.05))
+
+
+    def test_polling(self):
+        watcher = PollingWatcher(self.directory, 0.01)
+        try:
+            self.changes(watcher)
+        finally:
+            watcher.close()
+
+    def test_inotify(self):
+        try:
+            watcher = InotifyWatcher(self.directory)
+        except OSError:
+            return
+        try:
+            self.changes(watcher)
+        finally:
+            watcher.close()
+
+    def test_create_watcher(self):
+        watcher = createWatcher(self.directory, 0.01)
+        try:
+            self.assertTrue(watcher.method in ("inotify", "polling"))
+        finally:
+            watcher.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+__copyright__ = """
+Copyright 2011 James Lindstorff
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import ctypes
+import ctypes.util
+import os
+import os.path
+import select
+import struct
+import sys
+import time
+
+
+class PollingWatcher(object):
+    """
+    Watch a directory tree for changed files by comparing the modification
+    times and sizes of the files in the tree every interval seconds.
+    """
+    method = "polling"
+
+    def __init__(self, directory, interval = 0.5):
+        """
+        Initialize the watcher with the directory to watch and the
+        interval, in seconds, between walks of the directory tree.
+        """
+        self.directory = directory
+        self.interval = interval
+        self._snapshot = self.__walk()
+
+    def __walk(self):
+        """
+        Get the modification time and size of every file in the tree.
+        Return: dict of filename to (mtime, size)
+        """
+        snapshot = {}
+        for root, dirs, files in os.walk(self.directory):
+            for filename in files:
+                absfilename = os.path.join(root, filename)
+                try:
+                    stat = os.stat(absfilename)
+                except OSError:
+                    continue
+                snapshot[absfilename] = (stat.st_mtime, stat.st_size)
+        return snapshot
+
+    def wait(self, timeout = None):
+        """
+        Wait for files to change, at most timeout seconds if a timeout is given.
+        Return: set of the changed, added and removed filenames, empty on timeout
+        """
+        deadline = None
+        if(not timeout is None):
+            deadline = time.time() + timeout
+        while True:
+            if(deadline is None):
+                time.sleep(self.interval)
+            else:
+                time.sleep(max(0.0, min(self.interval, deadline - time.time())))
+            snapshot = self.__walk()
+            changed = set(filename for (filename, stat) in snapshot.items() if stat != self._snapshot.get(filename))
+            changed.update(filename for filename in self._snapshot if not filename in snapshot)
+            self._snapshot = snapshot
+            if(changed or ((not deadline is None) and time.time() >= deadline)):
+                return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """
+    Watch a directory tree for changed files with the Linux inotify API,
+    called through ctypes. Every directory in the tree gets a watch, and
+    directories created in the tree are watched as they are created.
+    """
+    method = "inotify"
+
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self, directory):
+        """
+        Initialize the watcher with the directory to watch.
+        Raises OSError if inotify isn't available.
+        """
+        self.directory = directory
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno = True)
+        if(not hasattr(self._libc, "inotify_init")):
+            raise OSError("inotify isn't available")
+        self._fd = self._libc.inotify_init()
+        if(0 > self._fd):
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        self._paths = {}
+        for root, dirs, files in os.walk(directory):
+            self.__watch(root)
+
+    def __watch(self, directory):
+        """
+        Add a watch for the directory.
+        """
+        wd = self._libc.inotify_add_watch(self._fd, directory, self.MASK)
+        if(0 <= wd):
+            self._paths[wd] = directory
+
+    def wait(self, timeout = None):
+        """
+        Wait for files to change, at most timeout seconds if a timeout is given.
+        If the kernel dropped events the directory itself is returned, meaning
+        any file may have changed.
+        Return: set of the changed, added and removed filenames, empty on timeout
+        """
+        (readable, writable, errors) = select.select([self._fd], [], [], timeout)
+        if(not readable):
+            return set()
+        data = os.read(self._fd, 65536)
+        changed = set()
+        offset = 0
+        while(offset < len(data)):
+            (wd, mask, cookie, length) = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = data[offset:offset + length].rstrip("\0")
+            offset += length
+            if(mask & self.IN_Q_OVERFLOW):
+                changed.add(self.directory)
+                continue
+            if(mask & self.IN_IGNORED):
+                self._paths.pop(wd, None)
+                continue
+            if(not wd in self._paths):
+                continue
+            path = os.path.join(self._paths[wd], name)
+            if(mask & self.IN_ISDIR):
+                if(mask & (self.IN_CREATE | self.IN_MOVED_TO)):
+                    # Files may have been added before the directory got its watch
+                    for root, dirs, files in os.walk(path):
+                        self.__watch(root)
+                        changed.update(os.path.join(root, filename) for filename in files)
+                else:
+                    changed.add(path)
+            else:
+                changed.add(path)
+        return changed
+
+    def close(self):
+        """
+        Close the inotify file descriptor, removing the watches.
+        """
+        os.close(self._fd)
+
+
+def createWatcher(directory, interval = 0.5):
+    """
+    Create a watcher for the directory tree, using inotify where it's
+    available and otherwise polling every interval seconds.
+    """
+    if(sys.platform.startswith("linux")):
+        try:
+            return InotifyWatcher(directory)
+        except OSError:
+            pass
+    return PollingWatcher(directory, interval)